@@ -13,6 +13,14 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 import os
 
+import django
+from django.core.exceptions import ImproperlyConfigured
+
+# The SQLite `transaction_mode` option below and the async views behind
+# `login_required` were added in Django 5.1.
+if django.VERSION < (5, 1):
+    raise ImproperlyConfigured(f"DMS requires Django 5.1 or later; Django {django.get_version()} is installed.")
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the time and queries of the other middleware are counted too.
+    'fileMonitoring.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +89,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Writers take the lock when their transaction starts and queue
+            # for up to `timeout` seconds, instead of failing when two
+            # transactions that began by reading both try to write.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # On disk rather than shared-cache memory, whose table locks fail
+            # concurrent writers outright, so tests can run parallel requests.
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -127,3 +149,145 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Stored files fan out over nested directories named by leading hex digits,
+# one level per entry: (2, 2) gives documents/ab/cd/<file>, 256 x 256 buckets.
+# After changing it run `manage.py shard_media` to move existing files.
+DMS_MEDIA_FANOUT = (2, 2)
+
+# Upload handlers refuse uploads over the user's quota and hash files as they
+# stream in (exposed as uploaded_file.sha256)
+FILE_UPLOAD_HANDLERS = [
+    'fileMonitoring.uploadhandlers.QuotaUploadHandler',
+    'fileMonitoring.uploadhandlers.HashingMemoryFileUploadHandler',
+    'fileMonitoring.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+# Chunk size for per-document integrity manifests (None disables them)
+DMS_CHUNK_MANIFEST_SIZE = 4 * 1024 * 1024
+
+# File hashing engine (see `manage.py benchmark_hashing` before changing)
+# On the reference host (SHA-NI capable) mmap was ~15-25% faster than readinto
+# from 64 MB up and SHA-256 ~2x faster than BLAKE2b. mmap is opt-in: a file
+# truncated while it is mapped kills the process with SIGBUS.
+DMS_HASH_ALGORITHM = 'sha256'  # or 'blake2b'
+DMS_HASH_STRATEGY = 'readinto'  # 'readinto', 'file_digest' or 'mmap'
+DMS_HASH_BUFFER_SIZE = 1024 * 1024
+
+# Rows per page for keyset-paginated document listings
+DMS_PAGE_SIZE = 50
+
+# Background worker pool (text extraction, ...); SYNC runs tasks inline
+DMS_BACKGROUND_WORKERS = 2
+DMS_BACKGROUND_SYNC = False
+
+# Maximum characters of extracted file text kept in the search index
+DMS_SEARCH_MAX_CHARS = 1_000_000
+# Maximum bytes unzipped from an Office/OpenDocument file to extract its text
+DMS_SEARCH_MAX_XML_BYTES = 64 * 1024 * 1024
+
+# Buffered ActivityLog/UsageStat writes; SYNC writes each event immediately
+DMS_LOG_BATCH_SIZE = 500
+DMS_LOG_FLUSH_INTERVAL = 2.0  # seconds
+DMS_LOG_SYNC = False
+# Repeat views of a document by the same user within this many seconds aren't logged
+DMS_VIEW_DEDUP_WINDOW = 600
+DMS_VIEW_DEDUP_SIZE = 10000
+
+# Hand file transfers to the front-end server after the permission checks:
+# None (Django streams the file), 'x-accel-redirect' (nginx, with an internal
+# location at DMS_SENDFILE_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile'.
+DMS_SENDFILE = None
+DMS_SENDFILE_PREFIX = '/protected-media/'
+
+# Resumable chunked uploads (see fileMonitoring/uploads.py). Chunk size
+# defaults to DMS_CHUNK_MANIFEST_SIZE; the upload dir to MEDIA_ROOT/uploads,
+# which must be on the same filesystem as MEDIA_ROOT.
+DMS_UPLOAD_CHUNK_SIZE = None
+DMS_UPLOAD_DIR = None
+DMS_UPLOAD_EXPIRY_HOURS = 24
+DMS_UPLOAD_MAX_SIZE = None  # bytes
+
+# Older versions stored as deltas against the next version (see
+# fileMonitoring/versions.py). Every SNAPSHOT_INTERVAL-th version stays a full
+# copy to bound rebuild chains; deltas are only kept when at most MAX_RATIO
+# of the full size. Deltas are computed only by `manage.py compact_versions`;
+# run it from cron. Rebuilt versions are cached under DMS_CACHE_DIR
+# (MEDIA_ROOT/cache by default).
+DMS_VERSION_DELTAS = True
+DMS_VERSION_SNAPSHOT_INTERVAL = 10
+DMS_VERSION_DELTA_MIN_SIZE = 16 * 1024  # bytes
+DMS_VERSION_DELTA_MAX_SIZE = 64 * 1024 * 1024  # bytes
+DMS_VERSION_DELTA_MAX_RATIO = 0.5
+DMS_VERSION_CACHE_SIZE = 512 * 1024 * 1024  # bytes
+DMS_CACHE_DIR = None
+
+# Compression at rest (see fileMonitoring/compression.py): new files of these
+# types are stored compressed when a sample shrinks by MIN_RATIO or more.
+# 'zlib' decompresses several times faster; 'lzma' saves more on files that
+# are rarely downloaded. Run `manage.py benchmark_compression` to compare.
+DMS_COMPRESSION = False
+DMS_COMPRESSION_TYPES = {
+    '.txt': 'zlib', '.csv': 'zlib', '.tsv': 'zlib', '.json': 'zlib', '.xml': 'zlib', '.html': 'zlib',
+    '.htm': 'zlib', '.md': 'zlib', '.rtf': 'zlib', '.yaml': 'zlib', '.yml': 'zlib', '.svg': 'zlib',
+    '.doc': 'zlib', '.xls': 'zlib', '.ppt': 'zlib', '.bmp': 'zlib', '.tif': 'zlib', '.tiff': 'zlib',
+    '.log': 'lzma', '.sql': 'lzma',
+}
+DMS_COMPRESSION_MIN_SIZE = 4 * 1024  # bytes
+DMS_COMPRESSION_MIN_RATIO = 1.5
+
+# Thumbnails and first-page previews (see fileMonitoring/previews.py), cached
+# under DMS_CACHE_DIR. Requests wait up to TIMEOUT seconds for a render.
+DMS_PREVIEW_CACHE_SIZE = 256 * 1024 * 1024  # bytes
+DMS_PREVIEW_TIMEOUT = 10  # seconds
+
+# Largest selection one bulk operation (fileMonitoring/bulk.py) accepts.
+DMS_BULK_MAX_ITEMS = 5000
+
+# Most files one streamed ZIP export (fileMonitoring/export.py) may hold.
+DMS_EXPORT_MAX_FILES = 10000
+
+# Trashed documents are purged after RETENTION_DAYS (None keeps them) by
+# `manage.py purge_trash`, BATCH_SIZE per transaction; see
+# fileMonitoring/retention.py. Run it, and `manage.py reconcile_media`, from cron.
+DMS_TRASH_RETENTION_DAYS = 30
+DMS_PURGE_BATCH_SIZE = 500
+
+# Default per-user storage quota in bytes (None: unlimited), counting every
+# version and the trash; UserProfile.quota_bytes overrides it per user. See
+# fileMonitoring/accounting.py and `manage.py reconcile_storage`.
+DMS_USER_QUOTA = None
+
+# Cached category/folder trees, folder pickers and shared-document listings
+# (see fileMonitoring/listcache.py), invalidated by versioned keys. The
+# local-memory cache is per process: with several worker processes use the
+# file-based cache instead so invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': BASE_DIR / 'cache',
+    # },
+}
+DMS_LIST_CACHE = 'default'
+DMS_LIST_CACHE_ENABLED = True
+DMS_LIST_CACHE_TIMEOUT = 300  # seconds
+
+# Threads the async views (download, chunk upload, integrity check) use for
+# disk I/O and hashing; see fileMonitoring/aio.py. Serve DMS.asgi with an
+# ASGI server (e.g. uvicorn) so slow clients don't each hold a thread, and
+# compare with `manage.py benchmark_asgi`.
+DMS_ASYNC_IO_WORKERS = 8
+
+# Per-view latency, query and response-size metrics plus timers around
+# hashing, upload writes and log inserts (see fileMonitoring/metrics.py),
+# served in the Prometheus text format at /metrics/ to staff or to requests
+# with "Authorization: Bearer <DMS_METRICS_TOKEN>". Requests slower than
+# DMS_SLOW_REQUEST_SECONDS (None: off) are logged with their SQL to the
+# fileMonitoring.slow_requests logger.
+DMS_METRICS_ENABLED = True
+DMS_METRICS_TOKEN = None
+DMS_SLOW_REQUEST_SECONDS = None
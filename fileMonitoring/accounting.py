@@ -0,0 +1,221 @@
+"""
+Denormalized storage counters and per-user quotas.
+
+Documents carry ``versions_size``, the bytes of all their versions. Each
+user profile counts the bytes and documents the user owns, trash included;
+folders and categories count the live documents in them. The counters are
+moved with ``F()`` updates in the same transaction as the change they
+account for (one UPDATE per model, however many rows a bulk operation
+touches), so reading them is O(1). ``manage.py reconcile_storage``
+recomputes them from the documents and fixes any drift.
+
+A user's quota is ``UserProfile.quota_bytes``, or DMS_USER_QUOTA when that
+is unset (None means unlimited). Uploads are checked against it before
+they are stored and again, exactly, when their rows are written.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import BigIntegerField, Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.template.defaultfilters import filesizeformat
+
+from . import listcache
+from .models import Category, Document, DocumentVersion, Folder, UserProfile
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def default_quota():
+    return getattr(settings, 'DMS_USER_QUOTA', None)
+
+
+# --- Counters ---
+def _adjust(model, key, deltas):
+    """Add ``{key value: (bytes, files)}`` to ``model``'s counters; return how many rows changed."""
+    deltas = {k: d for k, d in deltas.items() if k is not None and d != (0, 0)}
+    if not deltas:
+        return 0
+    if len(deltas) == 1:
+        ((k, (size, files)),) = deltas.items()
+        return model.objects.filter(**{key: k}).update(
+            storage_bytes=F('storage_bytes') + size, file_count=F('file_count') + files,
+        )
+    return model.objects.filter(**{f'{key}__in': list(deltas)}).update(
+        storage_bytes=F('storage_bytes') + Case(
+            *[When(**{key: k}, then=Value(size)) for k, (size, _) in deltas.items()],
+            output_field=BigIntegerField(),
+        ),
+        file_count=F('file_count') + Case(
+            *[When(**{key: k}, then=Value(files)) for k, (_, files) in deltas.items()],
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def _sum(rows, sign):
+    deltas = defaultdict(lambda: (0, 0))
+    for k, size, files in rows:
+        old_size, old_files = deltas[k]
+        deltas[k] = (old_size + sign * size, old_files + sign * files)
+    return deltas
+
+
+def adjust_users(rows, sign=1):
+    """Apply ``(user_id, bytes, files)`` rows, creating any missing profile from scratch."""
+    deltas = {k: d for k, d in _sum(rows, sign).items() if k is not None and d != (0, 0)}
+    if _adjust(UserProfile, 'user_id', deltas) < len(deltas):
+        # Users created outside registration (e.g. createsuperuser) have no
+        # profile yet; count theirs from the documents, so call this after
+        # the change itself is written.
+        missing = set(deltas) - set(UserProfile.objects.filter(user_id__in=deltas).values_list('user_id', flat=True))
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id, role='standard') for user_id in missing])
+        recompute_users(UserProfile.objects.filter(user_id__in=missing))
+
+
+def adjust_folders(rows, sign=1):
+    """Apply ``(folder_id, bytes, files)`` rows to the folders and their categories."""
+    deltas = _sum(rows, sign)
+    deltas = {k: d for k, d in deltas.items() if k is not None and d != (0, 0)}
+    if not deltas:
+        return
+    _adjust(Folder, 'pk', deltas)
+    if len(deltas) == 1:
+        ((folder_id, (size, files)),) = deltas.items()
+        Category.objects.filter(folder=folder_id).update(
+            storage_bytes=F('storage_bytes') + size, file_count=F('file_count') + files,
+        )
+        # The cached folder trees show these counters.
+        listcache.invalidate_tree(Category.objects.filter(folder=folder_id).values_list('created_by', flat=True))
+        return
+    folders = list(Folder.objects.filter(pk__in=deltas).values_list('pk', 'category_id', 'category__created_by'))
+    categories = {pk: category_id for pk, category_id, _ in folders}
+    _adjust(Category, 'pk', _sum(
+        [(categories.get(folder_id), size, files) for folder_id, (size, files) in deltas.items()], 1,
+    ))
+    listcache.invalidate_tree({owner for _, _, owner in folders})
+
+
+# --- Events ---
+def document_added(document):
+    """A new document (with its first version) was created."""
+    adjust_users([(document.uploaded_by_id, document.versions_size, 1)])
+    if not document.is_deleted:
+        adjust_folders([(document.folder_id, document.versions_size, 1)])
+
+
+def version_added(document, size):
+    """``size`` bytes of a new version were added to ``document``."""
+    adjust_users([(document.uploaded_by_id, size, 0)])
+    if not document.is_deleted:
+        adjust_folders([(document.folder_id, size, 0)])
+
+
+def documents_removed(rows):
+    """Documents ``(user_id, folder_id, versions_size, is_deleted)`` were deleted for good."""
+    adjust_users([(user_id, size, 1) for user_id, _, size, _ in rows], sign=-1)
+    adjust_folders([(folder_id, size, 1) for _, folder_id, size, is_deleted in rows if not is_deleted], sign=-1)
+
+
+def documents_trashed(rows, sign=1):
+    """Documents ``(folder_id, versions_size)`` left their folders for the trash (``sign=-1``: restored)."""
+    adjust_folders([(folder_id, size, 1) for folder_id, size in rows], sign=-sign)
+
+
+def documents_moved(rows, target_id):
+    """Live documents ``(folder_id, versions_size)`` moved to folder ``target_id``."""
+    adjust_folders([(folder_id, size, 1) for folder_id, size in rows], sign=-1)
+    adjust_folders([(target_id, size, 1) for _, size in rows])
+
+
+# --- Quotas ---
+def usage(user):
+    """``(bytes used, files, quota or None)`` for ``user`` (a User or its id)."""
+    row = UserProfile.objects.filter(user=user).values_list('storage_bytes', 'file_count', 'quota_bytes').first()
+    if row is None:
+        return 0, 0, default_quota()
+    storage_bytes, file_count, quota = row
+    return storage_bytes, file_count, quota if quota is not None else default_quota()
+
+
+def check_quota(user, size):
+    """Raise QuotaExceeded if ``size`` more bytes would take ``user`` over quota."""
+    used, _, quota = usage(user)
+    if quota is not None and used + size > quota:
+        raise QuotaExceeded(
+            f"This upload needs {filesizeformat(size)} but only "
+            f"{filesizeformat(max(0, quota - used))} of your {filesizeformat(quota)} quota is left."
+        )
+
+
+def enforce_quota(user_id):
+    """
+    Raise QuotaExceeded if ``user_id`` is over quota. Call inside the upload's
+    transaction after its counters were moved, so the error rolls them back.
+    """
+    row = UserProfile.objects.filter(user_id=user_id).values_list('storage_bytes', 'quota_bytes').first()
+    if row is None:
+        return
+    used, quota = row
+    quota = quota if quota is not None else default_quota()
+    if quota is not None and used > quota:
+        raise QuotaExceeded(f"This upload would exceed your {filesizeformat(quota)} quota.")
+
+
+# --- Reconciling ---
+def _totals(documents, group):
+    documents = documents.values(group)
+    return (
+        Coalesce(Subquery(documents.annotate(n=Sum('versions_size')).values('n')), 0),
+        Coalesce(Subquery(documents.annotate(n=Count('id')).values('n')), 0),
+    )
+
+
+def _recompute(queryset, documents, group):
+    storage_bytes, file_count = _totals(documents, group)
+    drifted = queryset.annotate(expected_bytes=storage_bytes, expected_files=file_count).exclude(
+        storage_bytes=F('expected_bytes'), file_count=F('expected_files'),
+    ).count()
+    queryset.update(storage_bytes=storage_bytes, file_count=file_count)
+    return drifted
+
+
+def recompute_documents(documents=None):
+    documents = Document.objects.all() if documents is None else documents
+    sizes = DocumentVersion.objects.filter(document=OuterRef('pk')).values('document') \
+        .annotate(n=Sum('size')).values('n')
+    drifted = documents.annotate(expected=Coalesce(Subquery(sizes), 0)).exclude(versions_size=F('expected')).count()
+    documents.update(versions_size=Coalesce(Subquery(sizes), 0))
+    return drifted
+
+
+def recompute_users(profiles=None):
+    profiles = UserProfile.objects.all() if profiles is None else profiles
+    return _recompute(profiles, Document.objects.filter(uploaded_by=OuterRef('user')), 'uploaded_by')
+
+
+def recompute_folders(folders=None):
+    folders = Folder.objects.all() if folders is None else folders
+    return _recompute(folders, Document.objects.filter(folder=OuterRef('pk'), is_deleted=False), 'folder')
+
+
+def recompute_categories(categories=None):
+    categories = Category.objects.all() if categories is None else categories
+    return _recompute(
+        categories, Document.objects.filter(folder__category=OuterRef('pk'), is_deleted=False), 'folder__category',
+    )
+
+
+def reconcile():
+    """Recompute every counter from the documents; return ``{name: rows that had drifted}``."""
+    missing = User.objects.filter(userprofile__isnull=True).values_list('pk', flat=True)
+    UserProfile.objects.bulk_create([UserProfile(user_id=user_id, role='standard') for user_id in missing])
+    return {
+        'documents': recompute_documents(),
+        'users': recompute_users(),
+        'folders': recompute_folders(),
+        'categories': recompute_categories(),
+    }
@@ -1,22 +1,22 @@
 from django.contrib import admin
 from .models import (
     UserProfile, Category, Folder, Document, DocumentVersion,
-    FileHash, ActivityLog, MonitoredFile, UsageStat
+    FileHash, ActivityLog, MonitoredFile, UsageStat, UsageRollup, Blob, UploadSession
 )
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'role')
+    list_display = ('user', 'role', 'storage_bytes', 'file_count', 'quota_bytes')
     search_fields = ('user__username', 'role')
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_by')
+    list_display = ('name', 'created_by', 'storage_bytes', 'file_count')
     search_fields = ('name',)
 
 @admin.register(Folder)
 class FolderAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'is_locked')
+    list_display = ('name', 'category', 'is_locked', 'storage_bytes', 'file_count')
     list_filter = ('is_locked',)
 
 @admin.register(Document)
@@ -27,11 +27,12 @@ class DocumentAdmin(admin.ModelAdmin):
 
 @admin.register(DocumentVersion)
 class DocumentVersionAdmin(admin.ModelAdmin):
-    list_display = ('document', 'version_number', 'created_at')
+    list_display = ('document', 'version_number', 'size', 'delta_size', 'created_at')
 
 @admin.register(FileHash)
 class FileHashAdmin(admin.ModelAdmin):
-    list_display = ('document', 'hash_value', 'last_checked')
+    list_display = ('document', 'algorithm', 'hash_value', 'last_checked')
+    list_filter = ('algorithm',)
 
 @admin.register(ActivityLog)
 class ActivityLogAdmin(admin.ModelAdmin):
@@ -46,3 +47,18 @@ class MonitoredFileAdmin(admin.ModelAdmin):
 class UsageStatAdmin(admin.ModelAdmin):
     list_display = ('document', 'accessed_by', 'action', 'accessed_at')
     list_filter = ('action',)
+
+@admin.register(UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    list_display = ('document', 'action', 'granularity', 'bucket', 'count')
+    list_filter = ('granularity', 'action')
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'codec', 'stored_size', 'ref_count', 'created_at')
+    list_filter = ('codec',)
+    search_fields = ('sha256',)
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'user', 'size', 'created_at', 'expires_at')
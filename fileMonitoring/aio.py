@@ -0,0 +1,55 @@
+"""
+Blocking file work for the async (ASGI) views.
+
+Disk reads and writes and hashing run in one bounded thread pool
+(DMS_ASYNC_IO_WORKERS threads), so thousands of slow clients share a few
+threads instead of each pinning one: under ASGI a client that is slow to
+send or receive only holds a coroutine, and a thread is taken only while
+a chunk is actually being read, written or hashed.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import compression
+
+CHUNK_SIZE = 64 * 1024
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DMS_ASYNC_IO_WORKERS', 8),
+                thread_name_prefix='dms-io',
+            )
+        return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Run blocking ``func`` in the I/O pool and return its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def read_range(path, start, end):
+    """Yield bytes ``start``..``end`` (inclusive) of ``path``, one pool task per chunk."""
+    f = await run(compression.open_file, path)
+    try:
+        await run(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await run(f.read, min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        await run(f.close)
@@ -0,0 +1,97 @@
+"""
+The pre-aggregated rollups the analytics page reads.
+
+Every UsageStat written by ``eventlog`` also bumps hourly, daily and
+all-time ``UsageRollup`` counters for its (document, action), so totals,
+top-N and time series never scan the raw usage table. Uploads are counted
+the same way from their ActivityLog rows. ``manage.py rebuild_usage_rollups``
+recomputes them from UsageStat and ActivityLog.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import UsageRollup
+
+TOTAL_BUCKET = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# ActivityLog actions that are rolled up alongside the usage actions.
+ROLLUP_ACTIVITIES = ('upload',)
+
+
+def buckets_for(when):
+    """``(granularity, bucket)`` pairs a usage event at ``when`` counts towards."""
+    when = when.astimezone(dt_timezone.utc)
+    hour = when.replace(minute=0, second=0, microsecond=0)
+    return [
+        ('hour', hour),
+        ('day', hour.replace(hour=0)),
+        ('total', TOTAL_BUCKET),
+    ]
+
+
+def apply_to_rollups(events):
+    """Add ``(document_id, owner_id, action, timestamp)`` events to the rollups."""
+    counts = Counter()
+    for document_id, owner_id, action, when in events:
+        for granularity, bucket in buckets_for(when):
+            counts[(document_id, owner_id, action, granularity, bucket)] += 1
+
+    with transaction.atomic():
+        missing = []
+        for (document_id, owner_id, action, granularity, bucket), n in counts.items():
+            key = {'document_id': document_id, 'action': action, 'granularity': granularity, 'bucket': bucket}
+            if not UsageRollup.objects.filter(**key).update(count=F('count') + n):
+                missing.append((key, owner_id, n))
+        if not missing:
+            return
+        # Rows that don't exist yet (e.g. every bucket of a new upload) are
+        # created together.
+        try:
+            with transaction.atomic():
+                UsageRollup.objects.bulk_create([
+                    UsageRollup(owner_id=owner_id, count=n, **key) for key, owner_id, n in missing
+                ])
+        except IntegrityError:
+            for key, owner_id, n in missing:
+                _add(key, owner_id, n)
+
+
+def _add(key, owner_id, n):
+    if UsageRollup.objects.filter(**key).update(count=F('count') + n):
+        return
+    try:
+        with transaction.atomic():
+            UsageRollup.objects.create(owner_id=owner_id, count=n, **key)
+    except IntegrityError:
+        # Another writer created the row first.
+        UsageRollup.objects.filter(**key).update(count=F('count') + n)
+
+
+# --- Reads ---
+def usage_totals(user):
+    """All-time ``{action: count}`` across ``user``'s documents."""
+    rows = UsageRollup.objects.filter(owner=user, granularity='total') \
+        .values('action').annotate(total=Sum('count'))
+    return {row['action']: row['total'] for row in rows}
+
+
+def top_documents(user, action='view', limit=5):
+    return UsageRollup.objects.filter(owner=user, granularity='total', action=action) \
+        .order_by('-count') \
+        .values('document__id', 'document__name', 'count')[:limit]
+
+
+def usage_series(user, granularity='day', periods=14):
+    """``[(bucket, {action: count})]`` for the last ``periods`` buckets, oldest first."""
+    step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+    latest = dict(buckets_for(timezone.now()))[granularity]
+    start = latest - step * (periods - 1)
+    rows = UsageRollup.objects.filter(owner=user, granularity=granularity, bucket__gte=start) \
+        .values('bucket', 'action').annotate(total=Sum('count'))
+    by_bucket = {}
+    for row in rows:
+        by_bucket.setdefault(row['bucket'], {})[row['action']] = row['total']
+    return [(start + step * i, by_bucket.get(start + step * i, {})) for i in range(periods)]
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FilemonitoringConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fileMonitoring'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,48 @@
+"""
+In-process background worker pool for work that shouldn't hold up a request
+(text extraction, previews, ...). Set ``DMS_BACKGROUND_SYNC = True`` to run
+tasks inline, e.g. in tests.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DMS_BACKGROUND_WORKERS', 2),
+                thread_name_prefix='dms-background',
+            )
+        return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(func, '__name__', func))
+    finally:
+        # Worker threads get their own DB connections; don't leak them.
+        connections.close_all()
+
+
+def submit(func, *args, **kwargs):
+    if getattr(settings, 'DMS_BACKGROUND_SYNC', False):
+        return func(*args, **kwargs)
+    return _get_executor().submit(_run, func, args, kwargs)
+
+
+def submit_on_commit(func, *args, **kwargs):
+    """Queue ``func`` once the current transaction commits, so it sees the new rows."""
+    transaction.on_commit(lambda: submit(func, *args, **kwargs))
@@ -0,0 +1,232 @@
+"""
+Content-addressed storage for document files.
+
+Every distinct file content is written once under ``blobs/`` and keyed by its
+SHA-256. ``Document.file`` and ``DocumentVersion.version_file`` hold the blob's
+storage name, and ``Blob.ref_count`` tracks how many of those rows point at it
+so the file is only unlinked when the last reference goes away. Unlinking
+happens in the background pool once the deleting transaction commits, and
+re-checks that no row names the file by then.
+
+With DMS_COMPRESSION on, eligible files are stored compressed (see
+compression.py); ``Blob.size`` and ``sha256`` always describe the original.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from . import accounting, background, compression, metrics
+from .models import Blob, Document, DocumentVersion
+
+# Names checked per query when looking for rows that still use a file.
+NAME_BATCH = 500
+
+
+def hash_uploaded_file(uploaded_file):
+    sha256 = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha256.update(chunk)
+    uploaded_file.seek(0)
+    return sha256.hexdigest()
+
+
+def store_file(uploaded_file, sha256=None, refs=1):
+    """Return the blob holding ``uploaded_file``'s content, taking ``refs`` references."""
+    if sha256 is None:
+        # Set by the hashing upload handlers; only hash here for files that
+        # did not come through them.
+        sha256 = getattr(uploaded_file, 'sha256', None) or hash_uploaded_file(uploaded_file)
+    blob = _acquire_stored(sha256, refs)
+    if blob is not None:
+        return blob
+
+    size = uploaded_file.size
+    name = _blob_name(sha256, uploaded_file.name)
+    codec = compression.choose_codec(uploaded_file.name, size, compression.read_sample(uploaded_file))
+    staged = _stage(name)
+    try:
+        stored_size = None
+        if codec:
+            stored_size = compression.write(uploaded_file.chunks(), staged, codec, size)
+        if stored_size is None:
+            codec = ''
+            with metrics.timer('blob_write', size), open(staged, 'wb') as out:
+                for chunk in uploaded_file.chunks():
+                    out.write(chunk)
+        return _commit(sha256, name, staged, size, codec, stored_size, refs)
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)
+
+
+def store_path(path, sha256, filename, refs=1):
+    """
+    Like ``store_file`` for a complete file already on local disk (e.g. an
+    assembled resumable upload). The file is moved into place rather than
+    copied (unless it is compressed), so it must be on the same filesystem
+    as the storage; it is removed either way.
+    """
+    try:
+        blob = _acquire_stored(sha256, refs)
+        if blob is not None:
+            return blob
+        size = os.path.getsize(path)
+        name = _blob_name(sha256, filename)
+        with open(path, 'rb') as f:
+            codec = compression.choose_codec(filename, size, compression.read_sample(f))
+        stored_size = None
+        if codec:
+            staged = _stage(name)
+            try:
+                stored_size = compression.write(compression.file_chunks(path), staged, codec, size)
+                if stored_size is not None:
+                    return _commit(sha256, name, staged, size, codec, stored_size, refs)
+            finally:
+                if os.path.exists(staged):
+                    os.remove(staged)
+        return _commit(sha256, name, path, size, '', None, refs)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# The file is written (and compressed) to a temporary name next to its
+# content address before any transaction starts, so a large upload never
+# holds the database write lock while it is copied; the transaction only
+# renames it into place if the blob is still missing.
+def _blob_name(sha256, filename):
+    blob = Blob(sha256=sha256)
+    return blob.file.field.generate_filename(blob, filename)
+
+
+def _stage(name):
+    """A new empty temporary file in the directory of storage ``name``."""
+    target = Blob._meta.get_field('file').storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, staged = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+    os.close(fd)
+    return staged
+
+
+def _acquire_stored(sha256, refs):
+    """Take ``refs`` references on the blob for ``sha256`` if its file is stored; else None."""
+    blob = Blob.objects.filter(sha256=sha256).first()
+    if blob is None or not blob.file or not blob.file.storage.exists(blob.file.name):
+        return None
+    # One conditional UPDATE: it misses (and the content is stored again)
+    # only if ``release`` deleted the row since it was read.
+    if refs > 0 and not Blob.objects.filter(pk=blob.pk, file=blob.file.name).update(ref_count=F('ref_count') + refs):
+        return None
+    return blob
+
+
+def _commit(sha256, name, staged, size, codec, stored_size, refs):
+    """
+    Take ``refs`` references on the blob for ``sha256``, moving ``staged``
+    into place as its file unless another writer stored it meanwhile.
+    """
+    with transaction.atomic():
+        blob, created = Blob.objects.select_for_update().get_or_create(sha256=sha256, defaults={'size': size})
+        storage = blob.file.storage
+        if created or not blob.file or not storage.exists(blob.file.name):
+            # A leftover file at the content address (e.g. from a rolled back
+            # upload) is replaced rather than trusted.
+            os.makedirs(os.path.dirname(storage.path(name)), exist_ok=True)
+            os.replace(staged, storage.path(name))
+            blob.file.name = name
+            blob.size = size
+            blob.codec = codec
+            blob.stored_size = stored_size
+            blob.save(update_fields=['file', 'size', 'codec', 'stored_size'])
+        acquire(blob, refs)
+    return blob
+
+
+def acquire(blob, refs=1):
+    if blob is None or refs <= 0:
+        return
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + refs)
+
+
+def release(blob_refs):
+    """Drop references given as ``{blob_id: count}`` and unlink unreferenced blobs."""
+    blob_refs = {blob_id: count for blob_id, count in blob_refs.items() if blob_id is not None and count > 0}
+    if not blob_refs:
+        return
+    by_count = defaultdict(list)
+    for blob_id, count in blob_refs.items():
+        by_count[count].append(blob_id)
+    with transaction.atomic():
+        # One UPDATE per distinct count, not per blob.
+        for count, blob_ids in by_count.items():
+            Blob.objects.filter(pk__in=blob_ids).update(ref_count=F('ref_count') - count)
+        orphans = list(Blob.objects.select_for_update().filter(pk__in=blob_refs, ref_count__lte=0))
+        if not orphans:
+            return
+        orphan_ids = [blob.pk for blob in orphans]
+        rows = Counter(Document.objects.filter(blob__in=orphan_ids).values_list('blob_id', flat=True))
+        rows.update(DocumentVersion.objects.filter(blob__in=orphan_ids).values_list('blob_id', flat=True))
+        for blob_id, count in rows.items():
+            # Counter drifted below the real number of rows; trust the rows.
+            Blob.objects.filter(pk=blob_id).update(ref_count=count)
+        unreferenced = [blob for blob in orphans if not rows[blob.pk]]
+        if not unreferenced:
+            return
+        Blob.objects.filter(pk__in=[blob.pk for blob in unreferenced]).delete()
+        background.submit_on_commit(unlink_unreferenced, [blob.file.name for blob in unreferenced])
+
+
+def _unlink(storage, name):
+    if name and storage.exists(name):
+        storage.delete(name)
+
+
+def referenced_names(names):
+    """The subset of storage ``names`` that a blob, document or version row still points at."""
+    names = list(names)
+    in_use = set()
+    for i in range(0, len(names), NAME_BATCH):
+        batch = names[i:i + NAME_BATCH]
+        in_use.update(Blob.objects.filter(file__in=batch).values_list('file', flat=True))
+        in_use.update(Document.objects.filter(file__in=batch).values_list('file', flat=True))
+        in_use.update(DocumentVersion.objects.filter(version_file__in=batch).values_list('version_file', flat=True))
+    return in_use
+
+
+def unlink_unreferenced(names):
+    """Delete the stored files named ``names`` that no row points at (any more)."""
+    names = {name for name in names if name}
+    storage = Blob._meta.get_field('file').storage
+    for name in names - referenced_names(names):
+        _unlink(storage, name)
+
+
+def delete_document(doc):
+    """Delete ``doc`` with its versions and release every file they referenced."""
+    delete_documents(Document.objects.filter(pk=doc.pk))
+
+
+def delete_documents(documents):
+    """Delete the ``documents`` queryset with their versions in bulk and release their files."""
+    docs = list(documents.values_list('pk', 'blob_id', 'file', 'uploaded_by_id', 'folder_id', 'versions_size', 'is_deleted'))
+    doc_ids = [doc[0] for doc in docs]
+    if not doc_ids:
+        return
+    files = [(blob_id, name) for _, blob_id, name, *_ in docs]
+    files += DocumentVersion.objects.filter(document__in=doc_ids).values_list('blob_id', 'version_file')
+    blob_refs = Counter(blob_id for blob_id, _ in files if blob_id)
+    legacy_names = {name for blob_id, name in files if not blob_id and name}
+
+    # Files stored before the blob store existed are plain per-upload paths,
+    # and delta-stored versions name their delta file; they go unless
+    # another row still points at the same name.
+    with transaction.atomic():
+        Document.objects.filter(pk__in=doc_ids).delete()
+        release(blob_refs)
+        accounting.documents_removed([doc[3:] for doc in docs])
+        if legacy_names:
+            background.submit_on_commit(unlink_unreferenced, legacy_names)
@@ -0,0 +1,149 @@
+"""
+Bulk document operations executed as set-based queries.
+
+A selection (explicit ids, a folder, a search query, or a combination) is
+always limited to the acting user's own documents and resolved with one
+SELECT that also evaluates whether each row is eligible for the operation.
+The operation is then a single UPDATE (or, for ``purge``, one bulk delete)
+over the eligible rows, re-checking the same condition so a concurrent
+change is never applied twice, and the whole batch is logged with one
+ActivityLog insert. Every requested document gets a result: ``ok``,
+``skipped`` (not eligible, e.g. restoring a document that isn't in the
+trash) or ``not_found``.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.utils import timezone
+
+from . import accounting, blobstore, eventlog, listcache, search
+from .models import Document, SearchEntry
+
+OPERATIONS = ('delete', 'restore', 'share', 'unshare', 'move', 'purge')
+# operation -> ActivityLog action
+ACTIONS = {
+    'delete': 'delete',
+    'restore': 'modify',
+    'share': 'modify',
+    'unshare': 'modify',
+    'move': 'modify',
+    'purge': 'delete',
+}
+
+
+class BulkError(Exception):
+    pass
+
+
+def max_items():
+    return getattr(settings, 'DMS_BULK_MAX_ITEMS', 5000)
+
+
+# --- Selecting ---
+def select(user, ids=None, folder_id=None, query=None):
+    """
+    Return ``(documents, requested ids)``: a queryset of ``user``'s documents
+    matching every given criterion, and the explicit ids (or None).
+    """
+    documents = Document.objects.filter(uploaded_by=user)
+    try:
+        if ids is not None:
+            ids = sorted({int(pk) for pk in ids})
+        if folder_id is not None:
+            folder_id = int(folder_id)
+    except (TypeError, ValueError):
+        raise BulkError("Invalid document or folder id.")
+    if ids is not None:
+        documents = documents.filter(pk__in=ids)
+    if folder_id is not None:
+        documents = documents.filter(folder_id=folder_id)
+    if query:
+        documents = documents.filter(pk__in=search.search_ids(user, query, 0, max_items() + 1))
+    if ids is None and folder_id is None and not query:
+        raise BulkError("Select documents, a folder or a search query.")
+    return documents, ids
+
+
+def _condition(operation, target):
+    if operation in ('delete', 'move'):
+        condition = Q(is_deleted=False)
+        if operation == 'move':
+            condition &= ~Q(folder=target)
+        return condition
+    if operation in ('restore', 'purge'):
+        return Q(is_deleted=True)
+    return Q(is_shared=operation == 'unshare')
+
+
+# --- Running ---
+def run(user, operation, documents, requested=None, target=None):
+    """
+    Apply ``operation`` to the ``documents`` queryset (``target`` is the
+    destination folder of ``move``, None for no folder). Returns a list of
+    ``{'id', 'status'}`` results in id order.
+    """
+    if operation not in OPERATIONS:
+        raise BulkError(f"Unknown operation '{operation}'.")
+    condition = _condition(operation, target)
+    limit = max_items()
+    rows = list(
+        documents.annotate(eligible=ExpressionWrapper(condition, output_field=BooleanField()))
+        .order_by('pk').values_list('pk', 'eligible', 'folder_id', 'versions_size')[:limit + 1]
+    )
+    if len(rows) > limit:
+        raise BulkError(f"More than {limit} documents selected; narrow the selection.")
+    eligible = [(pk, folder_id, size) for pk, ok, folder_id, size in rows if ok]
+
+    if eligible:
+        with transaction.atomic():
+            _apply(operation, eligible, condition, target)
+        eventlog.log_activities(user, ACTIONS[operation], [pk for pk, _, _ in eligible])
+
+    status = {pk: 'ok' if ok else 'skipped' for pk, ok, _, _ in rows}
+    for pk in requested or ():
+        status.setdefault(pk, 'not_found')
+    return [{'id': pk, 'status': status[pk]} for pk in sorted(status)]
+
+
+def _apply(operation, rows, condition, target):
+    # ``rows`` are the eligible ``(pk, folder_id, versions_size)``.
+    ids = [pk for pk, _, _ in rows]
+    documents = Document.objects.filter(condition, pk__in=ids)
+    if operation == 'delete':
+        documents.update(is_deleted=True, deleted_at=timezone.now())
+        accounting.documents_trashed([(folder_id, size) for _, folder_id, size in rows])
+    elif operation == 'restore':
+        documents.update(is_deleted=False, deleted_at=None)
+        accounting.documents_trashed([(folder_id, size) for _, folder_id, size in rows], sign=-1)
+    elif operation in ('share', 'unshare'):
+        documents.update(is_shared=operation == 'share')
+    elif operation == 'move':
+        documents.update(folder=target)
+        accounting.documents_moved([(folder_id, size) for _, folder_id, size in rows], target.pk if target else None)
+        # .update() skips the post_save signal that keeps search entries current.
+        SearchEntry.objects.filter(document__in=ids, document__folder=target).update(
+            folder=target.name if target else '',
+            category=target.category.name if target else '',
+        )
+    elif operation == 'purge':
+        blobstore.delete_documents(documents)
+    if operation in ('delete', 'restore', 'share', 'unshare'):
+        # .update() skips the signals that invalidate cached shared listings.
+        listcache.invalidate_shared()
+
+
+def summary(operation, results):
+    """A one-line description of ``results`` for a flash message."""
+    counts = {'ok': 0, 'skipped': 0, 'not_found': 0}
+    for result in results:
+        counts[result['status']] += 1
+    past = {
+        'delete': 'moved to trash', 'restore': 'restored', 'share': 'shared',
+        'unshare': 'unshared', 'move': 'moved', 'purge': 'permanently deleted',
+    }[operation]
+    message = f"{counts['ok']} document{'s' if counts['ok'] != 1 else ''} {past}."
+    if counts['skipped']:
+        message += f" {counts['skipped']} skipped."
+    if counts['not_found']:
+        message += f" {counts['not_found']} not found."
+    return message
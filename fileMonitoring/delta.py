@@ -0,0 +1,206 @@
+"""
+rsync-style binary deltas.
+
+The base file is cut into fixed-size blocks indexed by their Adler-32. The
+target is scanned with a rolling Adler-32: wherever the window matches a
+base block it becomes a copy from the base (extended for as long as the
+following bytes keep matching), everything in between is stored literally.
+Byte comparison stands in for rsync's strong checksum since both files are
+local.
+
+A delta file is gzip-compressed: a header with both sizes, then a sequence
+of ``C`` (copy offset, length from the base) and ``I`` (insert length,
+bytes) operations.
+
+Copies seek around the base, which a compressed blob can only do by
+decompressing again from the start, so a compressed base is decompressed
+once into a spooled temporary file before the delta is applied.
+"""
+import gzip
+import shutil
+import struct
+import tempfile
+import zlib
+
+from . import compression
+
+MAGIC = b'DMSDELTA1'
+HEADER = struct.Struct('>QQ')
+COPY = struct.Struct('>QQ')
+INSERT = struct.Struct('>Q')
+ADLER_MOD = 65521
+COPY_BUFFER = 1024 * 1024
+# Decompressed bases up to this size are kept in memory, larger ones on disk.
+# Bases are never larger than DMS_VERSION_DELTA_MAX_SIZE.
+BASE_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+class DeltaError(Exception):
+    pass
+
+
+def default_block_size(size):
+    # About sqrt(size), as rsync does, rounded to a power of two.
+    block = 512
+    while block * block < size and block < 64 * 1024:
+        block *= 2
+    return block
+
+
+def diff(base, target, block_size=None, max_literal=None):
+    """
+    Return the operations turning bytes ``base`` into bytes ``target``:
+    ``('copy', offset, length)`` and ``('insert', start, end)`` (a slice of
+    ``target``). Returns None once more than ``max_literal`` bytes would
+    have to be stored literally.
+    """
+    block = block_size or default_block_size(len(base))
+    index = {}
+    for offset in range(0, len(base) - block + 1, block):
+        index.setdefault(zlib.adler32(base[offset:offset + block]), []).append(offset)
+
+    ops = []
+    literal = 0
+    literal_start = 0
+    n = len(target)
+    p = 0
+    a = b = None
+    while p + block <= n:
+        if a is None:
+            weak = zlib.adler32(target[p:p + block])
+            a, b = weak & 0xffff, weak >> 16
+        else:
+            weak = (b << 16) | a
+        match = None
+        if weak in index:
+            window = target[p:p + block]
+            for offset in index[weak]:
+                if base[offset:offset + block] == window:
+                    match = offset
+                    break
+
+        if match is None:
+            if p + block == n:
+                break
+            # Roll the window one byte forward.
+            out, new = target[p], target[p + block]
+            a = (a - out + new) % ADLER_MOD
+            b = (b - block * out + a - 1) % ADLER_MOD
+            p += 1
+            if max_literal is not None and literal + p - literal_start > max_literal:
+                return None
+            continue
+
+        # The window was found by rolling, so bytes just before it may match too.
+        back = 0
+        while (p - back > literal_start and match - back > 0
+               and target[p - back - 1] == base[match - back - 1]):
+            back += 1
+        p -= back
+        match -= back
+        if p > literal_start:
+            ops.append(('insert', literal_start, p))
+            literal += p - literal_start
+        length = back + block
+        length += _match_length(base, match + length, target, p + length, block)
+        if ops and ops[-1][0] == 'copy' and ops[-1][1] + ops[-1][2] == match:
+            ops[-1] = ('copy', ops[-1][1], ops[-1][2] + length)
+        else:
+            ops.append(('copy', match, length))
+        p += length
+        literal_start = p
+        a = b = None
+
+    if literal_start < n:
+        literal += n - literal_start
+        if max_literal is not None and literal > max_literal:
+            return None
+        ops.append(('insert', literal_start, n))
+    return ops
+
+
+def _match_length(base, i, target, j, block):
+    """How many bytes from base[i:] and target[j:] are equal."""
+    length = 0
+    step = block
+    while step:
+        if (i + length + step <= len(base) and j + length + step <= len(target)
+                and base[i + length:i + length + step] == target[j + length:j + length + step]):
+            length += step
+            step *= 2
+        else:
+            step //= 2
+    return length
+
+
+def write_delta(ops, base_size, target, f):
+    """Write ``ops`` from ``diff`` (with ``target``'s bytes) to binary file ``f``."""
+    with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6) as out:
+        out.write(MAGIC + HEADER.pack(base_size, len(target)))
+        view = memoryview(target)
+        for op in ops:
+            if op[0] == 'copy':
+                out.write(b'C' + COPY.pack(op[1], op[2]))
+            else:
+                out.write(b'I' + INSERT.pack(op[2] - op[1]))
+                out.write(view[op[1]:op[2]])
+
+
+def apply_delta(base_path, delta_path, out):
+    """Write the target reconstructed from ``base_path`` and a delta file to ``out``."""
+    with gzip.open(delta_path, 'rb') as delta, _open_base(base_path) as base:
+        header = delta.read(len(MAGIC) + HEADER.size)
+        if header[:len(MAGIC)] != MAGIC:
+            raise DeltaError("Not a delta file.")
+        base_size, target_size = HEADER.unpack(header[len(MAGIC):])
+        written = 0
+        while True:
+            kind = delta.read(1)
+            if not kind:
+                break
+            if kind == b'C':
+                offset, length = COPY.unpack(_read_exact(delta, COPY.size))
+                if offset + length > base_size:
+                    raise DeltaError("Copy beyond the end of the base.")
+                base.seek(offset)
+                _copy(base, out, length)
+            elif kind == b'I':
+                (length,) = INSERT.unpack(_read_exact(delta, INSERT.size))
+                _copy(delta, out, length)
+            else:
+                raise DeltaError("Corrupt delta operation.")
+            written += length
+    if written != target_size:
+        raise DeltaError("Delta produced the wrong size.")
+    return written
+
+
+def _open_base(path):
+    """``path``'s original bytes in a file that seeks without decompressing."""
+    if compression.codec_of(path) in ('', 'store'):
+        return compression.open_file(path)
+    spool = tempfile.SpooledTemporaryFile(max_size=BASE_SPOOL_SIZE)
+    try:
+        with compression.open_file(path) as f:
+            shutil.copyfileobj(f, spool, COPY_BUFFER)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise DeltaError("Truncated delta.")
+    return data
+
+
+def _copy(src, out, length):
+    while length > 0:
+        data = src.read(min(COPY_BUFFER, length))
+        if not data:
+            raise DeltaError("Truncated delta or base.")
+        out.write(data)
+        length -= len(data)
@@ -0,0 +1,230 @@
+"""
+Access-controlled file responses with ETags and byte ranges.
+
+Media files are not served publicly; every download goes through a view
+that checks permissions and then calls ``serve_file``. The stored hash is
+the strong ETag, so ``If-None-Match`` is answered with 304 without touching
+the file. Single and multiple ``Range`` requests are answered with 206
+(``multipart/byteranges`` for several ranges).
+
+With ``DMS_SENDFILE = 'x-accel-redirect'`` (nginx) or ``'x-sendfile'``
+(Apache/lighttpd) the byte transfer, including ranges, is handed to the
+front-end server once the permission and ETag checks have passed. nginx
+needs an ``internal`` location at DMS_SENDFILE_PREFIX aliased to MEDIA_ROOT.
+
+Async views pass ``asynchronous=True`` to get bodies that are async
+iterators reading through aio.py's thread pool; a sync iterator would be
+read into memory whole before ASGI sends it.
+
+Files stored compressed (see compression.py) are decompressed as they are
+streamed, ranges included, and never handed to the front-end server.
+"""
+import mimetypes
+import os
+import secrets
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+
+from . import aio, compression
+
+# More ranges than this in one request are answered with the whole file.
+MAX_RANGES = 20
+CHUNK_SIZE = 64 * 1024
+
+
+def can_download(user, document):
+    """Owners can download their documents; others only live shared ones."""
+    if document.uploaded_by_id == user.id:
+        return True
+    return document.is_shared and not document.is_deleted
+
+
+def etag_for(hash_value):
+    return f'"{hash_value}"' if hash_value else None
+
+
+def etag_matches(header, etag):
+    """Weak comparison of ``etag`` against an If-None-Match header value."""
+    if not header or not etag:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in header.split(',')]
+    return etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+def parse_range(header, size):
+    """
+    Return the ``[(start, end)]`` (inclusive) ranges of a Range header, None
+    if the header should be ignored, or ``[]`` if nothing is satisfiable.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        start, sep, end = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                # Suffix range: the last N bytes.
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(0, size - length), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end else None
+        except ValueError:
+            return None
+        if end is None:
+            end = size - 1
+        elif start > end:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_range(path, start, end):
+    with compression.open_file(path) as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _multipart(path, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+               f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+        yield from _read_range(path, start, end)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+async def _amultipart(path, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+               f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+        async for data in aio.read_range(path, start, end):
+            yield data
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def _sendfile_response(path, name):
+    backend = getattr(settings, 'DMS_SENDFILE', None)
+    response = HttpResponse()
+    if backend == 'x-accel-redirect':
+        prefix = getattr(settings, 'DMS_SENDFILE_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + name.replace(os.sep, '/'))
+    elif backend == 'x-sendfile':
+        response['X-Sendfile'] = path
+    else:
+        return None
+    # Let the front-end server fill these in from the file.
+    del response['Content-Type']
+    return response
+
+
+def serve_file(request, path, name, filename, etag=None, last_modified=None, inline=False, max_age=None,
+               asynchronous=False):
+    """
+    Respond with the file at ``path`` (storage name ``name``), honouring
+    If-None-Match, If-Range and Range. ``max_age`` lets browsers reuse the
+    response without revalidating, for URLs that change with the content.
+    """
+    try:
+        codec, size = compression.describe(path)
+    except OSError:
+        raise Http404("File not found.")
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponse(status=304)
+    else:
+        # The front-end server would send a compressed file as stored.
+        response = None if codec else _sendfile_response(path, name)
+        if response is None:
+            response = _range_response(request, path, size, content_type, etag, asynchronous)
+            if response is None and asynchronous:
+                response = StreamingHttpResponse(aio.read_range(path, 0, size - 1), content_type=content_type)
+                response['Content-Length'] = str(size)
+            elif response is None and codec:
+                response = StreamingHttpResponse(_read_range(path, 0, size - 1), content_type=content_type)
+                response['Content-Length'] = str(size)
+            elif response is None:
+                response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Accept-Ranges'] = 'bytes'
+        disposition = 'inline' if inline else 'attachment'
+        response['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(filename)}"
+
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Downloads are per-user: browsers may keep them but must revalidate.
+    if max_age:
+        patch_cache_control(response, private=True, max_age=max_age)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _range_response(request, path, size, content_type, etag, asynchronous=False):
+    ranges = parse_range(request.headers.get('Range'), size)
+    if ranges is None:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and (not etag or if_range.strip() != etag):
+        # The client's copy is stale (or validated by date): send it all.
+        return None
+    if not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        body = (aio.read_range if asynchronous else _read_range)(path, start, end)
+        response = StreamingHttpResponse(body, status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        return response
+
+    boundary = secrets.token_hex(16)
+    length = sum(
+        len(f'--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n')
+        + (end - start + 1) + 2
+        for start, end in ranges
+    ) + len(f'--{boundary}--\r\n')
+    response = StreamingHttpResponse(
+        (_amultipart if asynchronous else _multipart)(path, ranges, size, content_type, boundary), status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = str(length)
+    return response
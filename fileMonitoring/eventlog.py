@@ -0,0 +1,196 @@
+"""
+Write-behind buffering for ActivityLog and UsageStat rows.
+
+Views queue events here instead of inserting them one by one. A flusher
+thread writes them with ``bulk_create`` once DMS_LOG_BATCH_SIZE events are
+waiting or every DMS_LOG_FLUSH_INTERVAL seconds, and whatever is left is
+flushed at interpreter exit. Writing is best-effort: a batch that fails is
+logged and dropped. Set ``DMS_LOG_SYNC = True`` to write every event
+immediately, e.g. in tests.
+
+Repeat views and downloads of a document by the same user within
+DMS_VIEW_DEDUP_WINDOW seconds are dropped using an in-memory LRU, so a
+preview (or a client fetching a file in ranges) doesn't cost a query. The
+window is per process.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import analytics, metrics
+from .models import ActivityLog, Document, UsageStat
+
+logger = logging.getLogger(__name__)
+
+
+def sync_mode():
+    return getattr(settings, 'DMS_LOG_SYNC', False)
+
+
+def batch_size():
+    return getattr(settings, 'DMS_LOG_BATCH_SIZE', 500)
+
+
+def flush_interval():
+    return getattr(settings, 'DMS_LOG_FLUSH_INTERVAL', 2.0)
+
+
+# --- Writing ---
+def write_events(activities, usages):
+    """Insert ``(user_id, action, document_id, when)`` activity and usage events."""
+    doc_ids = {e[2] for e in activities + usages if e[2] is not None}
+    user_ids = {e[0] for e in activities + usages}
+    # Rows may have been deleted while their events sat in the queue.
+    docs = dict(Document.objects.filter(pk__in=doc_ids).values_list('id', 'uploaded_by_id'))
+    users = set(User.objects.filter(pk__in=user_ids).values_list('id', flat=True))
+
+    activity_rows = [
+        ActivityLog(user_id=user_id, action=action, timestamp=when,
+                    document_id=doc_id if doc_id in docs else None)
+        for user_id, action, doc_id, when in activities if user_id in users
+    ]
+    usages = [e for e in usages if e[0] in users and e[2] in docs]
+    usage_rows = [
+        UsageStat(accessed_by_id=user_id, action=action, document_id=doc_id, accessed_at=when)
+        for user_id, action, doc_id, when in usages
+    ]
+    with metrics.timer('log_insert'), transaction.atomic():
+        ActivityLog.objects.bulk_create(activity_rows)
+        UsageStat.objects.bulk_create(usage_rows)
+        analytics.apply_to_rollups([
+            (doc_id, docs[doc_id], action, when) for _, action, doc_id, when in usages
+        ] + [
+            (doc_id, docs[doc_id], action, when) for _, action, doc_id, when in activities
+            if action in analytics.ROLLUP_ACTIVITIES and doc_id in docs
+        ])
+    metrics.log_events.inc(len(activity_rows), 'activity')
+    metrics.log_events.inc(len(usage_rows), 'usage')
+
+
+class LogBuffer:
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._activities = []
+        self._usages = []
+        self._thread = None
+        self._pid = None
+
+    def add(self, queue_name, event):
+        self.extend(queue_name, [event])
+
+    def extend(self, queue_name, events):
+        if sync_mode():
+            if queue_name == 'activities':
+                write_events(events, [])
+            else:
+                write_events([], events)
+            return
+        with self._cond:
+            self._ensure_thread()
+            getattr(self, f'_{queue_name}').extend(events)
+            if len(self._activities) + len(self._usages) >= batch_size():
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        # A forked worker inherits the queue but not the thread.
+        if self._pid != os.getpid():
+            self._activities, self._usages = [], []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='dms-log-flusher', daemon=True)
+            self._thread.start()
+
+    def _take(self):
+        with self._cond:
+            activities, usages = self._activities, self._usages
+            self._activities, self._usages = [], []
+        return activities, usages
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + flush_interval()
+                while len(self._activities) + len(self._usages) < batch_size():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+
+    def flush(self):
+        activities, usages = self._take()
+        if not activities and not usages:
+            return
+        try:
+            write_events(activities, usages)
+        except Exception:
+            logger.exception("Dropped %d buffered log events", len(activities) + len(usages))
+        finally:
+            if threading.current_thread() is self._thread:
+                connection.close()
+
+
+_buffer = LogBuffer()
+atexit.register(_buffer.flush)
+
+
+def flush():
+    _buffer.flush()
+
+
+def log_activity(user, action, document=None):
+    _buffer.add('activities', (user.pk, action, document.pk if document else None, timezone.now()))
+
+
+def log_activities(user, action, document_ids):
+    """Log one ``action`` per document id, queued (or written) as a single batch."""
+    when = timezone.now()
+    _buffer.extend('activities', [(user.pk, action, doc_id, when) for doc_id in document_ids])
+
+
+def log_usage(document, user, action):
+    _buffer.add('usages', (user.pk, action, document.pk, timezone.now()))
+
+
+# --- View dedup ---
+class RecentViews:
+    """LRU of ``(document_id, user_id, action) -> last logged time`` (monotonic seconds)."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def should_log(self, key, window):
+        now = time.monotonic()
+        with self._lock:
+            last = self._seen.get(key)
+            if last is not None and now - last < window:
+                return False
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
+
+
+recent_views = RecentViews(getattr(settings, 'DMS_VIEW_DEDUP_SIZE', 10000))
+
+
+def log_view(document, user, action='view'):
+    """Log a view (or download) unless ``user`` already had one of ``document`` within the dedup window."""
+    window = getattr(settings, 'DMS_VIEW_DEDUP_WINDOW', 600)
+    if recent_views.should_log((document.pk, user.pk, action), window):
+        log_usage(document, user, action)
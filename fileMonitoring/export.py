@@ -0,0 +1,236 @@
+"""
+ZIP exports of folders, categories and selections of documents.
+
+``stream`` writes the archive as it is read: each file is read (and
+decompressed, see compression.py) in small chunks, fed to ``zipfile`` and
+the bytes it has produced so far are yielded, so the first bytes go out
+straight away and memory stays constant whatever the size of the export.
+Nothing is written to disk. The archive is in streaming form (sizes and
+CRCs follow each file's data) with ZIP64 records for files over 4 GB.
+
+Files of types that are compressed already (images, media, office
+documents, archives, PDFs) are stored; everything else is deflated.
+``manifest.json`` and ``SHA256SUMS`` at the end of the archive list every
+file with the hash recorded for it in FileHash, so an export can be checked
+after it is unpacked.
+"""
+import json
+import os
+import posixpath
+import zipfile
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import aio, compression, search
+from .models import Category, Document, FileHash, Folder
+
+CHUNK_SIZE = 64 * 1024
+STORED_EXTENSIONS = {
+    '.7z', '.aac', '.apk', '.avi', '.avif', '.bz2', '.docx', '.epub', '.flac', '.gif', '.gz', '.heic', '.jar',
+    '.jpeg', '.jpg', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.odp', '.ods', '.odt', '.ogg', '.pdf', '.png',
+    '.pptx', '.rar', '.tgz', '.webm', '.webp', '.xlsx', '.xz', '.zip', '.zst',
+}
+MANIFEST_NAME = 'manifest.json'
+CHECKSUMS_NAME = 'SHA256SUMS'
+
+
+class ExportError(Exception):
+    pass
+
+
+Entry = namedtuple('Entry', 'name path document_id algorithm hash_value modified')
+
+
+def max_files():
+    return getattr(settings, 'DMS_EXPORT_MAX_FILES', 10000)
+
+
+# --- Selecting ---
+def select(user, ids=None, folder_id=None, category_id=None, query=None):
+    """
+    Return ``(documents, depth, title)`` for an export of a folder, a
+    category or a selection (``ids`` and/or a search ``query``): the live
+    documents ``user`` may download, the directory levels ``entries`` drops
+    and a name for the archive.
+    """
+    documents = Document.objects.filter(Q(uploaded_by=user) | Q(is_shared=True), is_deleted=False)
+    try:
+        if ids is not None:
+            ids = sorted({int(pk) for pk in ids})
+        folder_id = int(folder_id) if folder_id is not None else None
+        category_id = int(category_id) if category_id is not None else None
+    except (TypeError, ValueError):
+        raise ExportError("Invalid document, folder or category id.")
+
+    if folder_id is not None:
+        folder = Folder.objects.filter(pk=folder_id).first()
+        if folder is None:
+            raise ExportError("No such folder.")
+        documents, depth, title = documents.filter(folder=folder), 2, folder.name
+    elif category_id is not None:
+        category = Category.objects.filter(pk=category_id, created_by=user).first()
+        if category is None:
+            raise ExportError("No such category.")
+        documents, depth, title = documents.filter(folder__category=category), 1, category.name
+    elif ids is not None or query:
+        depth, title = 0, 'documents'
+        if ids is not None:
+            documents = documents.filter(pk__in=ids)
+        if query:
+            documents = documents.filter(pk__in=search.search_ids(user, query, 0, max_files() + 1))
+    else:
+        raise ExportError("Select documents, a folder or a category to export.")
+    return documents, depth, title
+
+
+# --- Planning ---
+def _clean(name):
+    """``name`` as a single safe path component."""
+    name = name.replace('/', '_').replace('\\', '_').strip()
+    return '_' if name in ('', '.', '..') else name
+
+
+def _unique(name, taken):
+    if name.lower() not in taken:
+        taken.add(name.lower())
+        return name
+    base, ext = posixpath.splitext(name)
+    n = 2
+    while f'{base} ({n}){ext}'.lower() in taken:
+        n += 1
+    taken.add(f'{base} ({n}){ext}'.lower())
+    return f'{base} ({n}){ext}'
+
+
+def _hash_of(document):
+    try:
+        filehash = document.filehash
+    except FileHash.DoesNotExist:
+        filehash = None
+    if filehash is not None and filehash.hash_value:
+        return filehash.algorithm, filehash.hash_value
+    if document.blob_id:
+        return 'sha256', document.blob.sha256
+    return '', ''
+
+
+def entries(documents, depth=0):
+    """
+    The archive entries for ``documents`` (with ``folder__category``,
+    ``filehash`` and ``blob`` selected): each named ``Category/Folder/name``
+    with the first ``depth`` directories dropped, so a folder export has its
+    files at the top and a category export one directory per folder.
+    """
+    result = []
+    taken = {MANIFEST_NAME.lower(), CHECKSUMS_NAME.lower()}
+    for doc in documents:
+        filename = doc.name if os.path.splitext(doc.name)[1] else doc.name + os.path.splitext(doc.file.name)[1]
+        parts = [doc.folder.category.name, doc.folder.name] if doc.folder_id else []
+        parts = [_clean(part) for part in parts[depth:]]
+        name = _unique('/'.join(parts + [_clean(filename)]), taken)
+        algorithm, hash_value = _hash_of(doc)
+        result.append(Entry(name, doc.file.path, doc.pk, algorithm, hash_value, timezone.localtime(doc.uploaded_at)))
+    return result
+
+
+def plan(documents, depth):
+    """The ``entries`` of ``documents``, refusing more than DMS_EXPORT_MAX_FILES."""
+    documents = list(
+        documents.select_related('folder__category', 'filehash', 'blob')
+        .order_by('folder__category__name', 'folder__name', 'name', 'pk')[:max_files() + 1]
+    )
+    if not documents:
+        raise ExportError("There is nothing to export.")
+    if len(documents) > max_files():
+        raise ExportError(f"Exports are limited to {max_files()} files; select fewer.")
+    return entries(documents, depth)
+
+
+# --- Streaming ---
+class _Sink:
+    """A write-only, unseekable file collecting what ``zipfile`` writes until it is drained."""
+
+    def __init__(self):
+        self._parts = []
+        self._offset = 0
+        self.pending = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._offset += len(data)
+        self.pending += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        self.pending = 0
+        return data
+
+
+def compress_type(name):
+    return zipfile.ZIP_STORED if posixpath.splitext(name)[1].lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _zipinfo(name, modified, size):
+    info = zipfile.ZipInfo(name, date_time=max(modified.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+    info.compress_type = compress_type(name)
+    info.external_attr = 0o644 << 16
+    # Tells zipfile up front whether the entry needs ZIP64 sizes.
+    info.file_size = size
+    return info
+
+
+def stream(entries):
+    """Yield the bytes of a ZIP archive of ``entries``, followed by its manifest."""
+    sink = _Sink()
+    files = []
+    missing = []
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for entry in entries:
+            try:
+                size = compression.content_size(entry.path)
+                source = compression.open_file(entry.path)
+            except OSError:
+                missing.append({'path': entry.name, 'document': entry.document_id})
+                continue
+            with source, archive.open(_zipinfo(entry.name, entry.modified, size), 'w') as target:
+                for data in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    target.write(data)
+                    if sink.pending >= CHUNK_SIZE:
+                        yield sink.drain()
+            files.append({
+                'path': entry.name, 'document': entry.document_id, 'size': size,
+                'algorithm': entry.algorithm, 'hash': entry.hash_value,
+            })
+            if sink.pending:
+                yield sink.drain()
+
+        manifest = {'created': timezone.now().isoformat(), 'files': files, 'missing': missing}
+        archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+        archive.writestr(CHECKSUMS_NAME, ''.join(
+            f"{f['hash']}  {f['path']}\n" for f in files if f['algorithm'] == 'sha256' and f['hash']
+        ))
+    yield sink.drain()
+
+
+async def astream(entries):
+    """``stream`` for ASGI responses, reading and compressing in aio.py's thread pool."""
+    chunks = stream(entries)
+    try:
+        while True:
+            data = await aio.run(next, chunks, None)
+            if data is None:
+                return
+            yield data
+    finally:
+        await aio.run(chunks.close)
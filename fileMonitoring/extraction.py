@@ -0,0 +1,109 @@
+"""
+Plain-text extraction for the search index.
+
+Text-like files are read directly, Office Open XML and OpenDocument files are
+unzipped and stripped of markup with the standard library, and PDFs use
+``pypdf`` when it is installed (they are skipped otherwise).
+"""
+import html
+import io
+import os
+import re
+import zipfile
+import zlib
+
+from django.conf import settings
+
+from . import compression
+
+try:
+    import pypdf
+except ImportError:  # optional dependency
+    pypdf = None
+
+TEXT_EXTENSIONS = {'.txt', '.md', '.csv', '.tsv', '.json', '.xml', '.html', '.htm', '.log', '.rtf', '.yaml', '.yml'}
+
+# Parts of each zipped format that hold the document text.
+OFFICE_PARTS = {
+    '.docx': re.compile(r'^word/(document|header\d*|footer\d*|footnotes)\.xml$'),
+    '.pptx': re.compile(r'^ppt/slides/slide\d+\.xml$'),
+    '.xlsx': re.compile(r'^xl/(sharedStrings|worksheets/sheet\d+)\.xml$'),
+    '.odt': re.compile(r'^content\.xml$'),
+    '.ods': re.compile(r'^content\.xml$'),
+    '.odp': re.compile(r'^content\.xml$'),
+}
+
+TAG_RE = re.compile(r'<[^>]+>')
+SPACE_RE = re.compile(r'\s+')
+
+
+def max_chars():
+    return getattr(settings, 'DMS_SEARCH_MAX_CHARS', 1_000_000)
+
+
+def max_xml_bytes():
+    return getattr(settings, 'DMS_SEARCH_MAX_XML_BYTES', 64 * 1024 * 1024)
+
+
+def extract_text(path, filename=None):
+    """Return the searchable text of ``path`` (possibly empty), capped at DMS_SEARCH_MAX_CHARS."""
+    ext = os.path.splitext(filename or path)[1].lower()
+    limit = max_chars()
+    if ext in TEXT_EXTENSIONS:
+        with io.TextIOWrapper(compression.open_file(path), encoding='utf-8', errors='ignore') as f:
+            text = f.read(limit)
+        if ext in ('.xml', '.html', '.htm'):
+            text = _strip_markup(text)
+    elif ext in OFFICE_PARTS:
+        text = _extract_zipped_xml(path, OFFICE_PARTS[ext], limit)
+    elif ext == '.pdf' and pypdf is not None:
+        text = _extract_pdf(path, limit)
+    else:
+        return ''
+    return SPACE_RE.sub(' ', text).strip()[:limit]
+
+
+def _strip_markup(text):
+    return html.unescape(TAG_RE.sub(' ', text))
+
+
+def _extract_zipped_xml(path, part_re, limit):
+    parts = []
+    size = 0
+    # Parts are unzipped as they are read and never past DMS_SEARCH_MAX_XML_BYTES
+    # in total, whatever sizes the archive claims, so a zip bomb costs no more
+    # than a large document.
+    budget = max_xml_bytes()
+    try:
+        with compression.open_file(path) as f, zipfile.ZipFile(f) as archive:
+            for info in sorted((i for i in archive.infolist() if part_re.match(i.filename)), key=lambda i: i.filename):
+                if budget <= 0 or size >= limit:
+                    break
+                with archive.open(info) as member:
+                    data = member.read(min(info.file_size, budget))
+                budget -= len(data)
+                text = _strip_markup(data.decode('utf-8', errors='ignore'))
+                parts.append(text)
+                size += len(text)
+    except (zipfile.BadZipFile, zlib.error, RuntimeError):
+        # Damaged or encrypted archives are indexed by name only.
+        return ''
+    return ' '.join(parts)
+
+
+def _extract_pdf(path, limit):
+    parts = []
+    size = 0
+    try:
+        with compression.open_file(path) as f:
+            reader = pypdf.PdfReader(f)
+            for page in reader.pages:
+                text = page.extract_text() or ''
+                parts.append(text)
+                size += len(text)
+                if size >= limit:
+                    break
+    except Exception:
+        # Damaged or encrypted PDFs are indexed by name only.
+        return ''
+    return ' '.join(parts)
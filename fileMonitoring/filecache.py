@@ -0,0 +1,123 @@
+"""
+Size-bounded least-recently-used caches of generated files on local disk.
+
+Each cache is a directory under DMS_CACHE_DIR (MEDIA_ROOT/cache by default,
+so cached files can be handed to the front-end server like any media file).
+Entries are written to a temporary name and renamed into place, and a hit
+bumps the file's mtime; when a put takes the cache over its size, the least
+recently used entries are deleted.
+
+Each process keeps a running total of the cache's size, so a put doesn't
+walk the directory: only the first put and one that takes the total over
+the limit do, and that walk also picks up what other processes wrote.
+"""
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+
+def cache_root():
+    return getattr(settings, 'DMS_CACHE_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'cache')
+
+
+class FileCache:
+    def __init__(self, name, max_bytes_setting, default_max_bytes):
+        self.name = name
+        self.max_bytes_setting = max_bytes_setting
+        self.default_max_bytes = default_max_bytes
+        self._lock = threading.Lock()
+        # Bytes in the cache as of the last walk plus this process's puts
+        # since, or None before the first walk (or after a clear).
+        self._total = None
+        self._total_directory = None
+
+    @property
+    def directory(self):
+        return os.path.join(cache_root(), self.name)
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, self.max_bytes_setting, self.default_max_bytes)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def storage_name(self, path):
+        """The name of a cached file relative to MEDIA_ROOT (for X-Accel-Redirect)."""
+        return os.path.relpath(path, settings.MEDIA_ROOT)
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, write):
+        """Create the entry for ``key`` by calling ``write(f)`` with a binary file; return its path."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+                f.flush()
+                size = os.fstat(f.fileno()).st_size
+            try:
+                size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            if self._total is not None and self._total_directory == self.directory:
+                self._total += size
+                if self._total <= self.max_bytes:
+                    return path
+            self._evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits its size limit."""
+        with self._lock:
+            self._evict(keep)
+
+    def _evict(self, keep):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.startswith('.tmp-'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total, self._total_directory = total, self.directory
+
+    def clear(self):
+        with self._lock:
+            for root, _, files in os.walk(self.directory):
+                for filename in files:
+                    os.remove(os.path.join(root, filename))
+            self._total = None
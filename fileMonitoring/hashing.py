@@ -0,0 +1,137 @@
+"""
+File hashing engine.
+
+Hashes are produced by one of several interchangeable read strategies and one
+of the supported algorithms. ``FileHash.algorithm`` records which algorithm
+produced a stored digest, so SHA-256 and BLAKE2b rows can coexist while a
+deployment migrates. Run ``manage.py benchmark_hashing`` to compare the
+strategies on the local disk before changing the defaults in settings.
+Files stored compressed are always hashed as their original bytes.
+"""
+import hashlib
+import mmap
+import os
+
+from django.conf import settings
+
+from . import compression, metrics
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# BLAKE2b is truncated to 32 bytes so its hex digest fits the same column as SHA-256.
+ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+}
+
+
+def default_algorithm():
+    return getattr(settings, 'DMS_HASH_ALGORITHM', 'sha256')
+
+
+def default_strategy():
+    return getattr(settings, 'DMS_HASH_STRATEGY', 'readinto')
+
+
+def buffer_size():
+    return getattr(settings, 'DMS_HASH_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
+
+
+def new_hasher(algorithm=None):
+    algorithm = algorithm or default_algorithm()
+    try:
+        return ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+
+
+# --- Strategies ---
+def hash_readinto(path, algorithm=None, size=None):
+    """Read into one reusable buffer; no per-read allocations."""
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb', buffering=0) as f:
+        # Small files don't need (or pay for allocating) a full-size buffer.
+        file_size = os.fstat(f.fileno()).st_size
+        buf = bytearray(max(1, min(size or buffer_size(), file_size)))
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def hash_file_digest(path, algorithm=None):
+    """``hashlib.file_digest`` (Python 3.11+), which reads with its own buffer."""
+    if not hasattr(hashlib, 'file_digest'):
+        return hash_readinto(path, algorithm)
+    constructor = ALGORITHMS[algorithm or default_algorithm()]
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, constructor).hexdigest()
+
+
+def hash_mmap(path, algorithm=None):
+    """
+    Hash a memory-mapped view of the file in slices of the buffer size. Only
+    for files nothing truncates meanwhile: reading past the new end raises
+    SIGBUS and kills the process.
+    """
+    hasher = new_hasher(algorithm)
+    step = buffer_size()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hasher.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(mapped), step):
+                    hasher.update(view[offset:offset + step])
+            finally:
+                view.release()
+    return hasher.hexdigest()
+
+
+STRATEGIES = {
+    'readinto': hash_readinto,
+    'file_digest': hash_file_digest,
+    'mmap': hash_mmap,
+}
+
+
+def hash_compressed(path, algorithm=None):
+    """Hash the original bytes of a file stored compressed, decompressing as it reads."""
+    hasher = new_hasher(algorithm)
+    with compression.open_file(path) as f:
+        for data in iter(lambda: f.read(buffer_size()), b''):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def hash_file(path, algorithm=None, strategy=None):
+    strategy = strategy or default_strategy()
+    try:
+        func = STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown hash strategy: {strategy}")
+    codec, size = compression.describe(path)
+    if codec:
+        func = hash_compressed
+    with metrics.timer('hash', size):
+        return func(path, algorithm or default_algorithm())
+
+
+def uploaded_digest(uploaded_file, algorithm=None):
+    """
+    Return ``(algorithm, hexdigest)`` for an uploaded file, preferring the
+    digests computed by the hashing upload handlers.
+    """
+    algorithm = algorithm or default_algorithm()
+    digests = getattr(uploaded_file, 'digests', None) or {}
+    if algorithm in digests:
+        return algorithm, digests[algorithm]
+    hasher = new_hasher(algorithm)
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return algorithm, hasher.hexdigest()
@@ -0,0 +1,284 @@
+"""
+Importing a directory tree as documents (see ``manage.py import_tree``).
+
+``walk`` maps ``ROOT/<category>/<folder>/.../<file>`` onto categories,
+folders and documents: deeper directories become one folder named by their
+path (``Folder / Sub``), files directly in a category directory go into a
+folder of the category's name and files directly in ROOT into no folder.
+With a ``category`` every directory under ROOT is a folder of it instead.
+
+``import_batch`` takes a batch of those files through the same steps as an
+upload, in bulk: the files are hashed in worker processes (``digest_file``,
+one read for the blob's SHA-256, the FileHash digest and the chunk
+manifest), new contents are copied (or hard-linked, or compressed, see
+compression.py) into the blob store, and the document, version, hash,
+manifest, search and activity rows are written with ``bulk_create`` in one
+transaction, with the storage counters moved once per batch.
+
+Files whose content the owner already has are skipped, so an import that
+was interrupted simply picks up where it stopped when rerun; a file whose
+document (same folder, name and size) already exists is skipped without
+being read at all.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import Counter, defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import accounting, analytics, compression, hashing, integrity, listcache
+from .models import (
+    ActivityLog, Blob, Category, ChunkManifest, Document, DocumentVersion, FileHash, Folder, MonitoredFile,
+    SearchEntry, UsageRollup, blob_upload_path,
+)
+
+Candidate = namedtuple('Candidate', 'path name category folder size')
+
+
+def _field_length(model, field):
+    return model._meta.get_field(field).max_length
+
+
+# --- Walking ---
+def walk(root, category=None):
+    """Yield a Candidate for every regular file under ``root``, in a stable order; hidden files are left out."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        relative = os.path.relpath(dirpath, root)
+        parts = [] if relative == '.' else relative.split(os.sep)
+        if category is None:
+            category_name, folder_parts = (parts[0], parts[1:]) if parts else (None, [])
+        else:
+            category_name, folder_parts = category, parts
+        folder_name = ' / '.join(folder_parts) or category_name
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if filename.startswith('.') or os.path.islink(path) or not os.path.isfile(path):
+                continue
+            yield Candidate(
+                path, filename[:_field_length(Document, 'name')],
+                category_name and category_name[:_field_length(Category, 'name')],
+                folder_name and folder_name[:_field_length(Folder, 'name')],
+                os.path.getsize(path),
+            )
+
+
+def resolve_folders(user, candidates):
+    """``{(category name, folder name): folder id}`` for ``candidates``, creating what ``user`` lacks."""
+    wanted = {(c.category, c.folder) for c in candidates if c.folder is not None}
+    if not wanted:
+        return {}
+    categories = {}
+    rows = Category.objects.filter(created_by=user, name__in={c for c, _ in wanted})
+    for pk, name in rows.order_by('pk').values_list('pk', 'name'):
+        categories.setdefault(name, pk)
+    new_categories = sorted({c for c, _ in wanted} - set(categories))
+    for category in Category.objects.bulk_create([Category(name=name, created_by=user) for name in new_categories]):
+        categories[category.name] = category.pk
+
+    folders = {}
+    rows = Folder.objects.filter(category__in=categories.values(), name__in={f for _, f in wanted})
+    for pk, category_id, name in rows.order_by('pk').values_list('pk', 'category_id', 'name'):
+        folders.setdefault((category_id, name), pk)
+    new_folders = sorted({(categories[c], f) for c, f in wanted} - set(folders))
+    for folder in Folder.objects.bulk_create([Folder(category_id=c, name=f) for c, f in new_folders]):
+        folders[(folder.category_id, folder.name)] = folder.pk
+    if new_categories or new_folders:
+        # bulk_create sends no signals.
+        listcache.invalidate_tree([user.pk])
+        listcache.invalidate_folders([user.pk])
+    return {(c, f): folders[(categories[c], f)] for c, f in wanted}
+
+
+# --- Hashing ---
+def digest_file(task):
+    """Worker: the digests of one file in a single read. Runs in a separate process."""
+    path, algorithm, chunk_size = task
+    sha256 = hashlib.sha256()
+    digest = hashing.new_hasher(algorithm) if algorithm != 'sha256' else None
+    chunks = integrity.ChunkHasher(chunk_size) if chunk_size else None
+    size = 0
+    try:
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(hashing.buffer_size()), b''):
+                sha256.update(data)
+                if digest is not None:
+                    digest.update(data)
+                if chunks is not None:
+                    chunks.update(data)
+                size += len(data)
+    except OSError:
+        return None
+    return {
+        'sha256': sha256.hexdigest(),
+        'digest': (digest or sha256).hexdigest(),
+        'chunk_digests': chunks.finish() if chunks is not None else None,
+        'size': size,
+    }
+
+
+# --- Storing ---
+def _place(source, target, filename, size, link):
+    """
+    Put the content of ``source`` at ``target``, compressed if eligible;
+    return ``(codec, stored size)``. The file appears under its name only
+    once complete, replacing any leftover of an interrupted run.
+    """
+    with open(source, 'rb') as f:
+        codec = compression.choose_codec(filename, size, compression.read_sample(f))
+    if codec:
+        stored_size = compression.write(compression.file_chunks(source), target, codec, size)
+        if stored_size is not None:
+            return codec, stored_size
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    os.close(fd)
+    try:
+        if link:
+            os.remove(tmp)
+            try:
+                os.link(source, tmp)
+            except OSError:
+                # No hard links across filesystems (or on this one).
+                shutil.copyfile(source, tmp)
+        else:
+            shutil.copyfile(source, tmp)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return '', None
+
+
+def store_blobs(files, link=False):
+    """
+    Make sure a blob holds each ``{sha256: (path, filename, size)}`` and
+    return ``{sha256: blob}``. Blobs that end up without references (the
+    document rows failed) are removed by ``manage.py reconcile_media``.
+    """
+    storage = Blob._meta.get_field('file').storage
+    existing = {blob.sha256: blob for blob in Blob.objects.filter(sha256__in=files)}
+    written, new, repaired = [], [], []
+    try:
+        for sha256, (path, filename, size) in files.items():
+            blob = existing.get(sha256)
+            if blob is not None and blob.file and storage.exists(blob.file.name):
+                continue
+            if blob is None:
+                blob = Blob(sha256=sha256, size=size)
+                new.append(blob)
+            else:
+                repaired.append(blob)
+            blob.file.name = blob_upload_path(blob, filename)
+            target = storage.path(blob.file.name)
+            blob.codec, blob.stored_size = _place(path, target, filename, size, link)
+            written.append(target)
+        with transaction.atomic():
+            # A concurrent upload of the same content may have got in first;
+            # its row wins and points at the same content address.
+            Blob.objects.bulk_create(new, ignore_conflicts=True)
+            Blob.objects.bulk_update(repaired, ['file', 'size', 'codec', 'stored_size'])
+    except BaseException:
+        for target in written:
+            os.remove(target)
+        raise
+    return {blob.sha256: blob for blob in Blob.objects.filter(sha256__in=files)}
+
+
+# --- Importing ---
+def existing_documents(user, candidates):
+    """The ``(folder id, name, size)`` of ``user``'s live documents named like one of ``candidates``."""
+    return set(
+        Document.objects.filter(uploaded_by=user, is_deleted=False, name__in={c.name for c in candidates})
+        .values_list('folder_id', 'name', 'size')
+    )
+
+
+def known_contents(user, hashes):
+    """The subset of SHA-256 ``hashes`` that ``user`` already has a live document of."""
+    return set(
+        Document.objects.filter(uploaded_by=user, is_deleted=False, blob__sha256__in=hashes)
+        .values_list('blob__sha256', flat=True)
+    )
+
+
+def import_batch(user, candidates, folders, digests, link=False):
+    """
+    Create the documents for ``candidates``, given the ``folders`` from
+    ``resolve_folders`` and each file's ``digest_file`` result; contents
+    must be distinct. Returns the number of documents and bytes.
+    """
+    algorithm = hashing.default_algorithm()
+    chunk_size = integrity.manifest_chunk_size()
+    files = {}
+    for candidate, digest in zip(candidates, digests):
+        files.setdefault(digest['sha256'], (candidate.path, candidate.name, digest['size']))
+    if not files:
+        return 0, 0
+    blobs = store_blobs(files, link)
+    now = timezone.now()
+    with transaction.atomic():
+        docs = Document.objects.bulk_create([
+            Document(
+                name=candidate.name, file=blobs[digest['sha256']].file.name, blob=blobs[digest['sha256']],
+                size=digest['size'], versions_size=digest['size'],
+                folder_id=folders.get((candidate.category, candidate.folder)), uploaded_by=user,
+                uploaded_at=now, version_count=1,
+            )
+            for candidate, digest in zip(candidates, digests)
+        ])
+        versions = DocumentVersion.objects.bulk_create([
+            DocumentVersion(
+                document=doc, version_file=doc.file.name, blob=doc.blob, version_number=1,
+                hash_value=doc.blob.sha256, size=doc.size,
+            )
+            for doc in docs
+        ])
+        for doc, version in zip(docs, versions):
+            doc.current_version = version
+        Document.objects.bulk_update(docs, ['current_version'])
+        FileHash.objects.bulk_create([
+            FileHash(document=doc, algorithm=algorithm, hash_value=digest['digest'], file_size=doc.size)
+            for doc, digest in zip(docs, digests)
+        ])
+        MonitoredFile.objects.bulk_create([MonitoredFile(document=doc) for doc in docs])
+        ChunkManifest.objects.bulk_create([
+            ChunkManifest(
+                document=doc, chunk_size=chunk_size, file_size=doc.size, digests=digest['chunk_digests'],
+                merkle_root=integrity.merkle_root(digest['chunk_digests']),
+            )
+            for doc, digest in zip(docs, digests)
+            if digest['chunk_digests'] and len(digest['chunk_digests']) > integrity.DIGEST_SIZE
+        ])
+        # Contents are extracted later by ``manage.py rebuild_search_index --content``.
+        SearchEntry.objects.bulk_create([
+            SearchEntry(document=doc, owner=user, name=doc.name, folder=candidate.folder or '',
+                        category=candidate.category if candidate.folder else '')
+            for doc, candidate in zip(docs, candidates)
+        ])
+        ActivityLog.objects.bulk_create([
+            ActivityLog(user=user, action='upload', document=doc, timestamp=now) for doc in docs
+        ])
+        # New documents have no rollups yet, so theirs can be inserted directly.
+        UsageRollup.objects.bulk_create([
+            UsageRollup(document=doc, owner=user, action='upload', granularity=granularity, bucket=bucket, count=1)
+            for doc in docs for granularity, bucket in analytics.buckets_for(now)
+        ])
+
+        # Every document and its version hold one reference each.
+        refs = Counter()
+        for doc in docs:
+            refs[doc.blob_id] += 2
+        by_count = defaultdict(list)
+        for blob_id, count in refs.items():
+            by_count[count].append(blob_id)
+        for count, blob_ids in by_count.items():
+            Blob.objects.filter(pk__in=blob_ids).update(ref_count=F('ref_count') + count)
+        accounting.adjust_users([(user.pk, doc.versions_size, 1) for doc in docs])
+        accounting.adjust_folders([(doc.folder_id, doc.versions_size, 1) for doc in docs])
+    return len(docs), sum(doc.size for doc in docs)
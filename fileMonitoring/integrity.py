@@ -0,0 +1,165 @@
+"""
+Chunk manifests: fixed-size SHA-256 chunk digests combined into a Merkle root.
+
+A manifest lets an integrity check re-hash only some chunks (sampling or
+suspect ranges), hash chunks of one large file in parallel, and report which
+byte ranges changed instead of just "tampered".
+"""
+import hashlib
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import compression, metrics
+from .models import ChunkManifest
+
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def manifest_chunk_size():
+    return getattr(settings, 'DMS_CHUNK_MANIFEST_SIZE', None)
+
+
+class ChunkHasher:
+    """Feeds a byte stream of any chunking into fixed-size chunk digests."""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.digests = bytearray()
+        self._current = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.chunk_size - self._filled)
+            self._current.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == self.chunk_size:
+                self._close_chunk()
+
+    def _close_chunk(self):
+        self.digests += self._current.digest()
+        self._current = hashlib.sha256()
+        self._filled = 0
+
+    def finish(self):
+        if self._filled:
+            self._close_chunk()
+        return bytes(self.digests)
+
+
+def iter_digests(packed):
+    for offset in range(0, len(packed), DIGEST_SIZE):
+        yield packed[offset:offset + DIGEST_SIZE]
+
+
+def merkle_root(packed):
+    level = list(iter_digests(packed))
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    while len(level) > 1:
+        paired = []
+        for i in range(0, len(level) - 1, 2):
+            paired.append(hashlib.sha256(b'\x01' + level[i] + level[i + 1]).digest())
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+
+def hash_chunk(path, index, chunk_size):
+    digest = hashlib.sha256()
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(index * chunk_size)
+        remaining = chunk_size
+        while remaining:
+            data = f.read(min(remaining, 1024 * 1024))
+            if not data:
+                break
+            digest.update(data)
+            remaining -= len(data)
+    return digest.digest()
+
+
+def build_manifest_digests(path, chunk_size):
+    hasher = ChunkHasher(chunk_size)
+    with compression.open_file(path) as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(data)
+    return hasher.finish()
+
+
+def verify_chunks(path, manifest, indexes=None, workers=None):
+    """
+    Re-hash the given chunk indexes (all by default) of ``path`` against
+    ``manifest`` and return the damaged byte ranges as ``[[start, end], ...]``
+    with ``end`` exclusive. A size change is reported as damage over the
+    added or missing tail.
+    """
+    chunk_size = manifest.chunk_size
+    expected = bytes(manifest.digests)
+    count = len(expected) // DIGEST_SIZE
+    codec, size = compression.describe(path)
+    if indexes is None:
+        indexes = range(count)
+    indexes = [i for i in indexes if 0 <= i < count]
+
+    if codec:
+        # A compressed file can only be read in order; decompress it once.
+        with metrics.timer('verify_chunks', size):
+            packed = build_manifest_digests(path, chunk_size)
+        damaged = [
+            i for i in indexes
+            if packed[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE] != expected[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]
+        ]
+    else:
+        workers = workers or min(8, os.cpu_count() or 1)
+        # hashlib releases the GIL on large updates, so threads hash in parallel.
+        with metrics.timer('verify_chunks', size), ThreadPoolExecutor(max_workers=workers) as pool:
+            actual = pool.map(lambda i: hash_chunk(path, i, chunk_size), indexes)
+            damaged = [
+                i for i, digest in zip(indexes, actual)
+                if digest != expected[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]
+            ]
+
+    ranges = [[i * chunk_size, min((i + 1) * chunk_size, manifest.file_size)] for i in damaged]
+    if size != manifest.file_size:
+        ranges.append([min(size, manifest.file_size), max(size, manifest.file_size)])
+    return merge_ranges(ranges)
+
+
+def sample_indexes(manifest, sample_size):
+    count = len(manifest.digests) // DIGEST_SIZE
+    return sorted(random.sample(range(count), min(sample_size, count)))
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def save_manifest(document, digests, chunk_size, file_size):
+    """Create or replace ``document``'s manifest; files of one chunk get none."""
+    if not digests or len(digests) <= DIGEST_SIZE:
+        ChunkManifest.objects.filter(document=document).delete()
+        return None
+    manifest, _ = ChunkManifest.objects.update_or_create(
+        document=document,
+        defaults={
+            'chunk_size': chunk_size,
+            'file_size': file_size,
+            'digests': digests,
+            'merkle_root': merkle_root(digests),
+        },
+    )
+    return manifest
+
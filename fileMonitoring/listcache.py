@@ -0,0 +1,148 @@
+"""
+Cached read-mostly listings: each user's category/folder tree and folder
+picker, and the shared-document pages.
+
+Entries live in the Django cache named by DMS_LIST_CACHE (the local-memory
+``default`` cache unless configured otherwise) and are stored under the
+current generation of their namespace as the cache ``version``. Invalidating
+bumps the generation after the change commits, so stale entries are never
+read again and simply age out. signals.py invalidates on saves and deletes of
+categories, folders and shared documents; code that changes them with
+``.update()`` (bulk operations, storage counters, purges) calls the
+``invalidate_*`` functions itself.
+
+Hits and misses are counted per namespace in this process (see ``stats()``)
+and exported as ``dms_list_cache_requests_total`` by metrics.py.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics
+from .models import Category, Document, Folder
+from .pagination import DOCUMENT_SORTS, paginate
+
+lookups = metrics.Counter(
+    'dms_list_cache_requests_total', "Cached listing lookups by namespace and result.", ('namespace', 'result'),
+)
+
+
+def enabled():
+    return getattr(settings, 'DMS_LIST_CACHE_ENABLED', True)
+
+
+def timeout():
+    return getattr(settings, 'DMS_LIST_CACHE_TIMEOUT', 300)
+
+
+def get_cache():
+    return caches[getattr(settings, 'DMS_LIST_CACHE', 'default')]
+
+
+# --- Generations ---
+def _generation_key(namespace, scope):
+    return f'dms:gen:{namespace}:{scope}'
+
+
+def generation(namespace, scope=''):
+    cache = get_cache()
+    key = _generation_key(namespace, scope)
+    value = cache.get(key)
+    if value is None:
+        # Never restart from 1 after an eviction: entries stored under an
+        # old generation could still be around.
+        cache.add(key, time.time_ns(), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+def _bump(namespace, scopes):
+    cache = get_cache()
+    for scope in scopes:
+        key = _generation_key(namespace, scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate(namespace, scopes=('',)):
+    """Drop ``namespace``'s entries for ``scopes`` once the current transaction commits."""
+    if not enabled():
+        return
+    scopes = set(scopes)
+    if scopes:
+        transaction.on_commit(lambda: _bump(namespace, scopes))
+
+
+def _invalidate_users(namespace, user_ids):
+    # Checked first so a queryset of user ids isn't run for a disabled cache.
+    if enabled():
+        invalidate(namespace, [user_id for user_id in user_ids if user_id is not None])
+
+
+def invalidate_tree(user_ids):
+    _invalidate_users('tree', user_ids)
+
+
+def invalidate_folders(user_ids):
+    _invalidate_users('folders', user_ids)
+
+
+def invalidate_shared():
+    invalidate('shared')
+
+
+# --- Reading ---
+def cached(namespace, key, build, scope=''):
+    """Return the cached value of ``build()`` for ``key`` in ``namespace``."""
+    if not enabled():
+        return build()
+    cache = get_cache()
+    version = generation(namespace, scope)
+    key = f'dms:{namespace}:{key}'
+    value = cache.get(key, version=version)
+    lookups.inc(1, namespace, 'misses' if value is None else 'hits')
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout(), version=version)
+    return value
+
+
+def stats():
+    """``{namespace: {'hits', 'misses'}}`` counted in this process."""
+    counts = {}
+    for (namespace, result), value in lookups.values().items():
+        counts.setdefault(namespace, {'hits': 0, 'misses': 0})[result] = value
+    return counts
+
+
+def folder_tree(user):
+    """``user``'s categories, each with its folders prefetched."""
+    return cached('tree', user.pk, lambda: list(
+        Category.objects.filter(created_by=user).prefetch_related('folder_set')
+    ), scope=user.pk)
+
+
+def folder_choices(user):
+    """``user``'s folders with their categories, for folder pickers."""
+    return cached('folders', user.pk, lambda: list(
+        Folder.objects.filter(category__created_by=user).select_related('category')
+    ), scope=user.pk)
+
+
+def shared_page(request):
+    """One page of the documents other users shared with ``request.user``."""
+    sort = request.GET.get('sort')
+    if sort not in DOCUMENT_SORTS:
+        sort = 'date'
+    cursor = request.GET.get('cursor') or ''
+    field, descending = DOCUMENT_SORTS[sort]
+
+    def build():
+        files = Document.objects.filter(is_shared=True, is_deleted=False).exclude(uploaded_by=request.user) \
+            .select_related('uploaded_by')
+        return paginate(files, field, descending, cursor, sort=sort)
+    return cached('shared', f'{request.user.pk}:{sort}:{cursor}', build)
@@ -0,0 +1,263 @@
+import asyncio
+import os
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from fileMonitoring import blobstore, uploads
+from fileMonitoring.management.commands.benchmark_hashing import parse_size
+from fileMonitoring.models import Document, UploadSession, UserProfile
+
+try:
+    import uvicorn
+except ImportError:  # optional dependency
+    uvicorn = None
+
+USERNAME = 'benchmark_asgi'
+DEFAULT_CLIENTS = '10,100,1000'
+# Small client buffers, so a slow reader really holds the server back
+# instead of the kernel taking the whole response at once.
+CLIENT_BUFFER = 16 * 1024
+PIECE = 16 * 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """A WSGI server with a fixed number of worker threads, like a gunicorn gthread worker."""
+    request_queue_size = 4096
+    daemon_threads = True
+
+    def __init__(self, *args, threads=32, **kwargs):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the file-transfer views under a thread-pool WSGI server and under uvicorn (ASGI) "
+        "with many concurrent slow clients. Uses the configured database and MEDIA_ROOT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default=DEFAULT_CLIENTS,
+                            help=f"Comma separated numbers of concurrent clients (default: {DEFAULT_CLIENTS}).")
+        parser.add_argument('--mode', choices=('download', 'upload'), default='download',
+                            help="Slow downloads of one document, or slow resumable-upload chunk PUTs.")
+        parser.add_argument('--size', default='1M', help="Bytes each client transfers (default: 1M).")
+        parser.add_argument('--rate', default='256K', help="Bytes per second each client sends or reads.")
+        parser.add_argument('--servers', default='wsgi,asgi', help="Which servers to run: wsgi, asgi or both.")
+        parser.add_argument('--wsgi-threads', type=int, default=32, help="Worker threads of the WSGI server.")
+        parser.add_argument('--timeout', type=float, default=600, help="Seconds before a client gives up.")
+
+    def handle(self, *args, **options):
+        clients = [int(n) for n in options['clients'].split(',') if n.strip()]
+        servers = [s.strip() for s in options['servers'].split(',') if s.strip()]
+        if set(servers) - {'wsgi', 'asgi'}:
+            raise CommandError("--servers takes wsgi and/or asgi.")
+        if 'asgi' in servers and uvicorn is None:
+            raise CommandError("The ASGI benchmark needs uvicorn (pip install uvicorn), or use --servers wsgi.")
+        self.size = parse_size(options['size'])
+        self.rate = parse_size(options['rate'])
+        self.timeout = options['timeout']
+        self.mode = options['mode']
+
+        user, cookies, target = self.set_up(self.size)
+        try:
+            self.stdout.write(
+                f"{'server':>6} {'clients':>8} {'ok':>6} {'failed':>7} {'wall s':>8} "
+                f"{'p50 s':>7} {'p95 s':>7} {'max s':>7} {'MB/s':>7} {'threads':>8}"
+            )
+            for server in servers:
+                for count in clients:
+                    result = self.run(server, count, cookies, target, options['wsgi_threads'])
+                    self.stdout.write(
+                        f"{server:>6} {count:>8} {result['ok']:>6} {result['failed']:>7} {result['wall']:>8.1f} "
+                        f"{result['p50']:>7.2f} {result['p95']:>7.2f} {result['max']:>7.2f} "
+                        f"{result['mbps']:>7.1f} {result['threads']:>8}"
+                    )
+        finally:
+            self.tear_down(user)
+        self.stdout.write(
+            f"Each client moves {self.size} bytes at {self.rate} bytes/s (ideal {self.size / self.rate:.1f}s). "
+            "'threads' is the most threads this process had while a run was going."
+        )
+
+    # --- Data ---
+    def set_up(self, size):
+        self.tear_down(User.objects.filter(username=USERNAME).first())
+        user = User.objects.create_user(USERNAME, password=get_random_string(20))
+        UserProfile.objects.create(user=user, role='standard')
+        client = Client()
+        client.force_login(user)
+        csrf_token = get_random_string(32)
+        cookies = f"sessionid={client.cookies['sessionid'].value}; csrftoken={csrf_token}"
+        self.csrf_token = csrf_token
+
+        if self.mode == 'download':
+            blob = blobstore.store_file(ContentFile(os.urandom(size), name='benchmark.bin'), refs=2)
+            doc = uploads.create_document(user, 'benchmark.bin', None, blob, ('sha256', blob.sha256))
+            return user, cookies, ('GET', reverse('download_document', args=[doc.pk]), 0)
+        # Every client re-sends chunk 0 of one session.
+        session = uploads.create_session(user, 'benchmark.bin', size)
+        return user, cookies, ('PUT', reverse('upload_chunk', args=[session.pk, 0]), session.chunk_length(0))
+
+    def tear_down(self, user):
+        if user is None:
+            return
+        blobstore.delete_documents(Document.objects.filter(uploaded_by=user))
+        for session in UploadSession.objects.filter(user=user):
+            uploads.discard(session)
+        user.delete()
+
+    # --- Servers ---
+    def start_server(self, kind, port, threads):
+        if kind == 'wsgi':
+            server = make_server(
+                '127.0.0.1', port, get_wsgi_application(),
+                server_class=lambda *a, **kw: PooledWSGIServer(*a, threads=threads, **kw),
+                handler_class=QuietHandler,
+            )
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+
+            def stop():
+                server.shutdown()
+                server.server_close()
+            return stop
+
+        config = uvicorn.Config(
+            get_asgi_application(), host='127.0.0.1', port=port, lifespan='off',
+            log_level='warning', backlog=4096, timeout_keep_alive=1,
+        )
+        server = uvicorn.Server(config)
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+        return stop
+
+    def run(self, kind, count, cookies, target, threads):
+        port = free_port()
+        stop = self.start_server(kind, port, threads)
+        peak = [threading.active_count()]
+        done = threading.Event()
+
+        def sample():
+            while not done.is_set():
+                peak[0] = max(peak[0], threading.active_count())
+                time.sleep(0.05)
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            started = time.perf_counter()
+            results = asyncio.run(self.clients(port, count, cookies, target))
+            wall = time.perf_counter() - started
+        finally:
+            done.set()
+            sampler.join()
+            stop()
+
+        times = sorted(t for t in results if t is not None)
+        ok = len(times)
+        return {
+            'ok': ok,
+            'failed': count - ok,
+            'wall': wall,
+            'p50': statistics.median(times) if times else 0.0,
+            'p95': times[int(0.95 * (ok - 1))] if times else 0.0,
+            'max': times[-1] if times else 0.0,
+            'mbps': ok * self.size / wall / 1e6,
+            'threads': peak[0],
+        }
+
+    # --- Clients ---
+    async def clients(self, port, count, cookies, target):
+        return await asyncio.gather(*[self.client(port, cookies, target) for _ in range(count)])
+
+    async def client(self, port, cookies, target):
+        """One slow client; returns its total time, or None if it failed."""
+        method, path, body_size = target
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CLIENT_BUFFER)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_BUFFER)
+        sock.setblocking(False)
+        started = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+            reader, writer = await asyncio.open_connection(sock=sock)
+            return await asyncio.wait_for(self.exchange(reader, writer, method, path, body_size, cookies, started),
+                                          self.timeout)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            sock.close()
+            return None
+
+    async def exchange(self, reader, writer, method, path, body_size, cookies, started):
+        headers = [
+            f'{method} {path} HTTP/1.1', 'Host: localhost', f'Cookie: {cookies}', 'Connection: close',
+        ]
+        if method == 'PUT':
+            headers += [
+                f'X-CSRFToken: {self.csrf_token}', 'Content-Type: application/octet-stream',
+                f'Content-Length: {body_size}',
+            ]
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode())
+        await writer.drain()
+        body = b'x' * PIECE
+        sent = 0
+        while sent < body_size:
+            n = min(PIECE, body_size - sent)
+            writer.write(body[:n])
+            await writer.drain()
+            sent += n
+            await asyncio.sleep(n / self.rate)
+
+        status = await reader.readline()
+        received = 0
+        while True:
+            data = await reader.read(PIECE)
+            if not data:
+                break
+            received += len(data)
+            if method == 'GET':
+                await asyncio.sleep(len(data) / self.rate)
+        writer.close()
+        if not status.split(b' ')[1:2] == [b'200']:
+            return None
+        if method == 'GET' and received < self.size:
+            return None
+        return time.perf_counter() - started
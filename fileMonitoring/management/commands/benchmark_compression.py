@@ -0,0 +1,148 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from fileMonitoring import compression
+from fileMonitoring.management.commands.benchmark_hashing import parse_size
+from fileMonitoring.models import Blob
+
+CODECS = ('zlib', 'lzma')
+SAMPLES = ('csv', 'json', 'xml', 'log', 'random')
+
+
+def sample_data(kind, size, rng):
+    """``size`` bytes of synthetic ``kind`` content, roughly as repetitive as the real thing."""
+    words = ['invoice', 'contract', 'report', 'draft', 'final', 'approved', 'pending', 'review', 'budget', 'q3']
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        if kind == 'csv':
+            line = (f"{i},{rng.choice(words)},{rng.randint(1, 10 ** 6)},{rng.random():.4f},"
+                    f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}\n")
+        elif kind == 'json':
+            line = json.dumps({'id': i, 'name': rng.choice(words), 'amount': rng.randint(1, 10 ** 6),
+                               'tags': rng.sample(words, 3)}) + ',\n'
+        elif kind == 'xml':
+            line = f'<row id="{i}"><name>{rng.choice(words)}</name><amount>{rng.randint(1, 10 ** 6)}</amount></row>\n'
+        elif kind == 'log':
+            line = (f"2024-05-{rng.randint(1, 28):02d} 12:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} "
+                    f"INFO request {rng.choice(words)} user={rng.randint(1, 500)} took {rng.randint(1, 900)}ms\n")
+        else:
+            line = None
+        if line is None:
+            return rng.randbytes(size)
+        parts.append(line)
+        total += len(line)
+        i += 1
+    return ''.join(parts).encode()[:size]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure compression at rest: CPU time to compress and decompress against the bytes saved, "
+        "per codec, on synthetic samples, given files, or a sample of the stored blobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', default='8M', help="Size of each synthetic sample (default: 8M).")
+        parser.add_argument('--files', nargs='*', default=(), help="Measure these files instead of synthetic samples.")
+        parser.add_argument('--stored', type=int, default=0, metavar='N',
+                            help="Measure N randomly chosen stored blobs of the DMS_COMPRESSION_TYPES types instead.")
+        parser.add_argument('--dir', default=None, help="Directory for the work files (default: MEDIA_ROOT).")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per file and codec; the best run is kept.")
+
+    def handle(self, *args, **options):
+        base_dir = options['dir'] or settings.MEDIA_ROOT
+        os.makedirs(base_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='compress-bench-', dir=base_dir)
+        try:
+            inputs = self.inputs(options, work_dir)
+            if not inputs:
+                raise CommandError("Nothing to measure.")
+            self.run(inputs, work_dir, options['repeat'])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def run(self, inputs, work_dir, repeat):
+        totals = {codec: {'bytes': 0, 'saved': 0, 'compress': 0.0, 'decompress': 0.0} for codec in CODECS}
+        self.stdout.write(
+            f"{'input':<28} {'size':>9} {'codec':>5} {'ratio':>6} {'saved':>9} "
+            f"{'comp MB/s':>10} {'decomp MB/s':>12} {'chosen':>7}"
+        )
+        for label, path in inputs:
+            size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                sample = f.read(compression.SAMPLE_SIZE)
+            for codec in CODECS:
+                result = self.measure(path, size, codec, work_dir, repeat)
+                chosen = compression.ratio(sample, codec) >= compression.min_ratio()
+                total = totals[codec]
+                total['bytes'] += size
+                total['compress'] += result['compress']
+                total['decompress'] += result['decompress']
+                if chosen:
+                    total['saved'] += size - result['stored']
+                self.stdout.write(
+                    f"{label[:28]:<28} {filesizeformat(size):>9} {codec:>5} {size / max(1, result['stored']):>6.2f} "
+                    f"{filesizeformat(size - result['stored']):>9} {size / result['compress'] / 1e6:>10.1f} "
+                    f"{size / result['decompress'] / 1e6:>12.1f} {'yes' if chosen else 'no':>7}"
+                )
+
+        self.stdout.write("")
+        for codec, total in totals.items():
+            gigabytes = total['saved'] / 1024 ** 3
+            self.stdout.write(
+                f"{codec}: saves {filesizeformat(total['saved'])} of {filesizeformat(total['bytes'])} "
+                f"for {total['compress']:.2f}s CPU to compress and {total['decompress']:.2f}s per full read"
+                + (f" ({total['compress'] / gigabytes:.0f}s per GB saved)" if gigabytes else "")
+            )
+        self.stdout.write(
+            f"'chosen' is whether a file would be compressed at DMS_COMPRESSION_MIN_RATIO = {compression.min_ratio()}."
+        )
+
+    def inputs(self, options, work_dir):
+        if options['stored']:
+            extensions = compression.codec_types()
+            inputs = []
+            for blob in Blob.objects.filter(codec='').exclude(file='').only('file').order_by('?').iterator():
+                if os.path.splitext(blob.file.name)[1].lower() in extensions and os.path.exists(blob.file.path):
+                    inputs.append((os.path.basename(blob.file.name), blob.file.path))
+                    if len(inputs) >= options['stored']:
+                        break
+            return inputs
+        if options['files']:
+            return [(os.path.basename(path), path) for path in options['files']]
+
+        size = parse_size(options['size'])
+        rng = random.Random(0)
+        inputs = []
+        for kind in SAMPLES:
+            path = os.path.join(work_dir, f'sample.{kind}')
+            with open(path, 'wb') as f:
+                f.write(sample_data(kind, size, rng))
+            inputs.append((f'synthetic {kind}', path))
+        return inputs
+
+    def measure(self, path, size, codec, work_dir, repeat):
+        target = os.path.join(work_dir, f'stored.{codec}')
+        best = {'compress': float('inf'), 'decompress': float('inf'), 'stored': size}
+        for _ in range(max(1, repeat)):
+            started = time.process_time()
+            stored = compression.write(compression.file_chunks(path), target, codec, size, required_ratio=0)
+            best['compress'] = min(best['compress'], max(time.process_time() - started, 1e-9))
+            best['stored'] = stored
+            started = time.process_time()
+            with compression.open_file(target) as f:
+                while f.read(compression.CHUNK_SIZE):
+                    pass
+            best['decompress'] = min(best['decompress'], max(time.process_time() - started, 1e-9))
+        os.remove(target)
+        return best
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fileMonitoring import hashing
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+DEFAULT_SIZES = '1K,64K,1M,16M,256M,1G,4G'
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def drop_page_cache(path):
+    # Measure disk reads, not a file that is still in the page cache.
+    if hasattr(os, 'posix_fadvise'):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+class Command(BaseCommand):
+    help = "Benchmark file hashing strategies and algorithms on the local disk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                            help=f"Comma separated file sizes (default: {DEFAULT_SIZES}).")
+        parser.add_argument('--dir', default=None,
+                            help="Directory for the test files (default: MEDIA_ROOT, i.e. the disk documents live on).")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Runs per combination; the best run is kept.")
+        parser.add_argument('--warm', action='store_true',
+                            help="Leave files in the page cache instead of evicting them before each run.")
+
+    def handle(self, *args, **options):
+        sizes = [parse_size(s) for s in options['sizes'].split(',') if s.strip()]
+        base_dir = options['dir'] or settings.MEDIA_ROOT
+        os.makedirs(base_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='hash-bench-', dir=base_dir)
+
+        combos = [(s, a) for s in hashing.STRATEGIES for a in hashing.ALGORITHMS]
+        totals = {combo: 0.0 for combo in combos}
+        try:
+            header = f"{'size':>8}  " + "  ".join(f"{s + '/' + a:>20}" for s, a in combos)
+            self.stdout.write(header + "   (MB/s)")
+            for size in sizes:
+                if shutil.disk_usage(work_dir).free < size * 2:
+                    self.stdout.write(self.style.WARNING(f"Skipping {size} bytes: not enough free disk space."))
+                    continue
+                path = self.make_file(work_dir, size)
+                row = []
+                for combo in combos:
+                    best = self.measure(path, *combo, options['repeat'], options['warm'])
+                    totals[combo] += best
+                    row.append(size / best / 1e6 if best else 0.0)
+                os.remove(path)
+                self.stdout.write(f"{self.human(size):>8}  " + "  ".join(f"{mbps:>20.1f}" for mbps in row))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if not any(totals.values()):
+            raise CommandError("No sizes could be benchmarked.")
+
+        # Total time across all sizes is dominated by the large files, which
+        # is where the choice matters.
+        strategy = min(hashing.STRATEGIES, key=lambda s: totals[(s, hashing.default_algorithm())])
+        algorithm = min(hashing.ALGORITHMS, key=lambda a: totals[(strategy, a)])
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS(
+            f"Fastest on this disk: DMS_HASH_STRATEGY = '{strategy}', "
+            f"DMS_HASH_ALGORITHM = '{algorithm}'"
+        ))
+        self.stdout.write(
+            f"Current settings: DMS_HASH_STRATEGY = '{hashing.default_strategy()}', "
+            f"DMS_HASH_ALGORITHM = '{hashing.default_algorithm()}'"
+        )
+
+    def make_file(self, work_dir, size):
+        path = os.path.join(work_dir, f"bench-{size}.bin")
+        block = os.urandom(min(size, 4 * 1024 * 1024)) or b''
+        with open(path, 'wb') as f:
+            written = 0
+            while written < size:
+                n = min(len(block), size - written)
+                f.write(block[:n])
+                written += n
+        return path
+
+    def measure(self, path, strategy, algorithm, repeat, warm):
+        best = None
+        for _ in range(max(1, repeat)):
+            if not warm:
+                drop_page_cache(path)
+            started = time.perf_counter()
+            hashing.hash_file(path, algorithm, strategy)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    @staticmethod
+    def human(size):
+        for unit in ('G', 'M', 'K'):
+            if size >= UNITS[unit] and size % UNITS[unit] == 0:
+                return f"{size // UNITS[unit]}{unit}"
+        return str(size)
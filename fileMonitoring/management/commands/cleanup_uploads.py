@@ -0,0 +1,33 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from fileMonitoring import uploads
+from fileMonitoring.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete expired resumable upload sessions and stray upload files."
+
+    def handle(self, *args, **options):
+        expired = uploads.purge_expired()
+
+        # Data files whose session row is gone (e.g. deleted through the admin).
+        directory = uploads.upload_dir()
+        max_age = getattr(settings, 'DMS_UPLOAD_EXPIRY_HOURS', 24) * 3600
+        live = {str(pk) for pk in UploadSession.objects.values_list('id', flat=True)}
+        stray = 0
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                session_id, ext = os.path.splitext(entry.name)
+                if ext != '.part' or session_id in live:
+                    continue
+                if time.time() - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    stray += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {expired} expired upload sessions and {stray} stray upload files."
+        ))
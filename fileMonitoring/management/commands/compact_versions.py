@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from fileMonitoring import versions
+from fileMonitoring.models import Document, DocumentVersion
+
+
+class Command(BaseCommand):
+    help = (
+        "Store eligible older document versions as deltas against the next version. New versions are "
+        "not compacted as they are uploaded; run this from cron, e.g. hourly with --since 2."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document', type=int, action='append', dest='documents',
+                            help="Only this document id (repeatable).")
+        parser.add_argument('--since', type=float, metavar='HOURS',
+                            help="Only documents that got a new version in the last HOURS hours.")
+
+    def handle(self, *args, **options):
+        documents = Document.objects.annotate(n=Count('versions')).filter(n__gt=1)
+        if options['documents']:
+            documents = documents.filter(id__in=options['documents'])
+        if options['since'] is not None:
+            cutoff = timezone.now() - timedelta(hours=options['since'])
+            documents = documents.filter(
+                id__in=DocumentVersion.objects.filter(created_at__gte=cutoff).values('document')
+            )
+        converted = scanned = 0
+        for doc_id in documents.values_list('id', flat=True).iterator():
+            converted += versions.compact_document(doc_id)
+            scanned += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {converted} versions as deltas across {scanned} documents."
+        ))
@@ -0,0 +1,116 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from fileMonitoring import hashing, importing, integrity
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a directory tree for a user: top-level directories become categories, the directories "
+        "under them folders (deeper ones a folder named 'Folder / Sub'). Files are hashed in parallel, "
+        "copied into the blob store and recorded in bulk, BATCH_SIZE per transaction. Files whose content "
+        "the user already has are skipped, so an interrupted import resumes when rerun. Quotas are not "
+        "enforced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help="Directory to import.")
+        parser.add_argument('--user', required=True, help="Username that will own the documents.")
+        parser.add_argument('--category',
+                            help="Import into this category: the directories under ROOT become its folders.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Hashing processes (default: CPU count; 1 hashes inline).")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Files per transaction (default 500).")
+        parser.add_argument('--link', action='store_true',
+                            help="Hard-link files into storage instead of copying them (falls back to a copy "
+                                 "across filesystems). Only if the source files won't be changed afterwards.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the files that would be considered.")
+
+    def handle(self, *args, **options):
+        root = options['root']
+        if not os.path.isdir(root):
+            raise CommandError(f"{root} is not a directory.")
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--batch-size and --workers must be positive.")
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"No user named {options['user']}.")
+
+        candidates = importing.walk(root, options['category'])
+        if options['dry_run']:
+            files = size = 0
+            for candidate in candidates:
+                files += 1
+                size += candidate.size
+            self.stdout.write(f"{files} files ({filesizeformat(size)}) under {root}.")
+            return
+
+        self.user = user
+        self.link = options['link']
+        self.task = (hashing.default_algorithm(), integrity.manifest_chunk_size())
+        self.totals = {'imported': 0, 'bytes': 0, 'existing': 0, 'duplicates': 0, 'unreadable': 0}
+        started = time.monotonic()
+        pool = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        try:
+            while True:
+                batch = list(itertools.islice(candidates, options['batch_size']))
+                if not batch:
+                    break
+                self.run_batch(pool, batch, options['workers'])
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"  {self.totals['imported']} imported")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        t = self.totals
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {t['imported']} files ({filesizeformat(t['bytes'])}) in {elapsed:.1f}s; skipped "
+            f"{t['existing']} already imported, {t['duplicates']} whose content the user already has and "
+            f"{t['unreadable']} unreadable."
+        ))
+        if t['imported']:
+            self.stdout.write("Run `manage.py rebuild_search_index --content` to index their contents.")
+
+    def run_batch(self, pool, batch, workers):
+        folders = importing.resolve_folders(self.user, batch)
+        existing = importing.existing_documents(self.user, batch)
+        pending = []
+        for candidate in batch:
+            if (folders.get((candidate.category, candidate.folder)), candidate.name, candidate.size) in existing:
+                self.totals['existing'] += 1
+            else:
+                pending.append(candidate)
+        if not pending:
+            return
+
+        tasks = [(candidate.path, *self.task) for candidate in pending]
+        if pool is None:
+            digests = list(map(importing.digest_file, tasks))
+        else:
+            digests = list(pool.map(importing.digest_file, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+
+        known = importing.known_contents(self.user, [d['sha256'] for d in digests if d is not None])
+        seen = set()
+        selected, selected_digests = [], []
+        for candidate, digest in zip(pending, digests):
+            if digest is None:
+                self.totals['unreadable'] += 1
+                self.stderr.write(f"unreadable: {candidate.path}")
+            elif digest['sha256'] in known or digest['sha256'] in seen:
+                self.totals['duplicates'] += 1
+            else:
+                seen.add(digest['sha256'])
+                selected.append(candidate)
+                selected_digests.append(digest)
+        imported, size = importing.import_batch(self.user, selected, folders, selected_digests, self.link)
+        self.totals['imported'] += imported
+        self.totals['bytes'] += size
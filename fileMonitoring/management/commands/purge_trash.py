@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from fileMonitoring import retention
+
+
+class Command(BaseCommand):
+    help = "Permanently delete documents that have been in the trash longer than DMS_TRASH_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Documents deleted per transaction.")
+        parser.add_argument('--limit', type=int, help="Stop after this many documents.")
+
+    def handle(self, *args, **options):
+        days = retention.retention_days()
+        if days is None:
+            self.stdout.write("DMS_TRASH_RETENTION_DAYS is None; trash is kept forever.")
+            return
+        purged = retention.purge_expired(batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {purged} documents trashed more than {days} days ago."
+        ))
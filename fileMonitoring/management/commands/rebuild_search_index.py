@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from fileMonitoring import search
+from fileMonitoring.models import Document, SearchEntry
+
+
+class Command(BaseCommand):
+    help = "Rebuild the document search index, optionally re-extracting file contents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--content', action='store_true',
+                            help="Extract text from files whose content is missing or stale.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Threads used for text extraction (1 runs inline).")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rows = Document.objects.values_list(
+            'id', 'uploaded_by_id', 'name', 'folder__name', 'folder__category__name', 'file',
+        ).order_by('id')
+
+        last_id, indexed, stale = 0, 0, []
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            entries = [
+                SearchEntry(document_id=doc_id, owner_id=owner_id, name=name, folder=folder or '',
+                            category=category or '')
+                for doc_id, owner_id, name, folder, category, _ in batch
+            ]
+            with transaction.atomic():
+                SearchEntry.objects.bulk_create(
+                    entries, update_conflicts=True,
+                    unique_fields=['document'], update_fields=['owner', 'name', 'folder', 'category'],
+                )
+            indexed += len(entries)
+            if options['content']:
+                current = dict(SearchEntry.objects.filter(
+                    document_id__in=[row[0] for row in batch]
+                ).values_list('document_id', 'content_source'))
+                stale += [row[0] for row in batch if current.get(row[0]) != row[5]]
+
+        if options['workers'] > 1 and len(stale) > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                list(pool.map(self.extract, stale))
+        else:
+            for doc_id in stale:
+                search.extract_content(doc_id)
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'INSERT INTO "{search.FTS_TABLE}"("{search.FTS_TABLE}") VALUES (\'optimize\')')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} documents; extracted contents of {len(stale)}."
+        ))
+
+    @staticmethod
+    def extract(doc_id):
+        try:
+            search.extract_content(doc_id)
+        finally:
+            connection.close()
@@ -0,0 +1,58 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from fileMonitoring import analytics
+from fileMonitoring.models import ActivityLog, UsageRollup, UsageStat
+
+
+class Command(BaseCommand):
+    help = "Recompute the usage rollups behind the analytics page from UsageStat and ActivityLog."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        usage = UsageStat.objects.values_list(
+            'id', 'document_id', 'document__uploaded_by_id', 'action', 'accessed_at',
+        )
+        activity = ActivityLog.objects.filter(
+            action__in=analytics.ROLLUP_ACTIVITIES, document__isnull=False,
+        ).values_list('id', 'document_id', 'document__uploaded_by_id', 'action', 'timestamp')
+
+        # Rollups are small next to UsageStat, so count everything in memory
+        # and write the result in one pass.
+        counts, owners = Counter(), {}
+        scanned = 0
+        for rows in (usage, activity):
+            for batch in self._batches(rows.order_by('id'), batch_size):
+                scanned += len(batch)
+                for _, doc_id, owner_id, action, when in batch:
+                    owners[doc_id] = owner_id
+                    for granularity, bucket in analytics.buckets_for(when):
+                        counts[(doc_id, action, granularity, bucket)] += 1
+
+        rollups = [
+            UsageRollup(document_id=doc_id, owner_id=owners[doc_id], action=action,
+                        granularity=granularity, bucket=bucket, count=n)
+            for (doc_id, action, granularity, bucket), n in counts.items()
+        ]
+        with transaction.atomic():
+            UsageRollup.objects.all().delete()
+            UsageRollup.objects.bulk_create(rollups, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(rollups)} rollups from {scanned} usage and upload records."
+        ))
+
+    @staticmethod
+    def _batches(rows, batch_size):
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return
+            last_id = batch[-1][0]
+            yield batch
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from fileMonitoring import reconcile
+from fileMonitoring.models import Blob
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare MEDIA_ROOT with the database: report (or with --delete remove) files no row points "
+        "at and blob rows nothing references, and report (or with --delete-dangling delete the "
+        "documents of) rows whose file is missing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help="Remove orphan files and unreferenced blob rows instead of only reporting them.")
+        parser.add_argument('--delete-dangling', action='store_true',
+                            help="Delete the documents whose file, or any of whose versions' files, is missing.")
+        parser.add_argument('--min-age', type=float, default=24,
+                            help="Only treat files and blob rows older than this many hours as orphans (default 24).")
+
+    def handle(self, *args, **options):
+        storage = Blob._meta.get_field('file').storage
+        min_age = options['min_age'] * 3600
+        orphans = orphan_bytes = 0
+        for name, size in reconcile.orphan_files(min_age=min_age):
+            orphans += 1
+            orphan_bytes += size
+            if options['delete']:
+                storage.delete(name)
+            self.stdout.write(f"{'removed' if options['delete'] else 'orphan'} file: {name} ({filesizeformat(size)})")
+
+        dangling = []
+        for model_name, pk, name in reconcile.dangling_rows():
+            dangling.append((model_name, pk, name))
+            self.stdout.write(f"missing file: {model_name} {pk} -> {name or '(empty)'}")
+        if options['delete_dangling'] and dangling:
+            # Before the unreferenced blobs, so those whose documents go here go too.
+            doc_ids = reconcile.delete_dangling_documents(dangling)
+            self.stdout.write(f"deleted {len(doc_ids)} documents with missing files: {', '.join(map(str, doc_ids))}")
+
+        if options['delete']:
+            blobs = reconcile.delete_unreferenced_blobs(min_age)
+        else:
+            blobs = reconcile.unreferenced_blobs(min_age).count()
+
+        verb = 'Removed' if options['delete'] else 'Found'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {orphans} orphan files ({filesizeformat(orphan_bytes)}) and {blobs} unreferenced blob rows; "
+            f"{len(dangling)} rows point at missing files."
+        ))
+        if dangling and not options['delete_dangling']:
+            self.stdout.write(self.style.WARNING(
+                "Restore the missing files from backup, or run with --delete-dangling to delete the "
+                "documents they belong to."
+            ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from fileMonitoring import accounting
+
+
+class Command(BaseCommand):
+    help = "Recompute document, user, folder and category storage counters from the documents and versions."
+
+    def handle(self, *args, **options):
+        drifted = accounting.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            "Corrected " + ', '.join(f"{count} {name}" for name, count in drifted.items()) + "."
+        ))
@@ -0,0 +1,231 @@
+import hashlib
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from fileMonitoring import accounting, analytics
+from fileMonitoring.models import (
+    ActivityLog, Blob, Category, Document, DocumentVersion, FileHash, Folder,
+    MonitoredFile, SearchEntry, UsageRollup, UsageStat, UserProfile, blob_upload_path,
+)
+
+WORDS = (
+    'annual report budget contract draft final invoice meeting minutes notes '
+    'plan policy proposal quarterly receipt review roadmap schedule summary '
+    'agreement audit design estimate forecast handbook memo payroll strategy'
+).split()
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic dataset (users, folders, documents, usage) for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--categories', type=int, default=3, help="Categories per user.")
+        parser.add_argument('--folders', type=int, default=4, help="Folders per category.")
+        parser.add_argument('--documents', type=int, default=1000)
+        parser.add_argument('--versions', type=int, default=2, help="Maximum versions per document.")
+        parser.add_argument('--usage', type=int, default=5, help="Average usage records per document.")
+        parser.add_argument('--activity', type=int, default=2, help="Average activity records per document.")
+        parser.add_argument('--files', type=int, default=200,
+                            help="Distinct small files written to storage and shared by the documents.")
+        parser.add_argument('--file-size', type=int, default=4096, help="Average file size in bytes.")
+        parser.add_argument('--shared', type=float, default=0.1, help="Fraction of shared documents.")
+        parser.add_argument('--deleted', type=float, default=0.05, help="Fraction of trashed documents.")
+        parser.add_argument('--days', type=int, default=30, help="Spread usage and activity over this many days.")
+        parser.add_argument('--prefix', default='seed', help="Username prefix.")
+        parser.add_argument('--password', default='password')
+        parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['categories'] < 1 or options['folders'] < 1 or options['files'] < 1:
+            raise CommandError("--users, --categories, --folders and --files must be positive.")
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        users = self.create_users()
+        folders = self.create_folders(users)
+        blobs = self.create_blobs()
+        counts = self.create_documents(users, folders, blobs)
+        # Storage counters, set-based for the seeded rows only.
+        accounting.recompute_documents(Document.objects.filter(uploaded_by__in=users))
+        accounting.recompute_users(UserProfile.objects.filter(user__in=users))
+        accounting.recompute_folders(Folder.objects.filter(category__created_by__in=users))
+        accounting.recompute_categories(Category.objects.filter(created_by__in=users))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {sum(len(f) for f in folders.values())} folders, "
+            f"{len(blobs)} files, {counts['documents']} documents, {counts['versions']} versions, "
+            f"{counts['usage']} usage and {counts['activity']} activity records "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
+
+    # --- Users, categories and folders ---
+    def create_users(self):
+        prefix = self.options['prefix']
+        start = User.objects.filter(username__startswith=f'{prefix}_').count()
+        password = make_password(self.options['password'])
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}_{start + i}', email=f'{prefix}_{start + i}@example.com', password=password)
+            for i in range(self.options['users'])
+        ])
+        UserProfile.objects.bulk_create([UserProfile(user=user, role='standard') for user in users])
+        return [user.pk for user in users]
+
+    def create_folders(self, users):
+        categories = Category.objects.bulk_create([
+            Category(name=f'{self.rng.choice(WORDS).title()} {i}', created_by_id=user_id)
+            for user_id in users for i in range(self.options['categories'])
+        ])
+        folders = Folder.objects.bulk_create([
+            Folder(name=f'{self.rng.choice(WORDS).title()} {i}', category=category)
+            for category in categories for i in range(self.options['folders'])
+        ])
+        by_user = {user_id: [] for user_id in users}
+        for folder in folders:
+            by_user[folder.category.created_by_id].append((folder.pk, folder.name, folder.category.name))
+        return by_user
+
+    # --- Files ---
+    def create_blobs(self):
+        blobs = []
+        size = self.options['file_size']
+        for _ in range(self.options['files']):
+            words = []
+            length = 0
+            target = self.rng.randint(max(1, size // 2), size * 2)
+            while length < target:
+                word = self.rng.choice(WORDS)
+                words.append(word)
+                length += len(word) + 1
+            data = ' '.join(words)[:target].encode()
+            blob = Blob(sha256=hashlib.sha256(data).hexdigest(), size=len(data))
+            existing = Blob.objects.filter(sha256=blob.sha256).first()
+            if existing:
+                blobs.append(existing)
+                continue
+            name = blob_upload_path(blob, 'seed.txt')
+            storage = Blob._meta.get_field('file').storage
+            if storage.exists(name):
+                storage.delete(name)
+            blob.file.name = storage.save(name, ContentFile(data))
+            blob.save()
+            blobs.append(blob)
+        return blobs
+
+    # --- Documents and their history ---
+    def create_documents(self, users, folders, blobs):
+        opts = self.options
+        rng = self.rng
+        batch_size = opts['batch_size']
+        refs = Counter()
+        counts = Counter()
+        span = int(timedelta(days=opts['days']).total_seconds())
+
+        for offset in range(0, opts['documents'], batch_size):
+            n = min(batch_size, opts['documents'] - offset)
+            docs, placements = [], []
+            for i in range(offset, offset + n):
+                owner = rng.choice(users)
+                folder = rng.choice(folders[owner]) if rng.random() < 0.9 else None
+                blob = rng.choice(blobs)
+                deleted = rng.random() < opts['deleted']
+                docs.append(Document(
+                    name=f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i}.txt',
+                    file=blob.file.name, blob=blob, size=blob.size,
+                    folder_id=folder[0] if folder else None, uploaded_by_id=owner,
+                    is_shared=rng.random() < opts['shared'], is_deleted=deleted,
+                    deleted_at=self.now if deleted else None,
+                ))
+                placements.append(folder)
+
+            with transaction.atomic():
+                docs = Document.objects.bulk_create(docs)
+                versions, hashes, monitored, entries = [], [], [], []
+                usage, activity = [], []
+                for doc, folder in zip(docs, placements):
+                    history = [rng.choice(blobs) for _ in range(rng.randint(1, max(1, opts['versions'])) - 1)]
+                    history.append(doc.blob)
+                    for number, blob in enumerate(history, start=1):
+                        versions.append(DocumentVersion(
+                            document=doc, version_file=blob.file.name, blob=blob,
+                            version_number=number, hash_value=blob.sha256, size=blob.size,
+                        ))
+                        refs[blob.pk] += 1
+                    refs[doc.blob.pk] += 1
+                    hashes.append(FileHash(document=doc, hash_value=doc.blob.sha256, file_size=doc.size))
+                    monitored.append(MonitoredFile(document=doc))
+                    entries.append(SearchEntry(
+                        document=doc, owner_id=doc.uploaded_by_id, name=doc.name,
+                        folder=folder[1] if folder else '', category=folder[2] if folder else '',
+                    ))
+                    for _ in range(self._event_count(opts['usage'])):
+                        usage.append(UsageStat(
+                            document=doc, accessed_by_id=rng.choice(users),
+                            action='view' if rng.random() < 0.8 else 'download',
+                            accessed_at=self.now - timedelta(seconds=rng.randrange(span or 1)),
+                        ))
+                    for _ in range(self._event_count(opts['activity'])):
+                        activity.append(ActivityLog(
+                            user_id=doc.uploaded_by_id, document=doc,
+                            action=rng.choice(['upload', 'modify', 'download']),
+                            timestamp=self.now - timedelta(seconds=rng.randrange(span or 1)),
+                        ))
+
+                DocumentVersion.objects.bulk_create(versions)
+                for version in versions:
+                    # Versions were appended in order, so the last one per document wins.
+                    version.document.version_count = version.version_number
+                    version.document.current_version = version
+                Document.objects.bulk_update(docs, ['version_count', 'current_version'])
+                FileHash.objects.bulk_create(hashes)
+                MonitoredFile.objects.bulk_create(monitored)
+                SearchEntry.objects.bulk_create(entries)
+                UsageStat.objects.bulk_create(usage)
+                ActivityLog.objects.bulk_create(activity)
+                # Each batch has its own documents, so its rollups never collide
+                # with earlier batches and can be inserted directly.
+                UsageRollup.objects.bulk_create(
+                    self._rollups(usage, activity, {doc.pk: doc.uploaded_by_id for doc in docs})
+                )
+
+            counts.update(documents=len(docs), versions=len(versions), usage=len(usage), activity=len(activity))
+            if self.options['verbosity'] > 1:
+                self.stdout.write(f"  {offset + n} documents")
+
+        blobs = list({blob.pk: blob for blob in blobs}.values())
+        for blob in blobs:
+            blob.ref_count += refs[blob.pk]
+        Blob.objects.bulk_update(blobs, ['ref_count'], batch_size=batch_size)
+        return counts
+
+    def _event_count(self, mean):
+        # Number of events for one document, averaging ``mean``.
+        return int(self.rng.expovariate(1 / mean)) if mean > 0 else 0
+
+    @staticmethod
+    def _rollups(usage, activity, owners):
+        events = [(stat.document_id, stat.action, stat.accessed_at) for stat in usage] + [
+            (log.document_id, log.action, log.timestamp) for log in activity
+            if log.action in analytics.ROLLUP_ACTIVITIES
+        ]
+        counts = Counter()
+        for doc_id, action, when in events:
+            for granularity, bucket in analytics.buckets_for(when):
+                counts[(doc_id, action, granularity, bucket)] += 1
+        return [
+            UsageRollup(document_id=doc_id, owner_id=owners[doc_id], action=action,
+                        granularity=granularity, bucket=bucket, count=n)
+            for (doc_id, action, granularity, bucket), n in counts.items()
+        ]
@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fileMonitoring import sharding
+from fileMonitoring.models import media_fanout
+
+
+class Command(BaseCommand):
+    help = (
+        "Move stored files into the DMS_MEDIA_FANOUT directory layout in batches, re-pointing their rows "
+        "transactionally. Safe to run while the site is live and to interrupt; a rerun resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Files moved per transaction (default 200).")
+        parser.add_argument('--sleep', type=float, default=0.5,
+                            help="Seconds to pause after each batch, to throttle disk and database load (default 0.5).")
+        parser.add_argument('--grace', type=float, default=30,
+                            help="Seconds old names stay in place after their rows moved, for readers that "
+                                 "already looked them up (default 30).")
+        parser.add_argument('--limit', type=int, help="Stop after moving this many files.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the files that would move.")
+
+    def handle(self, *args, **options):
+        fanout = '/'.join('x' * width for width in media_fanout()) or '(flat)'
+        if options['dry_run']:
+            planned = sum(len(moves) for moves in sharding.planned_moves(options['batch_size']))
+            self.stdout.write(f"{planned} files are outside the {fanout} layout.")
+            return
+
+        moved = missing = 0
+        pending = []  # (time the rows moved, moves)
+        try:
+            for moves in sharding.planned_moves(options['batch_size']):
+                if options['limit'] is not None:
+                    moves = moves[:options['limit'] - moved]
+                done, absent = sharding.move_files(moves)
+                moved += len(done)
+                missing += len(absent)
+                pending.append((time.monotonic(), done))
+                for name in absent:
+                    self.stderr.write(f"missing file: {name}")
+                self.stdout.write(f"moved {moved} files")
+                pending = self.retire(pending, options['grace'])
+                if options['limit'] is not None and moved >= options['limit']:
+                    break
+                time.sleep(options['sleep'])
+        finally:
+            if pending:
+                time.sleep(max(0.0, pending[-1][0] + options['grace'] - time.monotonic()))
+                self.retire(pending, 0)
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} files into the {fanout} layout; {missing} rows point at missing files."
+        ))
+
+    def retire(self, pending, grace):
+        """Retire the batches older than ``grace`` seconds; return the rest."""
+        now = time.monotonic()
+        for moved_at, moves in pending:
+            if now - moved_at >= grace:
+                sharding.retire(moves)
+        return [(moved_at, moves) for moved_at, moves in pending if now - moved_at < grace]
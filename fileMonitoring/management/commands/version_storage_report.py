@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from fileMonitoring import versions
+from fileMonitoring.models import Document
+
+
+class Command(BaseCommand):
+    help = "Report version storage per document: full size of every version, bytes stored and space saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only documents uploaded by this username.")
+        parser.add_argument('--limit', type=int, default=50, help="Documents to list, most saved first.")
+
+    def handle(self, *args, **options):
+        documents = Document.objects.all()
+        if options['user']:
+            documents = documents.filter(uploaded_by__username=options['user'])
+        report = versions.storage_report(documents)
+        report.sort(key=lambda row: row['saved'], reverse=True)
+
+        self.stdout.write(f"{'Document':<40} {'Versions':>8} {'Deltas':>6} {'Full':>10} {'Stored':>10} {'Saved':>10}")
+        for row in report[:options['limit']]:
+            self.stdout.write(
+                f"{row['name'][:40]:<40} {row['versions']:>8} {row['deltas']:>6} "
+                f"{filesizeformat(row['logical']):>10} {filesizeformat(row['stored']):>10} "
+                f"{filesizeformat(row['saved']):>10}"
+            )
+        logical = sum(row['logical'] for row in report)
+        saved = sum(row['saved'] for row in report)
+        percent = 100 * saved / logical if logical else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(report)} documents: {filesizeformat(logical)} of versions stored in "
+            f"{filesizeformat(logical - saved)} ({percent:.1f}% saved)."
+        ))
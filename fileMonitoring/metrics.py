@@ -0,0 +1,267 @@
+"""
+In-process metrics served in the Prometheus text format.
+
+``MetricsMiddleware`` records each request's latency, query count, time in
+the database and response size, labelled by view name. ``timer()`` measures
+hot operations (hashing, upload writes, log inserts) and the bytes they
+handle. Recording is a few dict lookups and additions under a lock, cheap
+enough to leave on; every worker process keeps and serves its own numbers
+at ``metrics/`` (staff, or DMS_METRICS_TOKEN as a bearer token).
+
+Latency is measured until the view returns, so a streamed download counts
+the time to its first byte, not the transfer.
+
+With DMS_SLOW_REQUEST_SECONDS set, requests that take longer are logged
+with their SQL to the ``fileMonitoring.slow_requests`` logger.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+slow_logger = logging.getLogger('fileMonitoring.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3)
+# Statements kept per request for the slow-request log.
+SLOW_SQL_LIMIT = 100
+# Any other request method is counted as 'other', so clients can't add series.
+HTTP_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+_registry = []
+
+
+def enabled():
+    return getattr(settings, 'DMS_METRICS_ENABLED', True)
+
+
+def slow_request_seconds():
+    return getattr(settings, 'DMS_SLOW_REQUEST_SECONDS', None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+# --- Metric types ---
+class Counter:
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.values().items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket ..., count above the last, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(value) for key, value in self._series.items()}
+        for label_values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {counts[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Metrics ---
+requests_total = Counter(
+    'dms_http_requests_total', "HTTP requests by view, method and status code.", ('view', 'method', 'status'),
+)
+request_seconds = Histogram(
+    'dms_http_request_duration_seconds', "Time until the view returned its response.", ('view',),
+)
+request_queries = Histogram(
+    'dms_http_request_queries', "Database queries per request.", ('view',), QUERY_BUCKETS,
+)
+request_db_seconds = Histogram(
+    'dms_http_request_db_seconds', "Time per request spent in database queries.", ('view',),
+)
+response_bytes = Histogram(
+    'dms_http_response_size_bytes', "Response body size, where known up front.", ('view',), SIZE_BUCKETS,
+)
+operation_seconds = Histogram(
+    'dms_operation_duration_seconds', "Time spent in instrumented operations.", ('operation',),
+)
+operation_bytes = Counter(
+    'dms_operation_bytes_total', "Bytes processed by instrumented operations.", ('operation',),
+)
+log_events = Counter(
+    'dms_log_events_written_total', "Buffered activity and usage events written.", ('kind',),
+)
+
+
+@contextmanager
+def timer(operation, size=None):
+    """Time the block as ``operation``, counting ``size`` bytes if given."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        operation_seconds.observe(time.perf_counter() - started, operation)
+        if size:
+            operation_bytes.inc(size, operation)
+
+
+# --- Requests ---
+class QueryRecorder:
+    """Counts one request's queries and their time."""
+
+    def __init__(self, keep_sql=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.sql = [] if keep_sql else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.sql is not None and len(self.sql) < SLOW_SQL_LIMIT:
+                self.sql.append((elapsed, sql))
+
+
+# The recorder of the request being handled. Database connections belong to
+# threads and the async ORM queries from another thread than the view's, but
+# sync_to_async carries context variables over, so the wrapper installed on
+# every connection finds the right recorder either way.
+_recorder = ContextVar('dms_query_recorder', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection):
+    """Add the request query recorder to a newly opened database connection."""
+    if _record_query not in connection.execute_wrappers:
+        # First, so connection.execute_wrapper() blocks still pop their own.
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+class MetricsMiddleware:
+    """Records every request; goes first in MIDDLEWARE so the others are measured too."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        queries = QueryRecorder(keep_sql=slow_request_seconds() is not None)
+        token = _recorder.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def _acall(self, request):
+        queries = QueryRecorder(keep_sql=slow_request_seconds() is not None)
+        token = _recorder.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def record(self, request, response, elapsed, queries):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        requests_total.inc(1, view, method, response.status_code)
+        request_seconds.observe(elapsed, view)
+        request_queries.observe(queries.count, view)
+        request_db_seconds.observe(queries.seconds, view)
+        size = response.get('Content-Length')
+        if size is None and not response.streaming:
+            size = len(response.content)
+        if size is not None:
+            response_bytes.observe(int(size), view)
+
+        threshold = slow_request_seconds()
+        if threshold is not None and elapsed >= threshold:
+            slow_logger.warning(
+                "Slow request %s %s (%s): %.3fs, %d queries in %.3fs\n%s",
+                request.method, request.path, view, elapsed, queries.count, queries.seconds,
+                '\n'.join(f'{seconds * 1000:8.1f} ms  {sql}' for seconds, sql in queries.sql),
+            )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0005_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='hash_value',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0006_documentversion_hash_value'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filehash',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0007_filehash_file_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='integritychecklog',
+            name='damaged_ranges',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='ChunkManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('file_size', models.BigIntegerField()),
+                ('digests', models.BinaryField()),
+                ('merkle_root', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='chunk_manifest', to='fileMonitoring.document')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0008_chunkmanifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filehash',
+            name='algorithm',
+            field=models.CharField(choices=[('sha256', 'SHA-256'), ('blake2b', 'BLAKE2b-256')], default='sha256', max_length=16),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_sizes(apps, schema_editor):
+    Document = apps.get_model('fileMonitoring', 'Document')
+    storage = Document._meta.get_field('file').storage
+    for pk, name, blob_size in Document.objects.values_list('id', 'file', 'blob__size').iterator():
+        if blob_size is None:
+            try:
+                blob_size = storage.size(name)
+            except OSError:
+                continue
+        Document.objects.filter(pk=pk).update(size=blob_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0009_filehash_algorithm'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['uploaded_by', 'uploaded_at', 'id'], name='doc_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['uploaded_by', 'name', 'id'], name='doc_owner_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['uploaded_by', 'size', 'id'], name='doc_owner_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['uploaded_by', 'deleted_at', 'id'], name='doc_owner_trash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['folder', 'uploaded_at', 'id'], name='doc_folder_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['folder', 'name', 'id'], name='doc_folder_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['folder', 'size', 'id'], name='doc_folder_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('is_shared', True)), fields=['uploaded_at', 'id'], name='doc_shared_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('is_shared', True)), fields=['name', 'id'], name='doc_shared_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('is_shared', True)), fields=['size', 'id'], name='doc_shared_size_idx'),
+        ),
+        migrations.RunPython(backfill_sizes, migrations.RunPython.noop),
+    ]
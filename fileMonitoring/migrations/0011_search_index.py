@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE "fileMonitoring_search_fts" USING fts5(
+        name, folder, category, content,
+        content='fileMonitoring_searchentry', content_rowid='document_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER "fileMonitoring_search_ai" AFTER INSERT ON "fileMonitoring_searchentry" BEGIN
+        INSERT INTO "fileMonitoring_search_fts"(rowid, name, folder, category, content)
+        VALUES (new.document_id, new.name, new.folder, new.category, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER "fileMonitoring_search_ad" AFTER DELETE ON "fileMonitoring_searchentry" BEGIN
+        INSERT INTO "fileMonitoring_search_fts"("fileMonitoring_search_fts", rowid, name, folder, category, content)
+        VALUES ('delete', old.document_id, old.name, old.folder, old.category, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER "fileMonitoring_search_au" AFTER UPDATE ON "fileMonitoring_searchentry" BEGIN
+        INSERT INTO "fileMonitoring_search_fts"("fileMonitoring_search_fts", rowid, name, folder, category, content)
+        VALUES ('delete', old.document_id, old.name, old.folder, old.category, old.content);
+        INSERT INTO "fileMonitoring_search_fts"(rowid, name, folder, category, content)
+        VALUES (new.document_id, new.name, new.folder, new.category, new.content);
+    END
+    """,
+]
+
+FTS_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS "fileMonitoring_search_au"',
+    'DROP TRIGGER IF EXISTS "fileMonitoring_search_ad"',
+    'DROP TRIGGER IF EXISTS "fileMonitoring_search_ai"',
+    'DROP TABLE IF EXISTS "fileMonitoring_search_fts"',
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_DROP_SQL:
+        schema_editor.execute(sql)
+
+
+def backfill_entries(apps, schema_editor):
+    # Names only; file contents are extracted by `manage.py rebuild_search_index --content`.
+    Document = apps.get_model('fileMonitoring', 'Document')
+    SearchEntry = apps.get_model('fileMonitoring', 'SearchEntry')
+    rows = Document.objects.values_list('id', 'name', 'folder__name', 'folder__category__name')
+    batch = []
+    for doc_id, name, folder, category in rows.iterator():
+        batch.append(SearchEntry(document_id=doc_id, name=name, folder=folder or '', category=category or ''))
+        if len(batch) >= 1000:
+            SearchEntry.objects.bulk_create(batch)
+            batch = []
+    SearchEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0010_document_size_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='fileMonitoring.document')),
+                ('name', models.CharField(max_length=255)),
+                ('folder', models.CharField(blank=True, max_length=255)),
+                ('category', models.CharField(blank=True, max_length=100)),
+                ('content', models.TextField(blank=True)),
+                ('content_source', models.CharField(blank=True, max_length=255)),
+            ],
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+        migrations.RunPython(backfill_entries, migrations.RunPython.noop),
+    ]
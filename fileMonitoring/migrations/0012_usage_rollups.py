@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0011_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=20)),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('total', 'All time')], max_length=8)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='usagestat',
+            index=models.Index(fields=['document', 'accessed_at', 'id'], name='usage_doc_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usagestat',
+            index=models.Index(fields=['accessed_at', 'id'], name='usage_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='usagerollup',
+            name='document',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fileMonitoring.document'),
+        ),
+        migrations.AddField(
+            model_name='usagerollup',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='usagerollup',
+            index=models.Index(fields=['owner', 'granularity', 'action', 'bucket'], name='rollup_owner_series_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usagerollup',
+            index=models.Index(fields=['owner', 'granularity', 'action', 'count'], name='rollup_owner_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='usagerollup',
+            constraint=models.UniqueConstraint(fields=('document', 'action', 'granularity', 'bucket'), name='usage_rollup_unique'),
+        ),
+    ]
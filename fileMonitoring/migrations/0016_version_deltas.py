@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_sizes(apps, schema_editor):
+    Blob = apps.get_model('fileMonitoring', 'Blob')
+    DocumentVersion = apps.get_model('fileMonitoring', 'DocumentVersion')
+    DocumentVersion.objects.filter(blob__isnull=False).update(
+        size=Subquery(Blob.objects.filter(pk=OuterRef('blob_id')).values('size'))
+    )
+    storage = DocumentVersion._meta.get_field('version_file').storage
+    for pk, name in DocumentVersion.objects.filter(blob__isnull=True).values_list('id', 'version_file').iterator():
+        try:
+            DocumentVersion.objects.filter(pk=pk).update(size=storage.size(name))
+        except OSError:
+            continue
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0015_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='delta_base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='fileMonitoring.documentversion'),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='delta_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_sizes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def renumber_and_backfill(apps, schema_editor):
+    Document = apps.get_model('fileMonitoring', 'Document')
+    DocumentVersion = apps.get_model('fileMonitoring', 'DocumentVersion')
+    # Concurrent uploads could hand out the same number twice; renumber
+    # those documents' versions in creation order before the constraint.
+    duplicated = (DocumentVersion.objects.values('document')
+                  .annotate(n=Count('id'), numbers=Count('version_number', distinct=True))
+                  .filter(n__gt=F('numbers')).values_list('document', flat=True))
+    for document_id in list(duplicated):
+        ids = DocumentVersion.objects.filter(document_id=document_id).order_by('version_number', 'id').values_list('id', flat=True)
+        for number, pk in enumerate(list(ids), start=1):
+            DocumentVersion.objects.filter(pk=pk).update(version_number=number)
+
+    versions = DocumentVersion.objects.filter(document=OuterRef('pk'))
+    Document.objects.update(
+        version_count=Coalesce(Subquery(versions.values('document').annotate(m=Max('version_number')).values('m')), 0),
+        current_version=Subquery(versions.order_by('-version_number').values('id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0016_version_deltas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='current_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='fileMonitoring.documentversion'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='version_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(renumber_and_backfill, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='documentversion',
+            constraint=models.UniqueConstraint(fields=('document', 'version_number'), name='document_version_unique'),
+        ),
+    ]
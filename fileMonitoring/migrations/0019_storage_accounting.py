@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:47
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    Document = apps.get_model('fileMonitoring', 'Document')
+    DocumentVersion = apps.get_model('fileMonitoring', 'DocumentVersion')
+    UserProfile = apps.get_model('fileMonitoring', 'UserProfile')
+    Folder = apps.get_model('fileMonitoring', 'Folder')
+    Category = apps.get_model('fileMonitoring', 'Category')
+
+    def total(queryset, group):
+        queryset = queryset.values(group)
+        return (Coalesce(Subquery(queryset.annotate(n=Sum('versions_size')).values('n')), 0),
+                Coalesce(Subquery(queryset.annotate(n=Count('id')).values('n')), 0))
+
+    sizes = DocumentVersion.objects.filter(document=OuterRef('pk')).values('document')
+    Document.objects.update(versions_size=Coalesce(Subquery(sizes.annotate(n=Sum('size')).values('n')), 0))
+    storage_bytes, file_count = total(Document.objects.filter(uploaded_by=OuterRef('user')), 'uploaded_by')
+    UserProfile.objects.update(storage_bytes=storage_bytes, file_count=file_count)
+    storage_bytes, file_count = total(Document.objects.filter(folder=OuterRef('pk'), is_deleted=False), 'folder')
+    Folder.objects.update(storage_bytes=storage_bytes, file_count=file_count)
+    storage_bytes, file_count = total(
+        Document.objects.filter(folder__category=OuterRef('pk'), is_deleted=False), 'folder__category')
+    Category.objects.update(storage_bytes=storage_bytes, file_count=file_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0018_trash_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='file_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='storage_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='versions_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='file_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='storage_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='file_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='quota_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='storage_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:05
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# The FTS table gains an owner_id column, so it and its triggers are
+# recreated and rebuilt from the search entries. Searches match
+# ``{owner_id} : "<id>"`` first, so bm25 only ranks that user's rows.
+FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE "fileMonitoring_search_fts" USING fts5(
+        name, folder, category, content, owner_id,
+        content='fileMonitoring_searchentry', content_rowid='document_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER "fileMonitoring_search_ai" AFTER INSERT ON "fileMonitoring_searchentry" BEGIN
+        INSERT INTO "fileMonitoring_search_fts"(rowid, name, folder, category, content, owner_id)
+        VALUES (new.document_id, new.name, new.folder, new.category, new.content, new.owner_id);
+    END
+    """,
+    """
+    CREATE TRIGGER "fileMonitoring_search_ad" AFTER DELETE ON "fileMonitoring_searchentry" BEGIN
+        INSERT INTO "fileMonitoring_search_fts"("fileMonitoring_search_fts", rowid, name, folder, category, content, owner_id)
+        VALUES ('delete', old.document_id, old.name, old.folder, old.category, old.content, old.owner_id);
+    END
+    """,
+    """
+    CREATE TRIGGER "fileMonitoring_search_au" AFTER UPDATE ON "fileMonitoring_searchentry" BEGIN
+        INSERT INTO "fileMonitoring_search_fts"("fileMonitoring_search_fts", rowid, name, folder, category, content, owner_id)
+        VALUES ('delete', old.document_id, old.name, old.folder, old.category, old.content, old.owner_id);
+        INSERT INTO "fileMonitoring_search_fts"(rowid, name, folder, category, content, owner_id)
+        VALUES (new.document_id, new.name, new.folder, new.category, new.content, new.owner_id);
+    END
+    """,
+    """INSERT INTO "fileMonitoring_search_fts"("fileMonitoring_search_fts") VALUES ('rebuild')""",
+]
+
+FTS_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS "fileMonitoring_search_au"',
+    'DROP TRIGGER IF EXISTS "fileMonitoring_search_ad"',
+    'DROP TRIGGER IF EXISTS "fileMonitoring_search_ai"',
+    'DROP TABLE IF EXISTS "fileMonitoring_search_fts"',
+]
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_DROP_SQL:
+        schema_editor.execute(sql)
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def restore_previous_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    previous = import_module('fileMonitoring.migrations.0011_search_index')
+    for sql in previous.FTS_SQL:
+        schema_editor.execute(sql)
+    schema_editor.execute(FTS_SQL[-1])
+
+
+def backfill_owners(apps, schema_editor):
+    SearchEntry = apps.get_model('fileMonitoring', 'SearchEntry')
+    Document = apps.get_model('fileMonitoring', 'Document')
+    SearchEntry.objects.update(owner_id=models.Subquery(
+        Document.objects.filter(pk=models.OuterRef('document_id')).values('uploaded_by_id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fileMonitoring', '0021_uploadsession_finalizing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Dropped first: SQLite rebuilds the table to add the column, which
+        # would leave the triggers behind.
+        migrations.RunPython(drop_fts, restore_previous_fts),
+        migrations.AddField(
+            model_name='searchentry',
+            name='owner',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_owners, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='searchentry',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -1,9 +1,13 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 import hashlib
 import os
 import uuid
 
+from .hashing import hash_file
+
 # --- User Roles ---
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -12,55 +16,211 @@ class UserProfile(models.Model):
         ('standard', 'Standard User'),
     )
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    # Storage counters kept by accounting.py: every version of every document
+    # the user owns, trash included. quota_bytes overrides DMS_USER_QUOTA.
+    storage_bytes = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    quota_bytes = models.BigIntegerField(null=True, blank=True)
 
 
 # --- Category & Folder ---
+# Folder and category counters cover the live (not trashed) documents in
+# them, maintained by accounting.py.
 class Category(models.Model):
     name = models.CharField(max_length=100)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    storage_bytes = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
 
 class Folder(models.Model):
     name = models.CharField(max_length=255)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     is_locked = models.BooleanField(default=False)
+    storage_bytes = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
 
 
 # --- Document & Versioning ---
+# Stored files are fanned out over nested directories named by leading hex
+# digits of a key, e.g. documents/ab/cd/<name> for DMS_MEDIA_FANOUT (2, 2),
+# so no single directory grows to millions of entries. Files stored under
+# an older layout are moved with ``manage.py shard_media``.
+def media_fanout():
+    return tuple(getattr(settings, 'DMS_MEDIA_FANOUT', (2, 2)))
+
+def sharded_path(directory, key, filename):
+    parts = []
+    start = 0
+    for width in media_fanout():
+        parts.append(key[start:start + width])
+        start += width
+    return os.path.join(directory, *parts, filename)
+
+def sharded_name(directory, filename):
+    """Where ``filename`` goes under ``directory``, sharded by a hash of the name."""
+    key = hashlib.md5(filename.encode(), usedforsecurity=False).hexdigest()
+    return sharded_path(directory, key, filename)
+
 def document_upload_path(instance, filename):
     ext = filename.split('.')[-1]
     new_filename = f"{uuid.uuid4()}.{ext}"
-    return os.path.join('documents', new_filename)
+    return sharded_name('documents', new_filename)
+
+def blob_upload_path(instance, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    digest = instance.sha256
+    return sharded_path('blobs', digest, f"{digest}{ext}")
+
+class Blob(models.Model):
+    # One stored copy per distinct content; documents and versions point here.
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_upload_path, max_length=255)
+    size = models.BigIntegerField(default=0)
+    # Compression at rest (see compression.py): '' for a plain file, else the
+    # codec, and the bytes on disk (null where the file is plain).
+    codec = models.CharField(max_length=8, blank=True)
+    stored_size = models.BigIntegerField(null=True, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
 
 class Document(models.Model):
     name = models.CharField(max_length=255)
-    file = models.FileField(upload_to=document_upload_path)
+    file = models.FileField(upload_to=document_upload_path, max_length=255)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='documents')
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    size = models.BigIntegerField(default=0)  # bytes of the current file
+    versions_size = models.BigIntegerField(default=0)  # bytes of all its versions, the current one included
     is_shared = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    # Highest version_number handed out, incremented atomically (see
+    # uploads.add_version), and the version the current file belongs to.
+    # Versions are only deleted together with their document.
+    version_count = models.PositiveIntegerField(default=0)
+    current_version = models.ForeignKey('DocumentVersion', on_delete=models.DO_NOTHING, null=True, blank=True, related_name='+')
+
+    class Meta:
+        # One composite index per listing and sort so keyset pagination
+        # (see pagination.py) seeks straight to the page. The flags are
+        # partial-index conditions rather than leading columns: Django renders
+        # boolean filters as "NOT is_deleted", which SQLite can't use as an
+        # equality on an index column.
+        indexes = [
+            models.Index(fields=['uploaded_by', 'uploaded_at', 'id'], name='doc_owner_date_idx', condition=models.Q(is_deleted=False)),
+            models.Index(fields=['uploaded_by', 'name', 'id'], name='doc_owner_name_idx', condition=models.Q(is_deleted=False)),
+            models.Index(fields=['uploaded_by', 'size', 'id'], name='doc_owner_size_idx', condition=models.Q(is_deleted=False)),
+            models.Index(fields=['uploaded_by', 'deleted_at', 'id'], name='doc_owner_trash_idx', condition=models.Q(is_deleted=True)),
+            # Trash retention (see retention.py) purges the oldest first across users.
+            models.Index(fields=['deleted_at', 'id'], name='doc_trash_expiry_idx', condition=models.Q(is_deleted=True)),
+            models.Index(fields=['folder', 'uploaded_at', 'id'], name='doc_folder_date_idx', condition=models.Q(is_deleted=False)),
+            models.Index(fields=['folder', 'name', 'id'], name='doc_folder_name_idx', condition=models.Q(is_deleted=False)),
+            models.Index(fields=['folder', 'size', 'id'], name='doc_folder_size_idx', condition=models.Q(is_deleted=False)),
+            models.Index(fields=['uploaded_at', 'id'], name='doc_shared_date_idx', condition=models.Q(is_shared=True, is_deleted=False)),
+            models.Index(fields=['name', 'id'], name='doc_shared_name_idx', condition=models.Q(is_shared=True, is_deleted=False)),
+            models.Index(fields=['size', 'id'], name='doc_shared_size_idx', condition=models.Q(is_shared=True, is_deleted=False)),
+        ]
 
 class DocumentVersion(models.Model):
+    # version_file is the blob's file, or for an older version stored as a
+    # delta (see versions.py) the delta file, applied to delta_base's content.
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
-    version_file = models.FileField(upload_to=document_upload_path)
+    version_file = models.FileField(upload_to=document_upload_path, max_length=255)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='versions')
+    delta_base = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
     version_number = models.IntegerField()
+    hash_value = models.CharField(max_length=64, blank=True)  # SHA-256 of this version
+    size = models.BigIntegerField(default=0)  # bytes of this version's content
+    delta_size = models.BigIntegerField(null=True, blank=True)  # bytes of the delta file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also the index version history pages through.
+            models.UniqueConstraint(fields=['document', 'version_number'], name='document_version_unique'),
+        ]
+
+
+# --- Resumable Uploads ---
+class UploadSession(models.Model):
+    # A chunked upload in progress. Chunks are written in place into one
+    # preallocated file (see uploads.py) and recorded as UploadChunk rows.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True)  # set for a new version
+    folder = models.ForeignKey(Folder, on_delete=models.SET_NULL, null=True, blank=True)
+    name = models.CharField(max_length=255, blank=True)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    finalizing_at = models.DateTimeField(null=True, blank=True)  # set while a finalize hashes and stores the file
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        return max(0, min(self.chunk_size, self.size - index * self.chunk_size))
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    digest = models.BinaryField()  # 32-byte SHA-256 of the chunk, reused for the chunk manifest
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='upload_chunk_unique'),
+        ]
 
 
 # --- Integrity Check ---
 class FileHash(models.Model):
     document = models.OneToOneField(Document, on_delete=models.CASCADE)
-    hash_value = models.CharField(max_length=64)  # SHA-256
+    ALGORITHMS = [
+        ('sha256', 'SHA-256'),
+        ('blake2b', 'BLAKE2b-256'),
+    ]
+    hash_value = models.CharField(max_length=64)
+    algorithm = models.CharField(max_length=16, choices=ALGORITHMS, default='sha256')
+    file_size = models.BigIntegerField(null=True, blank=True)  # size when last hashed
     last_checked = models.DateTimeField(auto_now=True)
 
     @staticmethod
     def generate_sha256(file_path):
-        sha256 = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256.update(chunk)
-        return sha256.hexdigest()
+        return hash_file(file_path, 'sha256')
+
+    def compute(self, file_path):
+        """Hash ``file_path`` with the algorithm this row was recorded with."""
+        return hash_file(file_path, self.algorithm)
+
+
+class ChunkManifest(models.Model):
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='chunk_manifest')
+    chunk_size = models.PositiveIntegerField()
+    file_size = models.BigIntegerField()
+    digests = models.BinaryField()  # packed 32-byte SHA-256 digests, one per chunk
+    merkle_root = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now=True)
+
+
+# --- Search ---
+class SearchEntry(models.Model):
+    # Source rows for full-text search. On SQLite an FTS5 table indexes these
+    # through triggers (see migrations 0011 and 0022); other backends query it directly.
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name='search_entry')
+    # document.uploaded_by, indexed with the text so a search only ranks the user's own rows.
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    name = models.CharField(max_length=255)
+    folder = models.CharField(max_length=255, blank=True)
+    category = models.CharField(max_length=100, blank=True)
+    content = models.TextField(blank=True)
+    content_source = models.CharField(max_length=255, blank=True)  # file the content was extracted from
 
 
 # --- Activity Logging ---
@@ -76,7 +236,12 @@ class ActivityLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=20, choices=ACTIONS)
     document = models.ForeignKey(Document, null=True, blank=True, on_delete=models.SET_NULL)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # set when the event happened, not when it's flushed
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp', 'id'], name='activity_user_time_idx'),
+        ]
 
 
 # --- Custom Monitored ---
@@ -90,12 +255,44 @@ class UsageStat(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE)
     accessed_by = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=20)
-    accessed_at = models.DateTimeField(auto_now_add=True)
+    accessed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['document', 'accessed_at', 'id'], name='usage_doc_time_idx'),
+            models.Index(fields=['accessed_at', 'id'], name='usage_time_idx'),
+        ]
+
+class UsageRollup(models.Model):
+    # Pre-aggregated UsageStat counts per (document, action) and time bucket,
+    # maintained as usage is recorded (see analytics.py). 'total' rows hold
+    # the all-time count in a single fixed bucket.
+    GRANULARITIES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+        ('total', 'All time'),
+    ]
+    document = models.ForeignKey(Document, on_delete=models.CASCADE)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)  # document.uploaded_by, for per-user reads
+    action = models.CharField(max_length=20)
+    granularity = models.CharField(max_length=8, choices=GRANULARITIES)
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'action', 'granularity', 'bucket'], name='usage_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'granularity', 'action', 'bucket'], name='rollup_owner_series_idx'),
+            models.Index(fields=['owner', 'granularity', 'action', 'count'], name='rollup_owner_top_idx'),
+        ]
 
 class IntegrityCheckLog(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE)
     checked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     result = models.CharField(max_length=20, choices=[('intact', 'Intact'), ('tampered', 'Tampered')])
+    damaged_ranges = models.JSONField(default=list, blank=True)  # [[start, end), ...] byte offsets
     checked_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -0,0 +1,117 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the sort value and id of the last row seen rather than
+an OFFSET, so with a composite index on ``(..filters.., sort_field, id)`` page
+N costs the same as page 1.
+"""
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# sort key -> (model field, newest/largest first)
+DOCUMENT_SORTS = {
+    'date': ('uploaded_at', True),
+    'name': ('name', False),
+    'size': ('size', True),
+}
+
+
+def page_size():
+    return getattr(settings, 'DMS_PAGE_SIZE', 50)
+
+
+class KeysetPage:
+
+    def __init__(self, items, next_cursor, previous_cursor, sort=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.sort = sort
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(obj, field, backwards=False):
+    value = getattr(obj, field)
+    value = value.isoformat() if hasattr(value, 'isoformat') else value
+    raw = json.dumps([value, obj.pk, backwards]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, field):
+    """
+    Return ``(value, pk, backwards)``, or None for a missing or garbled
+    cursor, which gives the first page.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk, backwards = json.loads(raw)
+        value = model._meta.get_field(field).to_python(value)
+        pk = int(pk)
+    except (binascii.Error, ValueError, TypeError, ValidationError):
+        return None
+    if value is None or not isinstance(backwards, bool):
+        return None
+    return value, pk, backwards
+
+
+def paginate(queryset, field, descending=True, cursor=None, size=None, sort=None):
+    """Return one ``KeysetPage`` of ``queryset`` ordered by ``(field, id)``."""
+    size = size or page_size()
+    position = decode_cursor(cursor, queryset.model, field)
+    backwards = bool(position and position[2])
+    # Walking back to the previous page scans the index the other way.
+    scan_descending = descending != backwards
+
+    if position:
+        value, pk = position[0], position[1]
+        op = 'lt' if scan_descending else 'gt'
+        # The first filter gives the index a range start; the second breaks
+        # ties on the sort value by id.
+        queryset = queryset.filter(**{f'{field}__{op}e': value}).filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{f'pk__{op}': pk})
+        )
+
+    order = [f'-{field}', '-pk'] if scan_descending else [field, 'pk']
+    rows = list(queryset.order_by(*order)[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    has_next = True if backwards else more
+    has_previous = more if backwards else position is not None
+    next_cursor = encode_cursor(rows[-1], field) if rows and has_next else None
+    previous_cursor = encode_cursor(rows[0], field, backwards=True) if rows and has_previous else None
+    return KeysetPage(rows, next_cursor, previous_cursor, sort=sort)
+
+
+def paginate_documents(request, queryset, default_sort='date'):
+    """Paginate a Document queryset using the request's ``sort`` and ``cursor``."""
+    sort = request.GET.get('sort')
+    if sort not in DOCUMENT_SORTS:
+        sort = default_sort
+    field, descending = DOCUMENT_SORTS[sort]
+    return paginate(queryset, field, descending, request.GET.get('cursor'), sort=sort)
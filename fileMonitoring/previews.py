@@ -0,0 +1,263 @@
+"""
+Thumbnails and first-page previews rendered locally.
+
+Each document has two renditions: ``thumb`` for listings and ``page`` for the
+preview page. Images are scaled with Pillow, the first page of a PDF is
+rendered with PyMuPDF or poppler's ``pdftoppm`` (whichever is installed),
+and text files, as well as the text of Office files, are typeset as SVG with
+the standard library. Types with no renderer get a generic file-type icon.
+
+Renders are made in the background worker pool. Concurrent requests for the
+same render wait on one job. Results are cached on disk keyed by content
+hash and size (an LRU bounded by DMS_PREVIEW_CACHE_SIZE), so listings never
+open the originals once a thumbnail exists.
+"""
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import threading
+from collections import OrderedDict
+from concurrent.futures import TimeoutError
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import background, compression, extraction, filecache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional dependency
+    Image = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional dependency
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+# rendition -> longest side in pixels
+RENDITIONS = {
+    'thumb': 256,
+    'page': 1024,
+}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+# renderer -> (file extension, content type)
+FORMATS = {
+    'image': ('jpg', 'image/jpeg'),
+    'pdf': ('png', 'image/png'),
+    'text': ('svg', 'image/svg+xml'),
+}
+# Rendition URLs carry the document's upload time, so browsers can keep them.
+MAX_AGE = 24 * 3600
+TEXT_COLUMNS = 80
+TEXT_LINES = 60
+# Renders of files that failed once aren't retried on every request.
+FAILED_MEMORY = 1000
+
+cache = filecache.FileCache('previews', 'DMS_PREVIEW_CACHE_SIZE', 256 * 1024 * 1024)
+
+_pending = {}
+_failed = OrderedDict()
+_lock = threading.Lock()
+
+
+def render_timeout():
+    return getattr(settings, 'DMS_PREVIEW_TIMEOUT', 10)
+
+
+def pdftoppm():
+    return shutil.which('pdftoppm')
+
+
+def renderer_for(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in IMAGE_EXTENSIONS and Image is not None:
+        return 'image'
+    if ext == '.pdf' and (fitz is not None or pdftoppm()):
+        return 'pdf'
+    if ext in extraction.TEXT_EXTENSIONS or ext in extraction.OFFICE_PARTS:
+        return 'text'
+    return None
+
+
+def content_hash(doc):
+    if doc.blob_id:
+        return doc.blob.sha256
+    filehash = getattr(doc, 'filehash', None)
+    return filehash.hash_value if filehash else None
+
+
+def cache_key(doc, rendition):
+    """``<content hash>-<size>.<ext>``, or None if the document can't be rendered."""
+    renderer = renderer_for(doc.file.name)
+    digest = content_hash(doc)
+    if renderer is None or not digest:
+        return None
+    return f'{digest}-{RENDITIONS[rendition]}.{FORMATS[renderer][0]}'
+
+
+# --- Rendering ---
+def get_rendition(doc, rendition, wait=True):
+    """
+    Return the cached path of ``doc``'s rendition, rendering it in the
+    background pool if needed. None if it can't be rendered, failed, or
+    (with ``wait``) took longer than DMS_PREVIEW_TIMEOUT.
+    """
+    key = cache_key(doc, rendition)
+    if key is None:
+        return None
+    path = cache.get(key)
+    if path or key in _failed:
+        return path
+    job = (key, renderer_for(doc.file.name), doc.file.path, doc.file.name, RENDITIONS[rendition])
+    if getattr(settings, 'DMS_BACKGROUND_SYNC', False):
+        return _render(*job)
+    with _lock:
+        future = _pending.get(key)
+        if future is None:
+            future = background.submit(_render, *job)
+            _pending[key] = future
+            future.add_done_callback(lambda f, key=key: _pending.pop(key, None))
+    if not wait:
+        return None
+    try:
+        return future.result(timeout=render_timeout())
+    except TimeoutError:
+        return None
+
+
+def prerender(doc):
+    """Queue ``doc``'s thumbnail, e.g. right after upload."""
+    get_rendition(doc, 'thumb', wait=False)
+
+
+def _render(key, renderer, source, filename, size):
+    path = cache.get(key)
+    if path:
+        return path
+    try:
+        return cache.put(key, lambda out: RENDERERS[renderer](source, filename, size, out))
+    except Exception:
+        logger.warning("Could not render a preview of %s", filename, exc_info=True)
+        with _lock:
+            _failed[key] = True
+            while len(_failed) > FAILED_MEMORY:
+                _failed.popitem(last=False)
+        return None
+
+
+def render_image(source, filename, size, out):
+    with compression.open_file(source) as f, Image.open(f) as image:
+        # JPEG decoders can downscale while decoding; other formats ignore this.
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background_image = Image.new('RGB', image.size, 'white')
+            background_image.paste(image, mask=image.getchannel('A'))
+            image = background_image
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(out, 'JPEG', quality=80, optimize=True)
+
+
+def render_pdf(source, filename, size, out):
+    data = None
+    if compression.codec_of(source):
+        # Both renderers want a path; a compressed file is handed over in memory instead.
+        with compression.open_file(source) as f:
+            data = f.read()
+    if fitz is not None:
+        with (fitz.open(stream=data, filetype='pdf') if data is not None else fitz.open(source)) as pdf:
+            page = pdf[0]
+            zoom = size / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            out.write(pixmap.tobytes('png'))
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        prefix = os.path.join(tmp, 'page')
+        subprocess.run(
+            [pdftoppm(), '-f', '1', '-l', '1', '-png', '-singlefile', '-scale-to', str(size),
+             '-' if data is not None else source, prefix],
+            input=data, check=True, capture_output=True, timeout=render_timeout() * 3,
+        )
+        with open(prefix + '.png', 'rb') as f:
+            shutil.copyfileobj(f, out)
+
+
+def render_text(source, filename, size, out):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in extraction.TEXT_EXTENSIONS:
+        with io.TextIOWrapper(compression.open_file(source), encoding='utf-8', errors='replace') as f:
+            text = f.read(TEXT_COLUMNS * TEXT_LINES * 2)
+    else:
+        # Office files: the extracted text, without their layout.
+        text = extraction.extract_text(source, filename)[:TEXT_COLUMNS * TEXT_LINES]
+    lines = []
+    for line in text.expandtabs(4).splitlines() or ['']:
+        lines.extend(textwrap.wrap(line, TEXT_COLUMNS) or [''])
+        if len(lines) >= TEXT_LINES:
+            break
+    out.write(_text_svg(lines[:TEXT_LINES], size).encode())
+
+
+RENDERERS = {
+    'image': render_image,
+    'pdf': render_pdf,
+    'text': render_text,
+}
+
+
+def _printable(line):
+    # Control characters aren't allowed in XML.
+    return ''.join(c for c in line if c >= ' ' or c == '\t')
+
+
+def _text_svg(lines, size):
+    # A portrait page, like a printed sheet.
+    height = size
+    width = int(size * 0.75)
+    font = height / (TEXT_LINES + 4)
+    rows = ''.join(
+        f'<tspan x="{font:.1f}" dy="{font:.1f}">{escape(_printable(line))}</tspan>'
+        for line in lines
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+        f'<rect width="100%" height="100%" fill="#fff" stroke="#ccc"/>'
+        f'<text y="{font:.1f}" font-family="monospace" font-size="{font * 0.9:.1f}" fill="#333" '
+        f'xml:space="preserve">{rows}</text></svg>'
+    )
+
+
+def placeholder(filename, rendition):
+    """A generic icon labelled with the file extension, for types that can't be rendered."""
+    size = RENDITIONS[rendition]
+    label = escape(os.path.splitext(filename)[1].lstrip('.').upper()[:5] or 'FILE')
+    width = int(size * 0.75)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{size}" viewBox="0 0 75 100">'
+        '<path d="M5 2h45l20 20v76H5z" fill="#f8f9fa" stroke="#adb5bd" stroke-width="2"/>'
+        '<path d="M50 2v20h20" fill="none" stroke="#adb5bd" stroke-width="2"/>'
+        f'<text x="37.5" y="65" font-family="sans-serif" font-size="14" font-weight="bold" '
+        f'text-anchor="middle" fill="#6c757d">{label}</text></svg>'
+    )
+
+
+def placeholder_response(filename, rendition):
+    response = HttpResponse(placeholder(filename, rendition), content_type='image/svg+xml')
+    secure_response(response)
+    return response
+
+
+def secure_response(response):
+    # SVG renders are built from user content: never let them run anything.
+    response['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+    return response
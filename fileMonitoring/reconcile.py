@@ -0,0 +1,150 @@
+"""
+Reconciliation of MEDIA_ROOT against the database.
+
+``orphan_files`` walks the media directory with ``os.scandir``, one
+directory at a time, and checks the names it finds against the Blob,
+Document and DocumentVersion rows in batches, so memory is bounded by the
+batch size and the directory depth rather than the number of files. The
+preview/version caches and in-progress uploads are skipped; they are
+managed by filecache.py and ``manage.py cleanup_uploads``.
+
+``dangling_rows`` streams the rows whose file is missing, and
+``unreferenced_blobs`` the blob rows nothing points at. Versions are only
+deleted together with their document, so ``delete_dangling_documents``
+deletes every document that one of those rows belongs to, through
+``blobstore.delete_documents`` like any other deletion. See ``manage.py
+reconcile_media``.
+"""
+import os
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import blobstore, filecache, uploads
+from .models import Blob, Document, DocumentVersion
+
+ROW_BATCH = 2000
+
+
+def _skipped_dirs():
+    return {os.path.realpath(filecache.cache_root()), os.path.realpath(uploads.upload_dir())}
+
+
+def walk(root):
+    """Yield ``os.DirEntry`` objects of the files under ``root``, depth first."""
+    skipped = _skipped_dirs()
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.realpath(entry.path) not in skipped:
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def orphan_files(min_age=0, batch_size=blobstore.NAME_BATCH):
+    """
+    Yield ``(storage name, size)`` of files under MEDIA_ROOT that no row
+    points at and that are at least ``min_age`` seconds old (younger files
+    may belong to an upload whose row isn't committed yet).
+    """
+    root = settings.MEDIA_ROOT
+    cutoff = time.time() - min_age
+    batch = {}
+    for entry in walk(root):
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > cutoff:
+            continue
+        batch[os.path.relpath(entry.path, root)] = stat.st_size
+        if len(batch) >= batch_size:
+            yield from _unreferenced(batch)
+            batch = {}
+    if batch:
+        yield from _unreferenced(batch)
+
+
+def _unreferenced(batch):
+    in_use = blobstore.referenced_names(batch)
+    for name, size in batch.items():
+        if name not in in_use:
+            yield name, size
+
+
+def dangling_rows():
+    """
+    Yield ``(model name, pk, storage name)`` for rows whose file is missing.
+    Documents and versions stored as blobs are covered by their blob.
+    """
+    storage = Blob._meta.get_field('file').storage
+    querysets = [
+        ('Blob', Blob.objects.values_list('pk', 'file')),
+        ('Document', Document.objects.filter(blob__isnull=True).values_list('pk', 'file')),
+        ('DocumentVersion', DocumentVersion.objects.filter(blob__isnull=True).values_list('pk', 'version_file')),
+    ]
+    for model_name, rows in querysets:
+        for pk, name in rows.iterator(chunk_size=ROW_BATCH):
+            if not name or not os.path.exists(storage.path(name)):
+                yield model_name, pk, name
+
+
+def dangling_documents(rows):
+    """Ids of the documents whose content or versions the ``dangling_rows`` ``rows`` belong to."""
+    pks = defaultdict(list)
+    for model_name, pk, _ in rows:
+        pks[model_name].append(pk)
+    doc_ids = set(pks['Document'])
+    for i in range(0, max(len(pks['Blob']), len(pks['DocumentVersion'])), ROW_BATCH):
+        blobs, versions = pks['Blob'][i:i + ROW_BATCH], pks['DocumentVersion'][i:i + ROW_BATCH]
+        doc_ids.update(Document.objects.filter(blob__in=blobs).values_list('pk', flat=True))
+        doc_ids.update(DocumentVersion.objects.filter(
+            Q(blob__in=blobs) | Q(pk__in=versions)
+        ).values_list('document_id', flat=True))
+    return sorted(doc_ids)
+
+
+def delete_dangling_documents(rows):
+    """
+    Delete the documents ``rows`` from ``dangling_rows`` belong to, releasing
+    their blobs and storage like any other deletion; return their ids.
+    """
+    doc_ids = dangling_documents(rows)
+    for i in range(0, len(doc_ids), ROW_BATCH):
+        blobstore.delete_documents(Document.objects.filter(pk__in=doc_ids[i:i + ROW_BATCH]))
+    return doc_ids
+
+
+def unreferenced_blobs(min_age=0):
+    """
+    Blob rows that no document or version points at, whatever their
+    ref_count says, created at least ``min_age`` seconds ago (an upload
+    stores its blob just before the row pointing at it).
+    """
+    return Blob.objects.filter(
+        ~Exists(Document.objects.filter(blob=OuterRef('pk'))),
+        ~Exists(DocumentVersion.objects.filter(blob=OuterRef('pk'))),
+        created_at__lte=timezone.now() - timedelta(seconds=min_age),
+    )
+
+
+def delete_unreferenced_blobs(min_age=0):
+    """Delete unreferenced blob rows and their files; return how many went."""
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(unreferenced_blobs(min_age).select_for_update().values_list('pk', 'file')[:ROW_BATCH])
+            if not blobs:
+                break
+            unreferenced_blobs(min_age).filter(pk__in=[pk for pk, _ in blobs]).delete()
+        blobstore.unlink_unreferenced(name for _, name in blobs)
+        deleted += len(blobs)
+    return deleted
@@ -0,0 +1,51 @@
+"""
+Trash retention.
+
+Documents that have been in the trash longer than DMS_TRASH_RETENTION_DAYS
+are deleted for good by ``manage.py purge_trash`` (run it from cron). They
+go in batches of DMS_PURGE_BATCH_SIZE, each in its own short transaction,
+and their files (every version's blob or delta) are unlinked by the
+background pool once the batch commits.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import blobstore
+from .models import Document
+
+
+def retention_days():
+    """Days a document stays in the trash; None keeps trash forever."""
+    return getattr(settings, 'DMS_TRASH_RETENTION_DAYS', 30)
+
+
+def purge_batch_size():
+    return getattr(settings, 'DMS_PURGE_BATCH_SIZE', 500)
+
+
+def expired(now=None):
+    """Trashed documents past the retention period."""
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days())
+    # Trash rows from before deleted_at existed have none and are kept.
+    return Document.objects.filter(is_deleted=True, deleted_at__lt=cutoff)
+
+
+def purge_expired(now=None, batch_size=None, limit=None):
+    """Permanently delete expired trash; return how many documents were purged."""
+    if retention_days() is None:
+        return 0
+    batch_size = batch_size or purge_batch_size()
+    purged = 0
+    while limit is None or purged < limit:
+        size = batch_size if limit is None else min(batch_size, limit - purged)
+        ids = list(expired(now).order_by('deleted_at', 'id').values_list('id', flat=True)[:size])
+        if not ids:
+            break
+        # Re-checked in the delete, in case one was restored meanwhile.
+        blobstore.delete_documents(expired(now).filter(pk__in=ids))
+        purged += len(ids)
+        if len(ids) < size:
+            break
+    return purged
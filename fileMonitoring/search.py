@@ -0,0 +1,129 @@
+"""
+Full-text search over document names, folder and category names and
+extracted file contents.
+
+``SearchEntry`` rows are kept current by the signals in ``signals.py``. On
+SQLite they are indexed by the ``fileMonitoring_search_fts`` FTS5 table and
+ranked with bm25; on PostgreSQL the same rows are ranked with its built-in
+full-text search; any other backend falls back to substring matching.
+
+The FTS table also indexes each entry's owner, and a search matches the
+owner's id along with the words, so only the user's own rows are ranked
+rather than every user's rows that contain the words.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from . import background, extraction
+from .models import Document, SearchEntry
+from .pagination import KeysetPage, page_size
+
+FTS_TABLE = 'fileMonitoring_search_fts'
+# bm25 column weights: name, folder, category, content, owner_id
+FTS_WEIGHTS = (10.0, 4.0, 4.0, 1.0, 0.0)
+FTS_TEXT_COLUMNS = '{name folder category content}'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+# --- Indexing ---
+def index_document(doc):
+    folder = doc.folder
+    entry, _ = SearchEntry.objects.update_or_create(
+        document=doc,
+        defaults={
+            'name': doc.name,
+            'folder': folder.name if folder else '',
+            'category': folder.category.name if folder else '',
+            'owner_id': doc.uploaded_by_id,
+        },
+    )
+    if entry.content_source != doc.file.name:
+        background.submit_on_commit(extract_content, doc.pk)
+
+
+def extract_content(doc_id):
+    doc = Document.objects.filter(pk=doc_id).only('file').first()
+    if doc is None or not doc.file:
+        return
+    try:
+        text = extraction.extract_text(doc.file.path, doc.file.name)
+    except OSError:
+        return
+    SearchEntry.objects.filter(document_id=doc_id).update(content=text, content_source=doc.file.name)
+
+
+def reindex_folder(folder):
+    SearchEntry.objects.filter(document__folder=folder).update(
+        folder=folder.name, category=folder.category.name
+    )
+
+
+def reindex_category(category):
+    SearchEntry.objects.filter(document__folder__category=category).update(category=category.name)
+
+
+# --- Querying ---
+def fts_query(text):
+    """Turn user input into an FTS5 query: every word must match, as a prefix."""
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(text))
+
+
+def search_ids(user, text, offset, limit):
+    """Return ranked ids of ``user``'s live documents matching ``text``."""
+    if connection.vendor == 'sqlite':
+        query = fts_query(text)
+        if not query:
+            return []
+        # The words only match the text columns, or a number in the search
+        # would match the owner column of every one of the user's rows.
+        query = f'{{owner_id}} : "{user.pk}" AND {FTS_TEXT_COLUMNS} : ({query})'
+        weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+        sql = (
+            f'SELECT s.rowid FROM "{FTS_TABLE}" s '
+            f'JOIN "{Document._meta.db_table}" d ON d.id = s.rowid '
+            f'WHERE "{FTS_TABLE}" MATCH %s AND d.is_deleted = %s '
+            f'ORDER BY bm25("{FTS_TABLE}", {weights}) LIMIT %s OFFSET %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [query, False, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    entries = SearchEntry.objects.filter(document__uploaded_by=user, document__is_deleted=False)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        vector = (SearchVector('name', weight='A') + SearchVector('folder', 'category', weight='B')
+                  + SearchVector('content', weight='D'))
+        search_query = SearchQuery(text, search_type='websearch')
+        entries = entries.annotate(rank=SearchRank(vector, search_query)) \
+            .filter(rank__gt=0).order_by('-rank', '-document_id')
+    else:
+        for token in TOKEN_RE.findall(text):
+            entries = entries.filter(
+                Q(name__icontains=token) | Q(folder__icontains=token)
+                | Q(category__icontains=token) | Q(content__icontains=token)
+            )
+        entries = entries.order_by('-document_id')
+    return list(entries.values_list('document_id', flat=True)[offset:offset + limit])
+
+
+def search_page(user, text, cursor=None):
+    """One page of ranked results; the cursor is the offset of the page."""
+    size = page_size()
+    try:
+        offset = max(0, int(cursor or 0))
+    except ValueError:
+        offset = 0
+    ids = search_ids(user, text, offset, size + 1)
+    more = len(ids) > size
+    ids = ids[:size]
+    docs = Document.objects.filter(pk__in=ids).select_related('folder__category').in_bulk()
+    items = [docs[pk] for pk in ids if pk in docs]
+    return KeysetPage(
+        items,
+        next_cursor=str(offset + size) if more else None,
+        previous_cursor=str(max(0, offset - size)) if offset else None,
+    )
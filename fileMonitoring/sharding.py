@@ -0,0 +1,166 @@
+"""
+Moving stored files into the current DMS_MEDIA_FANOUT layout.
+
+``planned_moves`` scans blob rows and the blob-less document and version
+rows (files from before the blob store, and delta files) in primary key
+order and yields batches of ``(old name, new name)`` for files that are not
+where the layout puts them. Rows already in place are skipped, so a run
+that is interrupted or stopped with ``--limit`` simply resumes on the next
+one.
+
+``move_files`` links each file under its new name, then re-points every
+row naming it in one transaction; nothing is unlinked, so a reader that
+loaded a row just before the commit still finds the file. ``retire``
+deletes the old names some seconds later, first re-pointing any row that
+picked up an old name in the meantime. See ``manage.py shard_media``.
+"""
+import os
+import shutil
+
+from django.conf import settings
+from django.db import transaction
+
+from . import blobstore
+from .models import Blob, Document, DocumentVersion, SearchEntry, blob_upload_path, sharded_name
+
+
+def _storage():
+    return Blob._meta.get_field('file').storage
+
+
+def target_name(name):
+    """Where the file stored as ``name`` (not a blob) belongs in the current layout."""
+    directory, _, rest = name.replace('\\', '/').partition('/')
+    if not rest:
+        directory = 'documents'
+    return sharded_name(directory, os.path.basename(name))
+
+
+# --- Planning ---
+def _scan(queryset, target, batch_size):
+    last = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last).order_by('pk')[:batch_size])
+        if not rows:
+            return
+        last = rows[-1][0]
+        moves = []
+        for row in rows:
+            new = target(row)
+            if row[1] and row[1] != new:
+                moves.append((row[1], new))
+        yield moves
+
+
+def planned_moves(batch_size=200):
+    """Yield lists of up to ``batch_size`` ``(old name, new name)`` pairs, each name once."""
+    sources = [
+        _scan(Blob.objects.values_list('pk', 'file', 'sha256'),
+              lambda row: blob_upload_path(Blob(sha256=row[2]), row[1]), batch_size),
+        _scan(Document.objects.filter(blob__isnull=True).values_list('pk', 'file'),
+              lambda row: target_name(row[1]), batch_size),
+        _scan(DocumentVersion.objects.filter(blob__isnull=True).values_list('pk', 'version_file'),
+              lambda row: target_name(row[1]), batch_size),
+    ]
+    batch = {}
+    for source in sources:
+        for moves in source:
+            for old, new in moves:
+                batch.setdefault(old, new)
+            if len(batch) >= batch_size:
+                yield list(batch.items())
+                batch = {}
+    if batch:
+        yield list(batch.items())
+
+
+# --- Moving ---
+def _rename_rows(old, new):
+    Blob.objects.filter(file=old).update(file=new)
+    Document.objects.filter(file=old).update(file=new)
+    DocumentVersion.objects.filter(version_file=old).update(version_file=new)
+    # Keeps search from re-extracting the text of a file that only moved.
+    SearchEntry.objects.filter(content_source=old).update(content_source=new)
+
+
+def _link(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        # No hard links on this filesystem.
+        shutil.copy2(source, target)
+
+
+def move_files(moves):
+    """
+    Put each ``(old, new)`` file under its new name and re-point its rows.
+    Returns ``(moved, missing)``: the pairs that moved, whose old names are
+    for ``retire``, and the old names that had no file.
+    """
+    storage = _storage()
+    linked = []
+    missing = []
+    created = []
+    try:
+        for old, new in moves:
+            source = storage.path(old)
+            if not os.path.exists(source):
+                missing.append(old)
+                continue
+            target = storage.path(new)
+            if os.path.exists(target) and not os.path.samefile(source, target):
+                # Something else already has the name; take a free one next to it.
+                new = storage.get_available_name(new)
+                target = storage.path(new)
+            if not os.path.exists(target):
+                _link(source, target)
+                created.append(target)
+            linked.append((old, new))
+
+        with transaction.atomic():
+            # Serialises with store_file and release, which lock the blob row.
+            list(Blob.objects.select_for_update().filter(file__in=[old for old, _ in linked]).values_list('pk'))
+            for old, new in linked:
+                _rename_rows(old, new)
+            in_use = blobstore.referenced_names(new for _, new in linked)
+    except BaseException:
+        for target in created:
+            os.remove(target)
+        raise
+
+    # A row deleted since planning has nothing to re-point; drop its copy.
+    moved = []
+    for old, new in linked:
+        if new in in_use:
+            moved.append((old, new))
+        elif storage.path(new) in created:
+            os.remove(storage.path(new))
+    return moved, missing
+
+
+def retire(moves):
+    """Delete the old names of ``moves`` made by ``move_files``."""
+    storage = _storage()
+    targets = dict(moves)
+    with transaction.atomic():
+        # A row written from an old copy of a blob row during the move.
+        for old in blobstore.referenced_names(targets):
+            _rename_rows(old, targets[old])
+    for old in targets:
+        path = storage.path(old)
+        if os.path.exists(path):
+            os.remove(path)
+            _prune(os.path.dirname(path))
+
+
+def _prune(directory):
+    """Remove ``directory`` and its parents while empty, up to the top-level media directory."""
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    directory = os.path.realpath(directory)
+    while os.path.dirname(directory) != root and directory.startswith(root + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
@@ -0,0 +1,71 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import listcache, metrics, search
+from .models import Category, Document, Folder
+
+# Fields whose change affects the search index; saves that only touch other
+# columns (share/trash flags, counters) skip reindexing.
+SEARCH_FIELDS = {'name', 'file', 'folder'}
+
+
+# --- Search index ---
+@receiver(post_save, sender=Document)
+def index_document(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    search.index_document(instance)
+
+
+@receiver(post_save, sender=Folder)
+def reindex_folder(sender, instance, created, **kwargs):
+    if not created:
+        search.reindex_folder(instance)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    if not created:
+        search.reindex_category(instance)
+
+
+# --- Cached listings ---
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    listcache.invalidate_tree([instance.created_by_id])
+    listcache.invalidate_folders([instance.created_by_id])
+
+
+@receiver(post_save, sender=Folder)
+@receiver(post_delete, sender=Folder)
+def invalidate_folder(sender, instance, **kwargs):
+    if Folder.category.is_cached(instance):
+        owners = [instance.category.created_by_id]
+    else:
+        # The category may already be gone when it was deleted with its
+        # folders; its own signal covers that.
+        owners = list(Category.objects.filter(pk=instance.category_id).values_list('created_by', flat=True))
+    listcache.invalidate_tree(owners)
+    listcache.invalidate_folders(owners)
+
+
+@receiver(post_save, sender=Document)
+def invalidate_shared_document(sender, instance, created, update_fields=None, **kwargs):
+    # A full save may have unshared the document, so only saves known to
+    # leave an unshared document unshared are skipped.
+    if instance.is_shared or (update_fields is None and not created) or 'is_shared' in (update_fields or ()):
+        listcache.invalidate_shared()
+
+
+@receiver(post_delete, sender=Document)
+def invalidate_deleted_document(sender, instance, **kwargs):
+    if instance.is_shared and not instance.is_deleted:
+        listcache.invalidate_shared()
+
+
+# --- Metrics ---
+@receiver(connection_created)
+def record_queries(sender, connection, **kwargs):
+    metrics.install_query_recorder(connection)
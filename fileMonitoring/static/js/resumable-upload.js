@@ -0,0 +1,136 @@
+// Resumable, parallel chunked uploads for forms marked with data-resumable-url.
+// Files at or above data-resumable-threshold bytes are sent in chunks; an
+// interrupted upload of the same file to the same target resumes where it
+// stopped.
+(function () {
+  'use strict';
+
+  var PARALLEL = 4;
+  var RETRIES = 3;
+  var TARGETS = ['document', 'folder'];
+
+  function target(form) {
+    var result = {};
+    TARGETS.forEach(function (field) {
+      result[field] = form.elements[field] ? form.elements[field].value : '';
+    });
+    return result;
+  }
+
+  function storageKey(form, file) {
+    var t = target(form);
+    return ['dms-upload', form.action, t.document, t.folder, file.name, file.size, file.lastModified].join(':');
+  }
+
+  function sameTarget(form, session) {
+    var t = target(form);
+    return TARGETS.every(function (field) { return String(session[field] || '') === t[field]; });
+  }
+
+  function request(method, url, csrf, body, headers) {
+    var init = {method: method, headers: Object.assign({'X-CSRFToken': csrf}, headers || {}), body: body, credentials: 'same-origin'};
+    return fetch(url, init).then(function (response) {
+      return response.json().then(function (data) {
+        if (!response.ok) { throw new Error(data.error || response.statusText); }
+        return data;
+      });
+    });
+  }
+
+  function openSession(form, file, baseUrl, csrf) {
+    var saved = window.localStorage.getItem(storageKey(form, file));
+    var create = function () {
+      var data = new FormData();
+      data.append('filename', file.name);
+      data.append('size', file.size);
+      ['name', 'folder', 'document'].forEach(function (field) {
+        if (form.elements[field] && form.elements[field].value) { data.append(field, form.elements[field].value); }
+      });
+      return request('POST', baseUrl, csrf, data).then(function (session) {
+        window.localStorage.setItem(storageKey(form, file), session.id);
+        return session;
+      });
+    };
+    if (!saved) { return create(); }
+    return request('GET', baseUrl + saved + '/', csrf).then(function (session) {
+      return sameTarget(form, session) ? session : create();
+    }, create);
+  }
+
+  function complete(form, session, baseUrl, csrf) {
+    // The server refuses to finalize into any other document or folder.
+    var data = new FormData();
+    var t = target(form);
+    TARGETS.forEach(function (field) { data.append(field, t[field]); });
+    return request('POST', baseUrl + session.id + '/complete/', csrf, data);
+  }
+
+  function sendChunks(session, file, baseUrl, csrf, onProgress) {
+    var queue = session.missing.slice();
+    var done = session.chunk_count - queue.length;
+
+    function sendOne(index, attempt) {
+      var start = index * session.chunk_size;
+      var blob = file.slice(start, Math.min(start + session.chunk_size, file.size));
+      var url = baseUrl + session.id + '/chunks/' + index + '/';
+      return request('PUT', url, csrf, blob, {'Content-Type': 'application/octet-stream'})
+        .catch(function (error) {
+          if (attempt >= RETRIES) { throw error; }
+          return sendOne(index, attempt + 1);
+        });
+    }
+
+    function worker() {
+      if (!queue.length) { return Promise.resolve(); }
+      var index = queue.shift();
+      return sendOne(index, 1).then(function () {
+        done += 1;
+        onProgress(done / session.chunk_count);
+        return worker();
+      });
+    }
+
+    var workers = [];
+    for (var i = 0; i < PARALLEL; i++) { workers.push(worker()); }
+    return Promise.all(workers);
+  }
+
+  function upload(form, input) {
+    var file = input.files[0];
+    var baseUrl = form.dataset.resumableUrl;
+    var csrf = form.elements.csrfmiddlewaretoken.value;
+    var progress = form.querySelector('[data-resumable-progress]');
+    var bar = progress && progress.querySelector('.progress-bar');
+    var button = form.querySelector('button');
+    var setProgress = function (fraction) {
+      if (!bar) { return; }
+      bar.style.width = Math.round(fraction * 100) + '%';
+      bar.textContent = Math.round(fraction * 100) + '%';
+    };
+
+    if (progress) { progress.classList.remove('d-none'); }
+    if (button) { button.disabled = true; }
+    return openSession(form, file, baseUrl, csrf).then(function (session) {
+      setProgress((session.chunk_count - session.missing.length) / session.chunk_count);
+      return sendChunks(session, file, baseUrl, csrf, setProgress).then(function () {
+        return complete(form, session, baseUrl, csrf);
+      });
+    }).then(function (result) {
+      window.localStorage.removeItem(storageKey(form, file));
+      window.location.href = result.redirect;
+    }).catch(function (error) {
+      if (button) { button.disabled = false; }
+      window.alert('Upload interrupted: ' + error.message + '. Submit again to resume.');
+    });
+  }
+
+  document.querySelectorAll('form[data-resumable-url]').forEach(function (form) {
+    form.addEventListener('submit', function (event) {
+      var input = form.querySelector('input[type=file]');
+      var threshold = parseInt(form.dataset.resumableThreshold || '0', 10);
+      if (!window.fetch || !input.files.length || input.files[0].size < threshold) { return; }
+      event.preventDefault();
+      upload(form, input);
+    });
+  });
+})();
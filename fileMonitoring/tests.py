@@ -1,3 +1,1616 @@
-from django.test import TestCase
+"""
+Query-count and latency budgets for every view in ``fileMonitoring/urls.py``,
+and the behaviour of the pieces those views are built from.
 
-# Create your tests here.
+Each scale seeds a dataset with ``manage.py seed_dms`` and requests every URL
+once as a seeded user, failing if a view runs more queries or takes longer
+than its budget. Query budgets are the same at every scale: a view whose
+query count grows with the data has an N+1. Any query whose plan scans a
+whole table is printed with its EXPLAIN QUERY PLAN.
+
+The 10^3 and 10^4 scales run by default, the second so that latency budgets
+are checked against tables big enough for a missing index to show; seeding
+it takes about 15 seconds. Set DMS_TEST_SCALES to a
+comma-separated list (e.g. ``1000,100000,1000000``) to run the larger ones;
+seeding 10^5 documents takes a few minutes and 10^6 about half an hour.
+
+``ConcurrentVersionUploadTests`` fires parallel version uploads at one
+document; it needs the on-disk test database configured in settings. The
+remaining classes check outputs: range responses, compressed blobs, deltas
+and chunk manifests, cursors, bulk results, exports and imports.
+"""
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from . import (
+    accounting, analytics, blobstore, compression, delta, downloads, eventlog, extraction, filecache, hashing,
+    integrity, listcache, metrics, pagination, previews, retention, search, uploads, urls,
+)
+from .models import (
+    ActivityLog, Blob, Category, ChunkManifest, Document, DocumentVersion, Folder, IntegrityCheckLog, SearchEntry,
+    UploadChunk, UploadSession, UsageStat, UserProfile, sharded_name,
+)
+
+SCALES = (1_000, 10_000, 100_000, 1_000_000)
+PASSWORD = 'password'
+
+# url name -> (max queries, max milliseconds). The suite logs synchronously
+# (DMS_LOG_SYNC), so views that log an event also pay for its insert and
+# rollup updates here; in production those are batched off the request.
+BUDGETS = {
+    'dashboard': (5, 250),
+    'login': (15, 250),
+    'register': (3, 250),
+    'logout': (10, 250),
+    'upload_document': (46, 500),
+    'smart_preview': (19, 250),
+    'document_rendition': (3, 250),
+    'download_document': (22, 250),
+    'download_version': (3, 250),
+    'my_files': (5, 250),
+    'my_files_search': (6, 250),
+    'delete_file': (9, 250),
+    'trash': (3, 250),
+    'restore_file': (9, 250),
+    'permanent_delete_file': (27, 500),
+    'analytics': (7, 250),
+    'create_category': (3, 250),
+    'create_folder': (4, 250),
+    'view_folders': (4, 250),
+    'view_folder_documents': (4, 250),
+    'upload_new_version': (41, 500),
+    'document_versions': (4, 250),
+    'create_upload_session': (5, 250),
+    'upload_session': (5, 250),
+    'upload_chunk': (9, 250),
+    'complete_upload_session': (49, 500),
+    'restore_version': (39, 500),
+    'check_file_integrity': (7, 500),
+    'integrity_history': (4, 250),
+    'shared_documents': (3, 250),
+    'access_log': (4, 250),
+    'toggle_share': (4, 250),
+    'bulk_documents': (40, 500),
+    'export_documents': (12, 500),
+    'cache_stats': (2, 250),
+    'metrics': (2, 250),
+}
+
+
+def enabled_scales():
+    value = os.environ.get('DMS_TEST_SCALES', '1000,10000')
+    return {int(scale) for scale in value.split(',') if scale.strip()}
+
+
+def full_scans(sql):
+    """EXPLAIN QUERY PLAN rows of ``sql`` if any step scans a whole table."""
+    if connection.vendor != 'sqlite' or not sql.lstrip().upper().startswith('SELECT'):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        plan = [row[3] for row in cursor.fetchall()]
+    scans = [step for step in plan if step.startswith('SCAN ') and 'USING' not in step and 'VIRTUAL TABLE' not in step]
+    return plan if scans else []
+
+
+class TempMediaMixin:
+    """Stores the files a test class uploads under its own temporary MEDIA_ROOT."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class TempDirMixin:
+    """A temporary directory per test, with a helper to write files into it."""
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+
+class QueryBudgetMixin:
+    scale = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        # Password hashing would dominate the login and register timings.
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=cls.media_root,
+            PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        )
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_dms', documents=cls.scale, users=20, files=min(cls.scale, 200),
+            usage=3, activity=1, password=PASSWORD, prefix='budget', verbosity=0,
+        )
+        # The seeded user with the most documents.
+        cls.user = User.objects.filter(username__startswith='budget_').order_by('id').first()
+        # Staff, so the staff-only views are measured past their permission check.
+        cls.user.is_staff = True
+        cls.user.save(update_fields=['is_staff'])
+        live = Document.objects.filter(uploaded_by=cls.user, is_deleted=False).order_by('id')
+        trashed = Document.objects.filter(uploaded_by=cls.user, is_deleted=True).order_by('id')
+        cls.doc, cls.doc_to_delete, cls.doc_to_share = live[:3]
+        cls.bulk_ids = list(live.values_list('id', flat=True)[3:13])
+        cls.trashed, cls.trashed_to_purge = trashed[:2]
+        cls.folder = Folder.objects.filter(category__created_by=cls.user).order_by('id').first()
+        cls.version = DocumentVersion.objects.filter(document=cls.doc).order_by('id').first()
+        cls.upload = uploads.create_session(cls.user, 'budget.bin', 16)
+        cls.abandoned_upload = uploads.create_session(cls.user, 'abandoned.bin', 16)
+        cls.other_doc = Document.objects.exclude(uploaded_by=cls.user).filter(is_shared=True, is_deleted=False) \
+            .order_by('id').first()
+
+    def setUp(self):
+        eventlog.recent_views.clear()
+        # Cached listings outlive each test's rolled-back transaction.
+        listcache.get_cache().clear()
+        self.client.login(username=self.user.username, password=PASSWORD)
+
+    def requests(self):
+        """``(budget name, method, url, data)`` for every URL, in an order that keeps each valid."""
+        upload = lambda: SimpleUploadedFile('budget.txt', b'budget upload contents')
+        return [
+            ('dashboard', 'get', reverse('dashboard'), None),
+            ('smart_preview', 'get', reverse('smart_preview', args=[self.other_doc.id]), None),
+            ('document_rendition', 'get', reverse('document_rendition', args=[self.doc.id, 'thumb']), None),
+            ('download_document', 'get', reverse('download_document', args=[self.other_doc.id]), None),
+            ('download_document', 'get', reverse('download_document', args=[self.doc.id]), None),
+            ('download_version', 'get', reverse('download_version', args=[self.version.id]), None),
+            ('my_files', 'get', reverse('my_files'), None),
+            ('my_files_search', 'get', reverse('my_files'), {'q': 'report'}),
+            ('trash', 'get', reverse('trash'), None),
+            ('analytics', 'get', reverse('analytics'), None),
+            ('create_category', 'get', reverse('create_category'), None),
+            ('create_category', 'post', reverse('create_category'), {'name': 'Budget'}),
+            ('create_folder', 'get', reverse('create_folder'), None),
+            ('create_folder', 'post', reverse('create_folder'), {'name': 'Budget', 'category': self.folder.category_id}),
+            ('view_folders', 'get', reverse('view_folders'), None),
+            ('view_folder_documents', 'get', reverse('view_folder_documents', args=[self.folder.id]), None),
+            ('export_documents', 'get', reverse('export_documents'), {'folder': self.folder.id}),
+            ('export_documents', 'post', reverse('export_documents'), {'ids': [self.doc.id, self.other_doc.id]}),
+            ('shared_documents', 'get', reverse('shared_documents'), None),
+            ('cache_stats', 'get', reverse('cache_stats'), None),
+            ('metrics', 'get', reverse('metrics'), None),
+            ('document_versions', 'get', reverse('document_versions', args=[self.doc.id]), None),
+            ('access_log', 'get', reverse('access_log', args=[self.doc.id]), None),
+            ('integrity_history', 'get', reverse('integrity_history', args=[self.doc.id]), None),
+            ('check_file_integrity', 'get', reverse('check_file_integrity', args=[self.doc.id]), None),
+            ('upload_document', 'get', reverse('upload_document'), None),
+            ('upload_document', 'post', reverse('upload_document'),
+             {'name': 'Budget upload', 'folder': self.folder.id, 'file': upload()}),
+            ('create_upload_session', 'post', reverse('create_upload_session'), {'filename': 'budget.bin', 'size': 16}),
+            ('upload_chunk', 'put', reverse('upload_chunk', args=[self.upload.id, 0]), b'resumable budget'),
+            ('upload_session', 'get', reverse('upload_session', args=[self.upload.id]), None),
+            ('complete_upload_session', 'post', reverse('complete_upload_session', args=[self.upload.id]), None),
+            ('upload_session', 'delete', reverse('upload_session', args=[self.abandoned_upload.id]), None),
+            ('upload_new_version', 'get', reverse('upload_new_version', args=[self.doc.id]), None),
+            ('upload_new_version', 'post', reverse('upload_new_version', args=[self.doc.id]), {'version_file': upload()}),
+            ('restore_version', 'post', reverse('restore_version', args=[self.version.id]), None),
+            ('toggle_share', 'post', reverse('toggle_share', args=[self.doc_to_share.id]), None),
+            ('delete_file', 'post', reverse('delete_file', args=[self.doc_to_delete.id]), None),
+            ('bulk_documents', 'post', reverse('bulk_documents'),
+             {'operation': 'move', 'ids': self.bulk_ids, 'target_folder': self.folder.id}),
+            ('bulk_documents', 'post', reverse('bulk_documents'),
+             {'operation': 'delete', 'ids': self.bulk_ids, 'next': reverse('my_files')}),
+            ('bulk_documents', 'post', reverse('bulk_documents'), {'operation': 'purge', 'ids': self.bulk_ids}),
+            ('restore_file', 'post', reverse('restore_file', args=[self.trashed.id]), None),
+            ('permanent_delete_file', 'post', reverse('permanent_delete_file', args=[self.trashed_to_purge.id]), None),
+            ('logout', 'get', reverse('logout'), None),
+            ('login', 'get', reverse('login'), None),
+            ('login', 'post', reverse('login'), {'username': self.user.username, 'password': PASSWORD}),
+            ('register', 'get', reverse('register'), None),
+            ('register', 'post', reverse('register'),
+             {'username': 'budget_new', 'email': 'new@example.com', 'password': PASSWORD}),
+        ]
+
+    def test_every_url_has_a_budget(self):
+        names = {p.name for p in urls.urlpatterns if isinstance(p, URLPattern) and p.name}
+        self.assertEqual(names - set(BUDGETS), set())
+        self.assertEqual(names - {request[0] for request in self.requests()}, set())
+
+    @override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True)
+    def test_query_and_latency_budgets(self):
+        for name, method, url, data in self.requests():
+            max_queries, max_ms = BUDGETS[name]
+            with self.subTest(view=name, method=method, scale=self.scale):
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    if method in ('put', 'delete'):
+                        response = getattr(self.client, method)(url, data or b'', content_type='application/octet-stream')
+                    else:
+                        response = getattr(self.client, method)(url, data)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                self.assertLess(response.status_code, 400)
+
+                for query in ctx.captured_queries:
+                    plan = full_scans(query['sql'])
+                    if plan:
+                        print(f"\n[{self.scale}] {method.upper()} {name} does a full scan:\n  {query['sql']}")
+                        print('\n'.join(f'    {step}' for step in plan))
+
+                self.assertLessEqual(len(ctx.captured_queries), max_queries,
+                                     '\n'.join(q['sql'] for q in ctx.captured_queries))
+                self.assertLessEqual(elapsed_ms, max_ms)
+
+
+for _scale in SCALES:
+    _name = f'QueryBudget{_scale}Tests'
+    globals()[_name] = unittest.skipUnless(_scale in enabled_scales(), f"DMS_TEST_SCALES doesn't include {_scale}")(
+        type(_name, (QueryBudgetMixin, TestCase), {'scale': _scale})
+    )
+del _scale, _name
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ConcurrentVersionUploadTests(TransactionTestCase):
+    """Parallel uploads of new versions of one document."""
+    threads = 8
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user('uploader', password=PASSWORD)
+        self.client.login(username='uploader', password=PASSWORD)
+        self.client.post(reverse('upload_document'), {'name': 'plan.txt', 'file': SimpleUploadedFile('plan.txt', b'version 1')})
+        self.doc = Document.objects.get()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, n):
+        client = Client()
+        client.force_login(self.user)
+        try:
+            content = SimpleUploadedFile('plan.txt', f'version {n}'.encode())
+            return client.post(reverse('upload_new_version', args=[self.doc.id]), {'version_file': content}).status_code
+        finally:
+            connections.close_all()
+
+    def test_parallel_uploads_get_distinct_numbers(self):
+        barrier = threading.Barrier(self.threads)
+
+        def upload(n):
+            barrier.wait()
+            return self.upload(n)
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            statuses = list(pool.map(upload, range(2, self.threads + 2)))
+        self.assertEqual(statuses, [302] * self.threads)
+
+        self.doc.refresh_from_db()
+        numbers = sorted(self.doc.versions.values_list('version_number', flat=True))
+        self.assertEqual(numbers, list(range(1, self.threads + 2)))
+        self.assertEqual(self.doc.version_count, self.threads + 1)
+        current = self.doc.current_version
+        self.assertEqual(current.version_number, self.threads + 1)
+        self.assertEqual(self.doc.blob_id, current.blob_id)
+        # Every blob's reference count matches the rows pointing at it.
+        for blob in Blob.objects.all():
+            self.assertEqual(blob.ref_count, blob.documents.count() + blob.versions.count(), blob.sha256)
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PaginationTests(TestCase):
+    """Keyset cursors, including ones a client garbled or made up."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pager', password=PASSWORD)
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.client.login(username='pager', password=PASSWORD)
+
+    @staticmethod
+    def cursor(*values):
+        return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+    def test_bad_cursors_decode_to_none(self):
+        for cursor in ['', '!!!', 'bm90IGpzb24', self.cursor('garbage', 1, False), self.cursor(None, 1, False),
+                       self.cursor('2024-01-01T00:00:00', None, False), self.cursor(1, 2), self.cursor(1, 2, 'yes')]:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(pagination.decode_cursor(cursor, Document, 'uploaded_at'))
+        self.assertIsNone(pagination.decode_cursor(self.cursor(None, 1, False), Document, 'size'))
+        self.assertEqual(pagination.decode_cursor(self.cursor(10, '3', True), Document, 'size'), (10, 3, True))
+
+    def test_bad_cursor_gives_first_page(self):
+        for cursor in [self.cursor('garbage', 1, False), self.cursor(None, 1, False)]:
+            for sort in ['date', 'size', 'name']:
+                with self.subTest(cursor=cursor, sort=sort):
+                    response = self.client.get(reverse('my_files'), {'cursor': cursor, 'sort': sort})
+                    self.assertEqual(response.status_code, 200)
+        for name in ['trash', 'shared_documents', 'analytics']:
+            with self.subTest(view=name):
+                response = self.client.get(reverse(name), {'cursor': self.cursor('garbage', 1, False)})
+                self.assertEqual(response.status_code, 200)
+
+    def test_pages_walk_forward_and_back(self):
+        for n in range(5):
+            Document.objects.create(name=f'doc{n}', file=f'doc{n}.txt', size=n, uploaded_by=self.user)
+        documents = Document.objects.filter(uploaded_by=self.user)
+        first = pagination.paginate(documents, 'size', cursor=None, size=2)
+        self.assertEqual([d.size for d in first], [4, 3])
+        second = pagination.paginate(documents, 'size', cursor=first.next_cursor, size=2)
+        self.assertEqual([d.size for d in second], [2, 1])
+        last = pagination.paginate(documents, 'size', cursor=second.next_cursor, size=2)
+        self.assertEqual([d.size for d in last], [0])
+        self.assertFalse(last.has_next)
+        back = pagination.paginate(documents, 'size', cursor=second.previous_cursor, size=2)
+        self.assertEqual([d.size for d in back], [4, 3])
+        self.assertFalse(back.has_previous)
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkDocumentTests(TestCase):
+    """Per-document results of the bulk operations."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bulk', password=PASSWORD)
+        cls.other = User.objects.create_user('other', password=PASSWORD)
+        cls.folder = Folder.objects.create(name='Mine', category=Category.objects.create(name='Cat', created_by=cls.user))
+        cls.foreign = Folder.objects.create(name='Theirs', category=Category.objects.create(name='Cat', created_by=cls.other))
+        cls.docs = [
+            Document.objects.create(name=f'doc{n}', file=f'doc{n}.txt', size=n, uploaded_by=cls.user) for n in range(3)
+        ]
+        cls.foreign_doc = Document.objects.create(name='theirs', file='theirs.txt', uploaded_by=cls.other)
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.client.login(username='bulk', password=PASSWORD)
+
+    def bulk(self, operation, ids, **data):
+        response = self.client.post(reverse('bulk_documents'), {'operation': operation, 'ids': ids, **data})
+        self.assertEqual(response.status_code, 200, response.content)
+        return {result['id']: result['status'] for result in response.json()['results']}
+
+    def test_move_only_into_own_folders(self):
+        ids = [doc.pk for doc in self.docs]
+        response = self.client.post(reverse('bulk_documents'),
+                                    {'operation': 'move', 'ids': ids, 'target_folder': self.foreign.pk})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Document.objects.filter(folder=self.foreign).exists())
+
+        results = self.bulk('move', ids + [self.foreign_doc.pk], target_folder=self.folder.pk)
+        self.assertEqual(results, {**{pk: 'ok' for pk in ids}, self.foreign_doc.pk: 'not_found'})
+        self.assertEqual(Document.objects.filter(folder=self.folder).count(), 3)
+        self.assertEqual(self.bulk('move', ids[:1], target_folder=self.folder.pk), {ids[0]: 'skipped'})
+
+    def test_operation_results(self):
+        ids = [doc.pk for doc in self.docs]
+        self.assertEqual(self.bulk('delete', ids[:2]), {ids[0]: 'ok', ids[1]: 'ok'})
+        self.assertEqual(self.bulk('delete', ids + [9999]),
+                         {ids[0]: 'skipped', ids[1]: 'skipped', ids[2]: 'ok', 9999: 'not_found'})
+        self.assertEqual(self.bulk('restore', ids[1:]), {ids[1]: 'ok', ids[2]: 'ok'})
+        self.assertEqual(self.bulk('share', ids), {ids[0]: 'ok', ids[1]: 'ok', ids[2]: 'ok'})
+        self.assertEqual(self.bulk('unshare', ids[:1]), {ids[0]: 'ok'})
+        self.assertEqual(list(Document.objects.filter(is_shared=True).order_by('pk').values_list('pk', flat=True)),
+                         ids[1:])
+        self.assertEqual(self.bulk('purge', ids), {ids[0]: 'ok', ids[1]: 'skipped', ids[2]: 'skipped'})
+        self.assertFalse(Document.objects.filter(pk=ids[0]).exists())
+        self.assertEqual(ActivityLog.objects.filter(user=self.user, action='delete').count(), 4)
+
+        response = self.client.post(reverse('bulk_documents'), {'operation': 'explode', 'ids': ids})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('bulk_documents'),
+                                    {'operation': 'delete', 'ids': ids, 'next': reverse('my_files')})
+        self.assertRedirects(response, reverse('my_files'), fetch_redirect_response=False)
+
+    def test_folder_pickers_list_own_folders(self):
+        for name in ['my_files', 'upload_document']:
+            with self.subTest(view=name):
+                response = self.client.get(reverse(name))
+                self.assertContains(response, f'<option value="{self.folder.pk}">')
+                self.assertNotContains(response, f'<option value="{self.foreign.pk}">')
+        response = self.client.post(reverse('upload_document'), {
+            'name': 'x', 'folder': self.foreign.pk, 'file': SimpleUploadedFile('x.txt', b'x'),
+        })
+        self.assertEqual(response.status_code, 404)
+
+
+class ExtractionTests(TempDirMixin, SimpleTestCase):
+    """Text extraction from zipped Office documents."""
+
+    def docx(self, body):
+        path = os.path.join(self.tmp, 'doc.docx')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('word/document.xml', body)
+            archive.writestr('word/styles.xml', '<w:styles>ignored</w:styles>')
+        return path
+
+    def test_text_of_document_parts(self):
+        path = self.docx('<w:document><w:t>Quarterly</w:t> <w:t>report &amp; plan</w:t></w:document>')
+        self.assertEqual(extraction.extract_text(path), 'Quarterly report & plan')
+
+    def test_zip_bomb_is_read_only_up_to_the_cap(self):
+        path = self.docx(b'<w:t>bomb</w:t>' + b' ' * (200 * 1024 * 1024))
+        self.assertLess(os.path.getsize(path), 1024 * 1024)
+        with override_settings(DMS_SEARCH_MAX_XML_BYTES=1024 * 1024):
+            tracemalloc.start()
+            text = extraction.extract_text(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.assertEqual(text, 'bomb')
+        self.assertLess(peak, 16 * 1024 * 1024)
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class VersionTests(TempMediaMixin, TestCase):
+    """Document versions: uploading, restoring and their stored form."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('versions', password=PASSWORD)
+        self.client.login(username='versions', password=PASSWORD)
+
+    def upload(self, name, content):
+        self.client.post(reverse('upload_document'), {'name': name, 'file': SimpleUploadedFile(name, content)})
+        return Document.objects.get(name=name)
+
+    def new_version(self, doc, content):
+        response = self.client.post(reverse('upload_new_version', args=[doc.id]),
+                                    {'version_file': SimpleUploadedFile(doc.name, content)})
+        self.assertEqual(response.status_code, 302)
+
+    def test_restore_only_own_versions(self):
+        doc = self.upload('plan.txt', b'version 1')
+        self.new_version(doc, b'version 2')
+        first = doc.versions.get(version_number=1)
+        User.objects.create_user('intruder', password=PASSWORD)
+        self.client.login(username='intruder', password=PASSWORD)
+        self.assertEqual(self.client.post(reverse('restore_version', args=[first.id])).status_code, 404)
+        self.assertEqual(doc.versions.count(), 2)
+
+        self.client.login(username='versions', password=PASSWORD)
+        self.assertEqual(self.client.post(reverse('restore_version', args=[first.id])).status_code, 302)
+        doc.refresh_from_db()
+        self.assertEqual(doc.version_count, 3)
+        with doc.file.open('rb') as f:
+            self.assertEqual(f.read(), b'version 1')
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ResumableUploadTests(TempMediaMixin, TestCase):
+    """Upload sessions: sending chunks in any order and finalizing them."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('resumer', password=PASSWORD)
+        self.client.login(username='resumer', password=PASSWORD)
+
+    def start(self, content, **data):
+        response = self.client.post(reverse('create_upload_session'),
+                                    {'filename': 'data.bin', 'size': len(content), **data})
+        self.assertEqual(response.status_code, 201, response.content)
+        session = response.json()
+        size = session['chunk_size']
+        for index in reversed(range(session['chunk_count'])):
+            chunk = content[index * size:(index + 1) * size]
+            response = self.client.put(reverse('upload_chunk', args=[session['id'], index]), chunk,
+                                       content_type='application/octet-stream',
+                                       HTTP_X_CHUNK_SHA256=hashlib.sha256(chunk).hexdigest())
+            self.assertEqual(response.status_code, 200, response.content)
+        return session
+
+    def complete(self, session, **data):
+        return self.client.post(reverse('complete_upload_session', args=[session['id']]), data)
+
+    def test_finalize_only_into_the_session_target(self):
+        content = os.urandom(3000)
+        with override_settings(DMS_UPLOAD_CHUNK_SIZE=1024):
+            session = self.start(content)
+        self.assertEqual((session['chunk_count'], session['document'], session['folder']), (3, None, None))
+        response = self.complete(self.start(b'version 2'), document='1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['missing'], [])
+
+        response = self.complete(session, document='', folder='')
+        self.assertEqual(response.status_code, 200, response.content)
+        doc = Document.objects.get(pk=response.json()['document'])
+        with doc.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(doc.filehash.hash_value, hashlib.sha256(content).hexdigest())
+
+        version = self.start(b'version 2', document=doc.pk)
+        self.assertEqual(self.complete(version, document='').status_code, 409)
+        self.assertEqual(self.complete(version, document=str(doc.pk)).status_code, 200)
+        doc.refresh_from_db()
+        self.assertEqual((doc.version_count, doc.size), (2, len(b'version 2')))
+
+    def test_chunks_cannot_land_in_a_finalized_file(self):
+        content = os.urandom(2048)
+        with override_settings(DMS_UPLOAD_CHUNK_SIZE=1024):
+            started = self.start(content)
+        # Loaded before the finalize, as by a chunk PUT that was already running.
+        stale = UploadSession.objects.get(pk=started['id'])
+        response = self.complete(started)
+        self.assertEqual(response.status_code, 200, response.content)
+        with self.assertRaises(uploads.UploadError):
+            uploads.write_chunk(stale, 0, io.BytesIO(b'x' * 1024))
+        doc = Document.objects.get(pk=response.json()['document'])
+        with doc.file.open('rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), doc.blob.sha256)
+
+    def test_failed_store_drops_the_session(self):
+        started = self.start(b'some content')
+        with mock.patch.object(uploads.blobstore, 'store_path', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                uploads.finalize(UploadSession.objects.get(pk=started['id']))
+        self.assertFalse(UploadSession.objects.filter(pk=started['id']).exists())
+        self.assertEqual(os.listdir(uploads.upload_dir()), [])
+
+    def test_failed_check_releases_the_claim(self):
+        started = self.start(b'some content')
+        UploadChunk.objects.filter(session=started['id']).delete()
+        self.assertEqual(self.complete(started).status_code, 409)
+        session = UploadSession.objects.get(pk=started['id'])
+        self.assertIsNone(session.finalizing_at)
+        uploads.write_chunk(session, 0, io.BytesIO(b'some content'))
+        self.assertEqual(self.complete(started).status_code, 200)
+
+    def test_finalize_waits_for_chunk_writes(self):
+        content = os.urandom(2048)
+        with override_settings(DMS_UPLOAD_CHUNK_SIZE=1024):
+            started = self.start(content)
+        session = UploadSession.objects.get(pk=started['id'])
+        reading, release = threading.Event(), threading.Event()
+
+        class SlowBody(io.BytesIO):
+            def read(self, size=-1):
+                reading.set()
+                release.wait()
+                return super().read(size)
+
+        # A chunk rewrite that is still receiving its body when finalize starts.
+        with ThreadPoolExecutor(1) as pool:
+            writing = pool.submit(uploads._receive_chunk, session, 0, SlowBody(b'x' * 1024), None)
+            reading.wait()
+            threading.Timer(0.2, release.set).start()
+            doc = uploads.finalize(session)
+            writing.result()
+        with doc.file.open('rb') as f:
+            data = f.read()
+        self.assertEqual(data, b'x' * 1024 + content[1024:])
+        self.assertEqual(hashlib.sha256(data).hexdigest(), doc.blob.sha256)
+
+
+class RangeTests(SimpleTestCase):
+    """Range headers and the partial responses built from them."""
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.content = bytes(range(256)) * 4
+        self.path = os.path.join(tmp, 'data.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+
+    def test_parse_range(self):
+        cases = {
+            'bytes=0-9': [(0, 9)],
+            'bytes=10-': [(10, 1023)],
+            'bytes=-100': [(924, 1023)],
+            'bytes=1000-2000': [(1000, 1023)],
+            'bytes=0-9,5-20,30-39': [(0, 20), (30, 39)],
+            'bytes=21-30,0-20': [(0, 30)],
+            'bytes=2000-': [],
+            'bytes=-0': [],
+            'bytes=9-0': None,
+            'bytes=a-b': None,
+            'items=0-9': None,
+            '': None,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(downloads.parse_range(header, 1024), expected)
+
+    def serve(self, **headers):
+        request = RequestFactory().get('/', **headers)
+        return downloads.serve_file(request, self.path, 'data.bin', 'data.bin', etag='"abc"')
+
+    def test_single_and_unsatisfiable_ranges(self):
+        response = self.serve(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=5000-').status_code, 416)
+        # A stale If-Range gets the whole file.
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_multipart_ranges(self):
+        response = self.serve(HTTP_RANGE='bytes=0-9,500-509')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        parts = body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[0], b'')
+        self.assertEqual(parts[-1], b'--\r\n')
+        bodies = []
+        for part in parts[1:-1]:
+            head, _, data = part.partition(b'\r\n\r\n')
+            bodies.append((head.split(b'Content-Range: ')[1], data[:-2]))
+        self.assertEqual(bodies, [
+            (b'bytes 0-9/1024', self.content[0:10]),
+            (b'bytes 500-509/1024', self.content[500:510]),
+        ])
+
+
+class ChunkManifestTests(TempDirMixin, SimpleTestCase):
+    """Chunk digests, their Merkle root and localized re-verification."""
+
+    def test_merkle_root(self):
+        a, b, c = (hashlib.sha256(x).digest() for x in (b'a', b'b', b'c'))
+        pair = lambda left, right: hashlib.sha256(b'\x01' + left + right).digest()
+        self.assertEqual(integrity.merkle_root(b''), hashlib.sha256(b'').hexdigest())
+        self.assertEqual(integrity.merkle_root(a), a.hex())
+        self.assertEqual(integrity.merkle_root(a + b), pair(a, b).hex())
+        self.assertEqual(integrity.merkle_root(a + b + c), pair(pair(a, b), c).hex())
+
+    def test_verify_chunks(self):
+        content = os.urandom(10 * 1000 + 500)
+        path = self.write('data', content)
+        hasher = integrity.ChunkHasher(1000)
+        for offset in range(0, len(content), 777):
+            hasher.update(content[offset:offset + 777])
+        digests = hasher.finish()
+        self.assertEqual(digests, integrity.build_manifest_digests(path, 1000))
+        self.assertEqual(len(digests), 11 * integrity.DIGEST_SIZE)
+        manifest = ChunkManifest(chunk_size=1000, file_size=len(content), digests=digests)
+        self.assertEqual(integrity.verify_chunks(path, manifest), [])
+
+        damaged = bytearray(content)
+        damaged[1500] ^= 1
+        damaged[2100] ^= 1
+        damaged[9999] ^= 1
+        self.write('data', bytes(damaged))
+        self.assertEqual(integrity.verify_chunks(path, manifest), [[1000, 3000], [9000, 10000]])
+        self.assertEqual(integrity.verify_chunks(path, manifest, indexes=[0, 9]), [[9000, 10000]])
+        self.write('data', content[:10200])
+        self.assertEqual(integrity.verify_chunks(path, manifest), [[10000, 10500]])
+
+
+class DeltaTests(TempDirMixin, SimpleTestCase):
+    """Version deltas against their base content."""
+
+    def test_delta_roundtrip(self):
+        base = os.urandom(64 * 1024)
+        target = base[:10000] + b'inserted text' + base[10000:40000] + base[50000:] + b'appended'
+        ops = delta.diff(base, target)
+        literal = sum(op[2] - op[1] for op in ops if op[0] == 'insert')
+        self.assertLess(literal, 4096)
+        base_path = self.write('base', base)
+        delta_path = os.path.join(self.tmp, 'delta')
+        with open(delta_path, 'wb') as f:
+            delta.write_delta(ops, len(base), target, f)
+        out = io.BytesIO()
+        self.assertEqual(delta.apply_delta(base_path, delta_path, out), len(target))
+        self.assertEqual(out.getvalue(), target)
+        # Unrelated content isn't worth a delta.
+        self.assertIsNone(delta.diff(base, os.urandom(64 * 1024), max_literal=32 * 1024))
+        with self.assertRaises(delta.DeltaError):
+            delta.apply_delta(base_path, self.write('bad', gzip.compress(b'not a delta')), io.BytesIO())
+
+    def test_compressed_base_is_decompressed_once(self):
+        base = os.urandom(32 * 1024) * 4
+        target = base[64 * 1024:] + base[:64 * 1024]
+        base_path = os.path.join(self.tmp, 'base')
+        compression.write([base], base_path, 'zlib', len(base), required_ratio=0)
+        delta_path = os.path.join(self.tmp, 'delta')
+        with open(delta_path, 'wb') as f:
+            delta.write_delta(delta.diff(base, target), len(base), target, f)
+        out = io.BytesIO()
+        # Seeking a CompressedFile would decompress from the start for every copy.
+        with mock.patch.object(compression.CompressedFile, 'seek', side_effect=AssertionError):
+            delta.apply_delta(base_path, delta_path, out)
+        self.assertEqual(out.getvalue(), target)
+
+
+class CompressionTests(TempDirMixin, SimpleTestCase):
+    """Compressed blob files and the plain files stored before them."""
+
+    def test_compression_roundtrip(self):
+        content = b''.join(b'line %d of a fairly repetitive text file\n' % i for i in range(20000))
+        for codec in ('zlib', 'lzma', 'store'):
+            with self.subTest(codec=codec):
+                path = os.path.join(self.tmp, codec)
+                stored = compression.write([content[:1000], content[1000:]], path, codec, len(content))
+                self.assertEqual(stored, os.path.getsize(path))
+                self.assertEqual(compression.describe(path), (codec, len(content)))
+                self.assertEqual(compression.content_size(path), len(content))
+                with compression.open_file(path) as f:
+                    self.assertEqual(f.read(), content)
+                    f.seek(len(content) - 41)
+                    self.assertEqual(f.read(), content[-41:])
+                if codec != 'store':
+                    self.assertLess(stored, len(content) // 4)
+        # Content that wouldn't shrink enough is not written at all.
+        path = os.path.join(self.tmp, 'random')
+        self.assertIsNone(compression.write([os.urandom(100000)], path, 'zlib', 100000, required_ratio=1.1))
+        self.assertFalse(os.path.exists(path))
+
+    def test_plain_files_read_as_is(self):
+        path = self.write('plain', b'plain bytes')
+        self.assertEqual(compression.describe(path), ('', 11))
+        with compression.open_file(path) as f:
+            self.assertEqual(f.read(), b'plain bytes')
+        # A raw file starting with the magic bytes has to be wrapped.
+        self.assertEqual(compression.choose_codec('x.bin', 100, compression.MAGIC + b'x'), 'store')
+
+    def test_compressed_files_verify_against_original_bytes(self):
+        content = b'compressible ' * 10000
+        path = self.write('data', content)
+        manifest = ChunkManifest(chunk_size=4096, file_size=len(content),
+                                 digests=integrity.build_manifest_digests(path, 4096))
+        compression.write([content], path, 'zlib', len(content), required_ratio=0)
+        self.assertLess(os.path.getsize(path), len(content))
+        self.assertEqual(integrity.build_manifest_digests(path, 4096), manifest.digests)
+        self.assertEqual(integrity.verify_chunks(path, manifest), [])
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ExportTests(TempMediaMixin, TestCase):
+    """ZIP exports of folders, categories and selections."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.user = User.objects.create_user('porter', password=PASSWORD)
+        self.client.login(username='porter', password=PASSWORD)
+
+    def upload(self, name, content, folder=None):
+        data = {'name': name, 'file': SimpleUploadedFile(name, content)}
+        if folder:
+            data['folder'] = folder.pk
+        self.client.post(reverse('upload_document'), data)
+        return Document.objects.get(name=name, uploaded_by=self.user)
+
+    def unzip(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_export_contents(self):
+        category = Category.objects.create(name='Finance', created_by=self.user)
+        invoices = Folder.objects.create(name='Invoices', category=category)
+        reports = Folder.objects.create(name='Q1/Q2', category=category)
+        notes = b'notes ' * 5000
+        self.upload('notes.txt', notes, invoices)
+        self.upload('scan.pdf', b'%PDF-1.4 scan', invoices)
+        self.upload('notes.txt ', b'other notes', reports)
+
+        archive = self.unzip(self.client.get(reverse('export_documents'), {'folder': invoices.pk}))
+        self.assertEqual(sorted(archive.namelist()), ['SHA256SUMS', 'manifest.json', 'notes.txt', 'scan.pdf'])
+        self.assertEqual(archive.read('notes.txt'), notes)
+        self.assertEqual(archive.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('scan.pdf').compress_type, zipfile.ZIP_STORED)
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual(manifest['missing'], [])
+        self.assertEqual({f['path']: f['hash'] for f in manifest['files']}, {
+            'notes.txt': hashlib.sha256(notes).hexdigest(),
+            'scan.pdf': hashlib.sha256(b'%PDF-1.4 scan').hexdigest(),
+        })
+        self.assertIn(f'{hashlib.sha256(notes).hexdigest()}  notes.txt\n', archive.read('SHA256SUMS').decode())
+
+        archive = self.unzip(self.client.get(reverse('export_documents'), {'category': category.pk}))
+        self.assertEqual(sorted(archive.namelist()), [
+            'Invoices/notes.txt', 'Invoices/scan.pdf', 'Q1_Q2/notes.txt', 'SHA256SUMS', 'manifest.json',
+        ])
+        self.assertEqual(archive.read('Q1_Q2/notes.txt'), b'other notes')
+
+    def test_export_selection_skips_other_users_documents(self):
+        mine = self.upload('mine.txt', b'mine')
+        other = User.objects.create_user('other', password=PASSWORD)
+        hidden = Document.objects.create(name='hidden.txt', file='hidden.txt', uploaded_by=other)
+        archive = self.unzip(self.client.post(reverse('export_documents'), {'ids': [mine.pk, hidden.pk]}))
+        self.assertEqual(sorted(archive.namelist()), ['SHA256SUMS', 'manifest.json', 'mine.txt'])
+        self.assertEqual(self.client.get(reverse('export_documents'), {'ids': hidden.pk}).status_code, 400)
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True)
+class ImportTreeTests(TempMediaMixin, TestCase):
+    """``manage.py import_tree``."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.user = User.objects.create_user('porter', password=PASSWORD)
+
+    def test_import_tree(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        files = {
+            'Finance/Invoices/jan.txt': b'january',
+            'Finance/Invoices/2024/feb.txt': b'february',
+            'Finance/summary.txt': b'summary',
+            'Finance/copy.txt': b'january',
+            'Finance/.hidden': b'hidden',
+            'readme.txt': b'readme',
+        }
+        for name, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(content)
+
+        out = io.StringIO()
+        call_command('import_tree', root, user='porter', workers=1, stdout=out, stderr=io.StringIO())
+        self.assertIn('Imported 4 files', out.getvalue())
+        self.assertIn('1 whose content the user already has', out.getvalue())
+        documents = {
+            (doc.folder.category.name if doc.folder else None, doc.folder.name if doc.folder else None, doc.name): doc
+            for doc in Document.objects.filter(uploaded_by=self.user).select_related('folder__category')
+        }
+        self.assertEqual(sorted(documents, key=str), sorted([
+            # Walked before Invoices/jan.txt, so the one of the two imported.
+            ('Finance', 'Finance', 'copy.txt'),
+            ('Finance', 'Invoices / 2024', 'feb.txt'),
+            ('Finance', 'Finance', 'summary.txt'),
+            (None, None, 'readme.txt'),
+        ], key=str))
+        doc = documents[('Finance', 'Invoices / 2024', 'feb.txt')]
+        with doc.file.open('rb') as f:
+            self.assertEqual(f.read(), b'february')
+        self.assertEqual(doc.filehash.hash_value, hashlib.sha256(b'february').hexdigest())
+        self.assertEqual((doc.version_count, doc.current_version.version_number, doc.blob.ref_count), (1, 1, 2))
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.file_count, profile.storage_bytes), (4, sum(map(len, [
+            b'january', b'february', b'summary', b'readme',
+        ]))))
+
+        out = io.StringIO()
+        call_command('import_tree', root, user='porter', workers=1, stdout=out, stderr=io.StringIO())
+        self.assertIn('Imported 0 files', out.getvalue())
+        self.assertIn('skipped 4 already imported, 1 whose content', out.getvalue())
+        self.assertEqual(Document.objects.filter(uploaded_by=self.user).count(), 4)
+        self.assertEqual(analytics.usage_totals(self.user), {'upload': 4})
+
+
+@override_settings(DMS_METRICS_TOKEN='scrape-token')
+class MetricsTests(TestCase):
+    """Request metrics and their Prometheus exposition."""
+
+    def requests_counted(self, method):
+        return sum(count for (view, m, status), count in metrics.requests_total.values().items() if m == method)
+
+    def test_requests_are_counted_by_method(self):
+        before = self.requests_counted('GET'), self.requests_counted('other')
+        self.client.get(reverse('login'))
+        self.client.generic('BREW', reverse('login'))
+        self.client.generic('X-' + 'A' * 50, reverse('login'))
+        self.assertEqual((self.requests_counted('GET'), self.requests_counted('other')), (before[0] + 1, before[1] + 2))
+        self.assertFalse(any(m.startswith('X-') or m == 'BREW' for _, m, _ in metrics.requests_total.values()))
+
+    def test_exposition(self):
+        with metrics.timer('test_operation', size=100):
+            pass
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('dms_operation_bytes_total{operation="test_operation"} ', body)
+        self.assertIn('dms_operation_duration_seconds_bucket{operation="test_operation",le="+Inf"} ', body)
+        self.assertRegex(body, r'dms_http_requests_total\{view="[^"]+",method="GET",status="404"\} \d+')
+
+
+class ListCacheTests(TestCase):
+    """Cached folder trees and pickers are dropped when what they show changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('lister', password=PASSWORD)
+        cls.folders = [
+            Folder.objects.create(name='Folder', category=Category.objects.create(name=f'Cat{n}', created_by=cls.user))
+            for n in range(2)
+        ]
+
+    def setUp(self):
+        listcache.get_cache().clear()
+
+    def tree_bytes(self):
+        return [category.storage_bytes for category in listcache.folder_tree(self.user)]
+
+    def test_folder_counters_invalidate_the_tree(self):
+        self.assertEqual(self.tree_bytes(), [0, 0])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.tree_bytes(), [0, 0])
+        for rows, expected in [
+            ([(self.folders[0].pk, 100, 1)], [100, 0]),
+            ([(self.folders[0].pk, 10, 1), (self.folders[1].pk, 5, 1)], [110, 5]),
+        ]:
+            with self.captureOnCommitCallbacks(execute=True):
+                accounting.adjust_folders(rows)
+            self.assertEqual(self.tree_bytes(), expected)
+
+    def test_disabled_cache_skips_owner_lookups(self):
+        with self.settings(DMS_LIST_CACHE_ENABLED=False):
+            # The folder and its category, but not the category's owner.
+            with self.assertNumQueries(2):
+                accounting.adjust_folders([(self.folders[0].pk, 100, 1)])
+            with self.assertNumQueries(2):
+                listcache.folder_tree(self.user)
+
+    def test_folder_pickers(self):
+        self.assertEqual([folder.category.name for folder in listcache.folder_choices(self.user)], ['Cat0', 'Cat1'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Folder.objects.create(name='New', category=self.folders[0].category)
+        self.assertEqual(len(listcache.folder_choices(self.user)), 3)
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UsageRollupTests(TempMediaMixin, TestCase):
+    """The analytics page reads its counts from the usage rollups."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        eventlog.recent_views.clear()
+        self.user = User.objects.create_user('analyst', password=PASSWORD)
+        self.viewer = User.objects.create_user('viewer', password=PASSWORD)
+        self.client.login(username='analyst', password=PASSWORD)
+
+    def upload(self, name):
+        content = SimpleUploadedFile(name, name.encode())
+        self.client.post(reverse('upload_document'), {'name': name, 'file': content})
+        return Document.objects.get(name=name)
+
+    def test_counts(self):
+        first, second = self.upload('first.txt'), self.upload('second.txt')
+        for user, action in [(self.user, 'view'), (self.viewer, 'view'), (self.viewer, 'view'), (self.viewer, 'download')]:
+            eventlog.log_view(first, user, action)
+        eventlog.log_view(second, self.viewer)
+
+        response = self.client.get(reverse('analytics'))
+        self.assertEqual(
+            (response.context['total_uploads'], response.context['total_views'], response.context['total_downloads']),
+            (2, 3, 1),
+        )
+        self.assertEqual([row['document__name'] for row in response.context['top_docs']], ['first.txt', 'second.txt'])
+        self.assertEqual(response.context['series'][-1][1], {'upload': 2, 'view': 3, 'download': 1})
+
+        totals = analytics.usage_totals(self.user)
+        call_command('rebuild_usage_rollups', stdout=io.StringIO())
+        self.assertEqual(analytics.usage_totals(self.user), totals)
+        self.assertEqual(analytics.usage_totals(self.viewer), {})
+
+
+class FileCacheTests(TempDirMixin, SimpleTestCase):
+    """The size-bounded LRU of generated files."""
+
+    def setUp(self):
+        super().setUp()
+        override = override_settings(DMS_CACHE_DIR=self.tmp, DMS_TEST_CACHE_SIZE=1000)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.cache = filecache.FileCache('test', 'DMS_TEST_CACHE_SIZE', 0)
+
+    def put(self, key, size, age):
+        path = self.cache.put(key, lambda f: f.write(b'x' * size))
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.put('aa1', 400, age=30)
+        self.put('aa2', 400, age=20)
+        self.assertIsNotNone(self.cache.get('aa1'))
+        self.put('aa3', 400, age=10)
+        self.assertIsNotNone(self.cache.get('aa1'))
+        self.assertIsNone(self.cache.get('aa2'))
+        self.assertIsNotNone(self.cache.get('aa3'))
+        # An entry larger than the whole cache is still kept until the next put.
+        self.put('aa4', 2000, age=0)
+        self.assertEqual([key for key in ('aa1', 'aa3', 'aa4') if self.cache.get(key)], ['aa4'])
+
+    def test_puts_walk_only_when_over_the_limit(self):
+        with mock.patch('fileMonitoring.filecache.os.walk', wraps=os.walk) as walk:
+            self.put('bb1', 300, age=30)
+            self.assertEqual(walk.call_count, 1)
+            self.put('bb2', 300, age=20)
+            self.put('bb2', 300, age=20)
+            self.put('bb3', 300, age=10)
+            self.assertEqual(walk.call_count, 1)
+            self.put('bb4', 300, age=0)
+            self.assertEqual(walk.call_count, 2)
+        self.assertIsNone(self.cache.get('bb1'))
+        self.assertEqual(sum(os.path.getsize(self.cache.path_for(key)) for key in ('bb2', 'bb3', 'bb4')), 900)
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PreviewTests(TempMediaMixin, TestCase):
+    """Renditions are rendered once per content and served from the cache."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        previews.cache.clear()
+        self.user = User.objects.create_user('viewer', password=PASSWORD)
+        self.client.login(username='viewer', password=PASSWORD)
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('upload_document'), {'name': name, 'file': SimpleUploadedFile(name, content)})
+        return Document.objects.get(name=name)
+
+    def test_text_rendition(self):
+        with mock.patch.dict(previews.RENDERERS, text=mock.Mock(wraps=previews.RENDERERS['text'])) as renderers:
+            first = self.upload('notes.txt', b'first line <&>\nsecond line')
+            # Upload queues the thumbnail.
+            self.assertIsNotNone(previews.cache.get(previews.cache_key(first, 'thumb')))
+            response = self.client.get(reverse('document_rendition', args=[first.pk, 'page']))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/svg+xml')
+            svg = b''.join(response.streaming_content)
+            self.assertIn(b'first line &lt;&amp;&gt;', svg)
+            # The same content under another name reuses the render.
+            copy = self.upload('copy.txt', b'first line <&>\nsecond line')
+            response = self.client.get(reverse('document_rendition', args=[copy.pk, 'page']))
+            self.assertEqual(b''.join(response.streaming_content), svg)
+            self.assertEqual(renderers['text'].call_count, 2)
+
+    def test_unrenderable_types_get_an_icon(self):
+        doc = self.upload('archive.bin', b'\0' * 100)
+        response = self.client.get(reverse('document_rendition', args=[doc.pk, 'thumb']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('private', response['Cache-Control'])
+
+
+class SearchTests(TestCase):
+    """Ranked full-text search over the user's own documents."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('searcher', password=PASSWORD)
+        cls.other = User.objects.create_user('other', password=PASSWORD)
+        folder = Folder.objects.create(name='Reports', category=Category.objects.create(name='Finance', created_by=cls.user))
+        cls.docs = {
+            name: Document.objects.create(name=name, file=f'{name}.txt', uploaded_by=cls.user, folder=doc_folder)
+            for name, doc_folder in [
+                ('quarterly summary', None), ('budget', folder), ('notes', None), ('trashed summary', None),
+            ]
+        }
+        Document.objects.filter(pk=cls.docs['trashed summary'].pk).update(is_deleted=True)
+        SearchEntry.objects.filter(document=cls.docs['notes']).update(content='the summary of the quarter')
+        Document.objects.create(name='summary of theirs', file='theirs.txt', uploaded_by=cls.other)
+
+    def search(self, text, user=None):
+        names = {doc.pk: name for name, doc in self.docs.items()}
+        return [names.get(pk, pk) for pk in search.search_ids(user or self.user, text, 0, 10)]
+
+    def test_ranking_and_ownership(self):
+        # A match in the name ranks above one in the contents.
+        self.assertEqual(self.search('summ'), ['quarterly summary', 'notes'])
+        self.assertEqual(self.search('finance reports'), ['budget'])
+        self.assertEqual(self.search('summary quarter'), ['quarterly summary', 'notes'])
+        self.assertEqual(self.search('nothing like it'), [])
+        self.assertEqual(self.search('" * ( :'), [])
+
+    def test_owner_column_is_not_searched(self):
+        self.assertEqual(self.search(str(self.user.pk)), [])
+        self.assertEqual(len(search.search_ids(self.other, 'summary', 0, 10)), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM "{search.FTS_TABLE}" WHERE "{search.FTS_TABLE}" MATCH %s',
+                           [f'{{owner_id}} : "{self.other.pk}"'])
+            self.assertEqual(cursor.fetchone(), (1,))
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TrashAndReconcileTests(TempMediaMixin, TestCase):
+    """Trash retention and ``manage.py reconcile_media`` release blobs and storage."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.user = User.objects.create_user('keeper', password=PASSWORD)
+        self.client.login(username='keeper', password=PASSWORD)
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('upload_document'), {'name': name, 'file': SimpleUploadedFile(name, content)})
+        return Document.objects.get(name=name, uploaded_by=self.user)
+
+    def storage(self):
+        profile = UserProfile.objects.get(user=self.user)
+        return profile.file_count, profile.storage_bytes
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('reconcile_media', '--min-age', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_purge_expired_trash(self):
+        docs = [self.upload(f'old{n}.txt', b'same content') for n in range(3)] + [self.upload('recent.txt', b'recent')]
+        for doc, days in zip(docs, (40, 35, 31, 1)):
+            self.client.post(reverse('delete_file', args=[doc.pk]))
+            Document.objects.filter(pk=doc.pk).update(deleted_at=timezone.now() - timedelta(days=days))
+        blob = docs[0].blob
+        with self.settings(DMS_TRASH_RETENTION_DAYS=30), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(retention.purge_expired(batch_size=2), 3)
+        self.assertEqual(list(Document.objects.filter(uploaded_by=self.user)), [docs[3]])
+        self.assertEqual(self.storage(), (1, len(b'recent')))
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(os.path.exists(blob.file.path))
+        with self.settings(DMS_TRASH_RETENTION_DAYS=None):
+            self.assertEqual(retention.purge_expired(), 0)
+
+    def test_dangling_documents_are_deleted_with_their_storage(self):
+        keep, same = self.upload('keep.txt', b'shared'), self.upload('same.txt', b'shared')
+        lost = self.upload('lost.txt', b'lost content')
+        os.remove(lost.blob.file.path)
+
+        out = self.reconcile()
+        self.assertIn(f'missing file: Blob {lost.blob_id} -> {lost.blob.file.name}', out)
+        self.assertIn('1 rows point at missing files', out)
+        self.assertTrue(Document.objects.filter(pk=lost.pk).exists())
+
+        out = self.reconcile('--delete-dangling')
+        self.assertIn(f'deleted 1 documents with missing files: {lost.pk}', out)
+        self.assertEqual(set(Document.objects.filter(uploaded_by=self.user)), {keep, same})
+        self.assertFalse(Blob.objects.filter(pk=lost.blob_id).exists())
+        self.assertEqual(Blob.objects.get(pk=keep.blob_id).ref_count, 4)
+        self.assertEqual(self.storage(), (2, 2 * len(b'shared')))
+        self.assertIn('0 rows point at missing files', self.reconcile())
+
+    def test_orphan_files(self):
+        doc = self.upload('kept.txt', b'kept')
+        orphan = os.path.join(self.media_root, 'blobs', 'zz', 'orphan.bin')
+        os.makedirs(os.path.dirname(orphan), exist_ok=True)
+        with open(orphan, 'wb') as f:
+            f.write(b'orphan')
+        self.assertIn('orphan file: blobs/zz/orphan.bin', self.reconcile())
+        self.assertTrue(os.path.exists(orphan))
+        self.assertIn('removed file: blobs/zz/orphan.bin', self.reconcile('--delete'))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(doc.blob.file.path))
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BlobStoreTests(TempMediaMixin, TestCase):
+    """Identical content is stored once and counted by the rows pointing at it."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.user = User.objects.create_user('owner', password=PASSWORD)
+        self.other = User.objects.create_user('other', password=PASSWORD)
+        self.client.login(username='owner', password=PASSWORD)
+
+    def upload(self, name, content, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            (client or self.client).post(reverse('upload_document'), {
+                'name': name, 'file': SimpleUploadedFile(name, content),
+            })
+        return Document.objects.get(name=name)
+
+    def test_identical_content_is_stored_once(self):
+        content = b'%PDF-1.4 the same report'
+        first = self.upload('report.pdf', content)
+        other_client = Client()
+        other_client.login(username='other', password=PASSWORD)
+        second = self.upload('copy.pdf', content, other_client)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('upload_new_version', args=[first.pk]), {
+                'version_file': SimpleUploadedFile('report.pdf', content),
+            })
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(content).hexdigest())
+        self.assertIn(blob.sha256, blob.file.name)
+        with blob.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        # Each document and each of its versions holds a reference.
+        self.assertEqual(DocumentVersion.objects.filter(blob=blob).count(), 3)
+        self.assertEqual(blob.ref_count, 5)
+        self.assertEqual({first.file.name, second.file.name}, {blob.file.name})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_file', args=[first.pk]))
+            self.client.post(reverse('permanent_delete_file', args=[first.pk]))
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertTrue(os.path.exists(blob.file.path))
+        with self.captureOnCommitCallbacks(execute=True):
+            blobstore.delete_document(second)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(blob.file.path))
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class VerifyIntegrityTests(TempMediaMixin, TestCase):
+    """``manage.py verify_integrity`` re-hashes changed files and logs the results."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.user = User.objects.create_user('auditor', password=PASSWORD)
+        self.client.login(username='auditor', password=PASSWORD)
+
+    def upload(self, name, content):
+        self.client.post(reverse('upload_document'), {'name': name, 'file': SimpleUploadedFile(name, content)})
+        return Document.objects.get(name=name)
+
+    def verify(self, *args):
+        out = io.StringIO()
+        call_command('verify_integrity', '--workers', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_scan(self):
+        intact = self.upload('intact.bin', os.urandom(5000))
+        damaged = self.upload('damaged.bin', os.urandom(5000))
+        # Hashed on upload, and size and mtime are unchanged since: not read again unless --full.
+        self.assertIn('Checked 0 files (0 intact, 0 tampered, 0 missing), skipped 2', self.verify())
+        self.assertIn('Checked 2 files (2 intact, 0 tampered, 0 missing), skipped 0', self.verify('--full'))
+        self.assertIn('Checked 1 files (1 intact', self.verify('--full', '--document', str(intact.pk)))
+
+        path = damaged.blob.file.path
+        with open(path, 'r+b') as f:
+            f.seek(100)
+            f.write(b'X' * 10)
+        os.utime(path, (time.time() + 5, time.time() + 5))
+        out = self.verify()
+        self.assertIn('Checked 1 files (0 intact, 1 tampered, 0 missing), skipped 1', out)
+        self.assertIn('1 file(s) failed verification', out)
+        self.assertEqual(
+            list(IntegrityCheckLog.objects.filter(document=damaged).values_list('result', flat=True).order_by('pk')),
+            ['intact', 'tampered'],
+        )
+        os.remove(path)
+        self.assertIn('Checked 1 files (0 intact, 1 tampered, 1 missing)', self.verify('--user', 'auditor'))
+
+
+class HashingTests(TempDirMixin, SimpleTestCase):
+    """Every read strategy gives the same digest for every algorithm."""
+
+    def test_strategies_agree(self):
+        contents = [b'', b'x', os.urandom(3 * 1024 * 1024 + 17)]
+        expected = {
+            'sha256': hashlib.sha256,
+            'blake2b': lambda data: hashlib.blake2b(data, digest_size=32),
+        }
+        for n, content in enumerate(contents):
+            path = self.write(f'file{n}', content)
+            for algorithm, reference in expected.items():
+                for strategy in hashing.STRATEGIES:
+                    with self.subTest(size=len(content), algorithm=algorithm, strategy=strategy):
+                        self.assertEqual(hashing.hash_file(path, algorithm, strategy), reference(content).hexdigest())
+        with self.assertRaises(ValueError):
+            hashing.hash_file(path, 'md5')
+        with self.assertRaises(ValueError):
+            hashing.hash_file(path, 'sha256', 'unknown')
+
+    def test_compressed_files_hash_as_their_original_bytes(self):
+        content = b'compressible ' * 50000
+        path = os.path.join(self.tmp, 'compressed')
+        compression.write([content], path, 'lzma', len(content))
+        for strategy in hashing.STRATEGIES:
+            self.assertEqual(hashing.hash_file(path, 'blake2b', strategy),
+                             hashlib.blake2b(content, digest_size=32).hexdigest())
+
+    def test_uploaded_digest_reuses_the_handlers_digests(self):
+        uploaded = SimpleUploadedFile('a.txt', b'content')
+        self.assertEqual(hashing.uploaded_digest(uploaded, 'sha256'), ('sha256', hashlib.sha256(b'content').hexdigest()))
+        uploaded.digests = {'blake2b': 'precomputed'}
+        self.assertEqual(hashing.uploaded_digest(uploaded, 'blake2b'), ('blake2b', 'precomputed'))
+
+
+@override_settings(DMS_LOG_SYNC=False, DMS_LOG_BATCH_SIZE=10000, DMS_LOG_FLUSH_INTERVAL=3600)
+class EventLogTests(TestCase):
+    """Buffered activity and usage events, and the view dedup window."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('logger', password=PASSWORD)
+        cls.doc = Document.objects.create(name='logged', file='logged.txt', uploaded_by=cls.user)
+
+    def setUp(self):
+        eventlog.flush()
+        eventlog.recent_views.clear()
+
+    def test_events_are_written_in_one_batch_on_flush(self):
+        gone = Document.objects.create(name='gone', file='gone.txt', uploaded_by=self.user)
+        eventlog.log_activity(self.user, 'upload', self.doc)
+        eventlog.log_activities(self.user, 'delete', [gone.pk])
+        eventlog.log_usage(self.doc, self.user, 'view')
+        eventlog.log_usage(gone, self.user, 'view')
+        queued_at = timezone.now()
+        gone.delete()
+        self.assertFalse(ActivityLog.objects.exists())
+
+        eventlog.flush()
+        # Events keep the time they happened, and ones whose document went
+        # meanwhile keep no reference to it (activity) or are dropped (usage).
+        self.assertEqual(
+            sorted(ActivityLog.objects.values_list('action', 'document_id')), [('delete', None), ('upload', self.doc.pk)],
+        )
+        self.assertTrue(all(log.timestamp <= queued_at for log in ActivityLog.objects.all()))
+        self.assertEqual(list(UsageStat.objects.values_list('document_id', flat=True)), [self.doc.pk])
+        self.assertEqual(analytics.usage_totals(self.user), {'upload': 1, 'view': 1})
+
+    def test_repeat_views_within_the_window_are_dropped(self):
+        for action in ('view', 'view', 'download', 'view'):
+            eventlog.log_view(self.doc, self.user, action)
+        with self.settings(DMS_VIEW_DEDUP_WINDOW=0):
+            eventlog.log_view(self.doc, self.user)
+        eventlog.flush()
+        self.assertEqual(sorted(UsageStat.objects.values_list('action', flat=True)), ['download', 'view', 'view'])
+
+        recent = eventlog.RecentViews(max_size=2)
+        self.assertTrue(all(recent.should_log(key, 600) for key in ('a', 'b', 'c')))
+        # 'a' was evicted as least recently used; 'c' is still remembered.
+        self.assertEqual((recent.should_log('a', 600), recent.should_log('c', 600)), (True, False))
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AccountingTests(TempMediaMixin, TestCase):
+    """Storage counters follow every document change; quotas are enforced against them."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.user = User.objects.create_user('counter', password=PASSWORD)
+        self.client.login(username='counter', password=PASSWORD)
+        self.category = Category.objects.create(name='Work', created_by=self.user)
+        self.first, self.second = (Folder.objects.create(name=name, category=self.category) for name in 'ab')
+
+    def upload(self, name, content, folder=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('upload_document'), {
+                'name': name, 'file': SimpleUploadedFile(name, content), 'folder': folder.pk if folder else '',
+            })
+        return Document.objects.filter(name=name, uploaded_by=self.user).first()
+
+    def counters(self):
+        profile = UserProfile.objects.get(user=self.user)
+        return [(row.file_count, row.storage_bytes) for row in (
+            profile, Folder.objects.get(pk=self.first.pk), Folder.objects.get(pk=self.second.pk),
+            Category.objects.get(pk=self.category.pk),
+        )]
+
+    def test_counters_follow_documents(self):
+        report = self.upload('report.txt', b'r' * 10, self.first)
+        notes = self.upload('notes.txt', b'n' * 5, self.first)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('upload_new_version', args=[report.pk]),
+                             {'version_file': SimpleUploadedFile('report.txt', b'R' * 20)})
+        self.assertEqual(self.counters(), [(2, 35), (2, 35), (0, 0), (2, 35)])
+
+        self.client.post(reverse('bulk_documents'), {
+            'operation': 'move', 'ids': [report.pk], 'target_folder': self.second.pk,
+        })
+        self.assertEqual(self.counters(), [(2, 35), (1, 5), (1, 30), (2, 35)])
+
+        # The trash still counts against the owner, not the folder.
+        self.client.post(reverse('delete_file', args=[notes.pk]))
+        self.assertEqual(self.counters(), [(2, 35), (0, 0), (1, 30), (1, 30)])
+        self.client.post(reverse('restore_file', args=[notes.pk]))
+        self.assertEqual(self.counters(), [(2, 35), (1, 5), (1, 30), (2, 35)])
+
+        self.client.post(reverse('delete_file', args=[report.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('permanent_delete_file', args=[report.pk]))
+        self.assertEqual(self.counters(), [(1, 5), (1, 5), (0, 0), (1, 5)])
+
+    def test_reconcile_storage_fixes_drift(self):
+        self.upload('report.txt', b'r' * 10, self.first)
+        expected = self.counters()
+        UserProfile.objects.filter(user=self.user).update(storage_bytes=1, file_count=7)
+        Folder.objects.update(storage_bytes=3)
+        Category.objects.update(file_count=0)
+
+        out = io.StringIO()
+        call_command('reconcile_storage', stdout=out)
+        self.assertIn('Corrected 0 documents, 1 users, 2 folders, 1 categories.', out.getvalue())
+        self.assertEqual(self.counters(), expected)
+        self.assertEqual(accounting.reconcile(), {'documents': 0, 'users': 0, 'folders': 0, 'categories': 0})
+
+    def test_quota(self):
+        UserProfile.objects.create(user=self.user, role='standard', quota_bytes=2000)
+        self.upload('fits.txt', b'f' * 1500)
+        # Rejected by the upload handler from the request's length.
+        self.assertIsNone(self.upload('over.txt', b'o' * 1000))
+        self.assertEqual(self.counters()[0], (1, 1500))
+
+        # Rejected exactly when the rows are written, releasing the blob.
+        upload = SimpleUploadedFile('late.txt', b'l' * 501)
+        blob = blobstore.store_file(upload, refs=2)
+        with self.assertRaises(accounting.QuotaExceeded):
+            uploads.create_document(self.user, 'late.txt', None, blob, ('sha256', blob.sha256))
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertEqual(self.counters()[0], (1, 1500))
+
+        with self.settings(DMS_USER_QUOTA=100):
+            UserProfile.objects.filter(user=self.user).update(quota_bytes=None)
+            self.assertEqual(accounting.usage(self.user), (1500, 1, 100))
+            with self.assertRaises(accounting.QuotaExceeded):
+                accounting.check_quota(self.user, 1)
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AsyncViewTests(TempMediaMixin, TestCase):
+    """The async download, chunk upload and integrity check views, served as under ASGI."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        eventlog.recent_views.clear()
+        self.user = User.objects.create_user('streamer', password=PASSWORD)
+        self.client.login(username='streamer', password=PASSWORD)
+        self.content = os.urandom(5000)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('upload_document'), {
+                'name': 'data.bin', 'file': SimpleUploadedFile('data.bin', self.content),
+            })
+        self.doc = Document.objects.get(uploaded_by=self.user)
+
+    async def read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_download(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('download_document', args=[self.doc.pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.read(response), self.content)
+        response = await self.async_client.get(url, headers={'range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await self.read(response), self.content[100:200])
+
+        reader = await User.objects.acreate_user('reader', password=PASSWORD)
+        await self.async_client.aforce_login(reader)
+        self.assertEqual((await self.async_client.get(url)).status_code, 404)
+        await Document.objects.filter(pk=self.doc.pk).aupdate(is_shared=True)
+        for _ in range(3):
+            response = await self.async_client.get(url, headers={'range': 'bytes=0-99'})
+            self.assertEqual(await self.read(response), self.content[:100])
+        # One download, however many ranges it was fetched in.
+        self.assertEqual(await UsageStat.objects.filter(accessed_by=reader, action='download').acount(), 1)
+
+    async def test_chunk_upload(self):
+        await self.async_client.aforce_login(self.user)
+        with self.settings(DMS_UPLOAD_CHUNK_SIZE=1024):
+            response = await self.async_client.post(reverse('create_upload_session'), {
+                'filename': 'big.bin', 'size': len(self.content),
+            })
+        session = response.json()
+        chunks = [self.content[i:i + 1024] for i in range(0, len(self.content), 1024)]
+        for index, chunk in enumerate(chunks):
+            response = await self.async_client.put(
+                reverse('upload_chunk', args=[session['id'], index]), chunk,
+                content_type='application/octet-stream',
+                headers={'x-chunk-sha256': hashlib.sha256(chunk).hexdigest()},
+            )
+            self.assertEqual(response.json(), {'index': index})
+        response = await self.async_client.put(
+            reverse('upload_chunk', args=[session['id'], 0]), chunks[0],
+            content_type='application/octet-stream', headers={'x-chunk-sha256': '0' * 64},
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.post(reverse('complete_upload_session', args=[session['id']]))
+        doc = await Document.objects.select_related('blob').aget(pk=response.json()['document'])
+        self.assertEqual(doc.blob.sha256, hashlib.sha256(self.content).hexdigest())
+
+    async def test_check_integrity(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('check_file_integrity', args=[self.doc.pk])
+        self.assertRedirects(await self.async_client.get(url), reverse('my_files'), fetch_redirect_response=False)
+        with open(self.doc.file.path, 'r+b') as f:
+            f.seek(3000)
+            f.write(b'tampered')
+        await self.async_client.get(url)
+        results = [log async for log in IntegrityCheckLog.objects.filter(document=self.doc).order_by('pk')]
+        self.assertEqual([log.result for log in results], ['intact', 'tampered'])
+
+
+@override_settings(DMS_LOG_SYNC=True, DMS_BACKGROUND_SYNC=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ShardingTests(TempMediaMixin, TestCase):
+    """Stored files are fanned out by DMS_MEDIA_FANOUT; ``manage.py shard_media`` moves older ones."""
+
+    def setUp(self):
+        listcache.get_cache().clear()
+        self.user = User.objects.create_user('sharder', password=PASSWORD)
+        self.client.login(username='sharder', password=PASSWORD)
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('upload_document'), {'name': name, 'file': SimpleUploadedFile(name, content)})
+        return Document.objects.select_related('blob').get(name=name, uploaded_by=self.user)
+
+    def shard(self, *args):
+        out = io.StringIO()
+        call_command('shard_media', '--sleep', '0', '--grace', '0', *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_uploads_are_sharded(self):
+        doc = self.upload('a.txt', b'sharded')
+        sha = doc.blob.sha256
+        self.assertEqual(doc.blob.file.name, f'blobs/{sha[:2]}/{sha[2:4]}/{sha}.txt')
+        self.assertEqual((doc.file.name, doc.current_version.version_file.name), (doc.blob.file.name,) * 2)
+        with self.settings(DMS_MEDIA_FANOUT=(3,)):
+            self.assertEqual(self.upload('b.txt', b'wider').blob.file.name.count('/'), 2)
+
+    def test_shard_media_moves_flat_files(self):
+        with self.settings(DMS_MEDIA_FANOUT=()):
+            flat = self.upload('flat.txt', b'flat content')
+        self.assertEqual(flat.blob.file.name, f'blobs/{flat.blob.sha256}.txt')
+        old_path = flat.blob.file.path
+        # A document from before the blob store, and one whose file is gone.
+        for name, content in (('legacy.txt', b'legacy'), ('lost.txt', None)):
+            if content is not None:
+                with open(os.path.join(self.media_root, name), 'wb') as f:
+                    f.write(content)
+            Document.objects.create(name=name, file=name, uploaded_by=self.user)
+
+        self.assertIn('3 files are outside the xx/xx layout.', self.shard('--dry-run'))
+        out = self.shard('--batch-size', '2')
+        self.assertIn('missing file: lost.txt', out)
+        self.assertIn('Moved 2 files into the xx/xx layout; 1 rows point at missing files.', out)
+
+        flat = Document.objects.select_related('blob').get(pk=flat.pk)
+        sha = flat.blob.sha256
+        self.assertEqual(flat.blob.file.name, f'blobs/{sha[:2]}/{sha[2:4]}/{sha}.txt')
+        self.assertEqual((flat.file.name, flat.current_version.version_file.name), (flat.blob.file.name,) * 2)
+        self.assertFalse(os.path.exists(old_path))
+        legacy = Document.objects.get(name='legacy.txt')
+        self.assertEqual(legacy.file.name, sharded_name('documents', 'legacy.txt'))
+        for doc, content in ((flat, b'flat content'), (legacy, b'legacy')):
+            with doc.file.open('rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertIn('1 files are outside', self.shard('--dry-run'))
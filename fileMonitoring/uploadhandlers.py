@@ -0,0 +1,102 @@
+"""
+Upload handlers that hash files while Django streams them in.
+
+They replace Django's default memory/temporary-file handlers (see
+``FILE_UPLOAD_HANDLERS`` in settings) and expose the digest as
+``uploaded_file.sha256``, so nothing has to read the upload back to hash it.
+SHA-256 is always computed because it keys the blob store; if the integrity
+algorithm (``DMS_HASH_ALGORITHM``) differs, it is computed in the same pass and
+all digests are available as ``uploaded_file.digests``. When chunk manifests
+are enabled the packed chunk digests are exposed as
+``uploaded_file.chunk_digests`` as well.
+
+``QuotaUploadHandler`` goes first and stops an upload whose request is
+larger than the user's remaining quota before any of it reaches disk.
+"""
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    MemoryFileUploadHandler,
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+
+from . import accounting, hashing
+from .integrity import ChunkHasher, manifest_chunk_size
+
+
+class QuotaUploadHandler(FileUploadHandler):
+    """Sets ``request.upload_quota_error`` and skips the files if the request is over quota."""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.content_length = content_length
+        self.checked = False
+        self.error = None
+        return None
+
+    def new_file(self, *args, **kwargs):
+        # Checked at the first file, so requests without one cost no query.
+        if not self.checked:
+            self.checked = True
+            user = getattr(self.request, 'user', None)
+            if user is not None and user.is_authenticated:
+                try:
+                    accounting.check_quota(user, self.content_length)
+                except accounting.QuotaExceeded as e:
+                    self.error = self.request.upload_quota_error = str(e)
+        if self.error:
+            # The form fields before the file (CSRF token, name, ...) are kept;
+            # the rest of the body is read and discarded.
+            raise StopUpload(connection_reset=False)
+
+    def receive_data_chunk(self, raw_data, start):
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def quota_error(request):
+    """The error QuotaUploadHandler set for ``request``'s upload, if any."""
+    request.FILES  # parsing the body runs the handlers
+    return getattr(request, 'upload_quota_error', None)
+
+
+class HashingUploadMixin:
+
+    def new_file(self, *args, **kwargs):
+        # Set up before super(): the memory handler raises StopFutureHandlers
+        # from new_file() when it takes the file.
+        self.hashers = {'sha256': hashing.new_hasher('sha256')}
+        algorithm = hashing.default_algorithm()
+        if algorithm not in self.hashers:
+            self.hashers[algorithm] = hashing.new_hasher(algorithm)
+        chunk_size = manifest_chunk_size()
+        self.chunk_hasher = ChunkHasher(chunk_size) if chunk_size else None
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # This handler kept the chunk, so it is the one building the file.
+            for hasher in self.hashers.values():
+                hasher.update(raw_data)
+            if self.chunk_hasher:
+                self.chunk_hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.digests = {name: h.hexdigest() for name, h in self.hashers.items()}
+            uploaded_file.sha256 = uploaded_file.digests['sha256']
+            uploaded_file.chunk_digests = self.chunk_hasher.finish() if self.chunk_hasher else None
+            uploaded_file.manifest_chunk_size = self.chunk_hasher.chunk_size if self.chunk_hasher else None
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,389 @@
+"""
+Recording uploaded files as documents and versions, and resumable uploads.
+
+``create_document`` and ``add_version`` write the rows for a file already in
+the blob store; both the multipart views and resumable uploads use them.
+They move the storage counters and enforce the owner's quota (see
+accounting.py), raising QuotaExceeded and releasing the blob if it's over.
+
+A resumable upload is an ``UploadSession``: the client creates it with the
+file size, PUTs fixed-size chunks in any order (and in parallel), asks which
+byte ranges have arrived, and finalizes. Each chunk is written in place
+into one preallocated file under DMS_UPLOAD_DIR, so finalizing never copies
+the data: the file is hashed in one pass and renamed into the blob store.
+Chunk digests are computed as chunks arrive and become the document's chunk
+manifest. Chunk writers hold a shared lock on the file and finalizing an
+exclusive one, so no chunk lands in a file that has been hashed. Sessions expire after DMS_UPLOAD_EXPIRY_HOURS; ``manage.py
+cleanup_uploads`` deletes expired ones.
+"""
+import fcntl
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import accounting, aio, blobstore, eventlog, hashing, integrity, metrics, previews
+from .models import (
+    Document, DocumentVersion, FileHash, MonitoredFile, UploadChunk, UploadSession,
+)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# A finalize that hasn't finished by then is taken to have died and can be retried.
+FINALIZE_TIMEOUT = timedelta(hours=1)
+
+
+class UploadError(Exception):
+    pass
+
+
+# --- Recording uploads ---
+def create_document(user, name, folder, blob, digest, chunk_digests=None, chunk_size=None):
+    """
+    Create a document and its first version for ``blob`` (which must hold two
+    references for them). ``digest`` is ``(algorithm, hexdigest)``.
+    """
+    try:
+        doc = _create_document(user, name, folder, blob, digest, chunk_digests, chunk_size)
+    except accounting.QuotaExceeded:
+        blobstore.release({blob.pk: 2})
+        raise
+    eventlog.log_activity(user, 'upload', doc)
+    transaction.on_commit(lambda: previews.prerender(doc))
+    return doc
+
+
+def _create_document(user, name, folder, blob, digest, chunk_digests, chunk_size):
+    with transaction.atomic():
+        doc = Document.objects.create(
+            name=name,
+            file=blob.file.name,
+            blob=blob,
+            size=blob.size,
+            versions_size=blob.size,
+            folder=folder,
+            uploaded_by=user,
+            uploaded_at=timezone.now(),
+            version_count=1
+        )
+        doc.current_version = DocumentVersion.objects.create(
+            document=doc,
+            version_file=blob.file.name,
+            blob=blob,
+            version_number=1,
+            hash_value=blob.sha256,
+            size=blob.size
+        )
+        Document.objects.filter(pk=doc.pk).update(current_version=doc.current_version)
+        algorithm, hash_value = digest
+        FileHash.objects.create(document=doc, algorithm=algorithm, hash_value=hash_value, file_size=blob.size)
+        MonitoredFile.objects.create(document=doc)
+        integrity.save_manifest(doc, chunk_digests, chunk_size, blob.size)
+        accounting.document_added(doc)
+        accounting.enforce_quota(user.pk)
+    return doc
+
+
+def new_version(document, blob, file_name, hash_value, size):
+    """
+    Create the next version of ``document`` for ``blob`` (holding two
+    references; None for pre-blob-store files) and make it the current file.
+    Call inside a transaction: the number comes from an atomic increment of
+    ``version_count``, whose row lock serializes concurrent uploads to the
+    same document until commit. Raises QuotaExceeded (rolling the
+    transaction back) if the version takes the owner over quota.
+    """
+    Document.objects.filter(pk=document.pk).update(
+        version_count=F('version_count') + 1, versions_size=F('versions_size') + size,
+    )
+    version_number, previous_blob_id = (
+        Document.objects.filter(pk=document.pk).values_list('version_count', 'blob_id').get()
+    )
+    version = DocumentVersion.objects.create(
+        document=document,
+        version_file=file_name,
+        blob=blob,
+        version_number=version_number,
+        hash_value=hash_value,
+        size=size
+    )
+
+    # update original document to point to new version
+    document.file = file_name
+    document.blob = blob
+    document.size = size
+    document.uploaded_at = timezone.now()
+    document.version_count = version_number
+    document.current_version = version
+    document.save(update_fields=['file', 'blob', 'size', 'uploaded_at', 'version_count', 'current_version'])
+    blobstore.release({previous_blob_id: 1})
+    accounting.version_added(document, size)
+    accounting.enforce_quota(document.uploaded_by_id)
+    return version
+
+
+def add_version(document, user, blob, digest, chunk_digests=None, chunk_size=None):
+    """Make ``blob`` (holding two references) the new current version of ``document``."""
+    try:
+        with transaction.atomic():
+            new_version(document, blob, blob.file.name, blob.sha256, blob.size)
+            algorithm, hash_value = digest
+            FileHash.objects.update_or_create(
+                document=document,
+                defaults={'algorithm': algorithm, 'hash_value': hash_value, 'file_size': blob.size}
+            )
+            integrity.save_manifest(document, chunk_digests, chunk_size, blob.size)
+    except accounting.QuotaExceeded:
+        blobstore.release({blob.pk: 2})
+        raise
+    eventlog.log_activity(user, 'modify', document)
+    transaction.on_commit(lambda: previews.prerender(document))
+    return document
+
+
+# --- Resumable sessions ---
+def upload_dir():
+    # Under MEDIA_ROOT by default so finished files are renamed, not copied, into the blob store.
+    return getattr(settings, 'DMS_UPLOAD_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'uploads')
+
+
+def session_chunk_size():
+    # Matching the manifest chunk size lets chunk digests double as the manifest.
+    return (getattr(settings, 'DMS_UPLOAD_CHUNK_SIZE', None)
+            or integrity.manifest_chunk_size() or DEFAULT_CHUNK_SIZE)
+
+
+def session_path(session):
+    return os.path.join(upload_dir(), f'{session.pk}.part')
+
+
+def create_session(user, filename, size, name='', folder=None, document=None):
+    if size < 0:
+        raise UploadError("Invalid size.")
+    max_size = getattr(settings, 'DMS_UPLOAD_MAX_SIZE', None)
+    if max_size and size > max_size:
+        raise UploadError("File is too large.")
+    try:
+        # Refused before any chunk is written rather than at the end.
+        accounting.check_quota(document.uploaded_by_id if document else user, size)
+    except accounting.QuotaExceeded as e:
+        raise UploadError(str(e))
+    hours = getattr(settings, 'DMS_UPLOAD_EXPIRY_HOURS', 24)
+    session = UploadSession.objects.create(
+        user=user, filename=os.path.basename(filename)[:255], size=size, name=name,
+        folder=folder, document=document, chunk_size=session_chunk_size(),
+        expires_at=timezone.now() + timedelta(hours=hours),
+    )
+    os.makedirs(upload_dir(), exist_ok=True)
+    # A sparse file of the final size; chunks are written into it in place.
+    with open(session_path(session), 'wb') as f:
+        f.truncate(size)
+    return session
+
+
+def write_chunk(session, index, stream, expected_sha256=None):
+    """Write chunk ``index`` from ``stream`` (a file-like request body) at its offset."""
+    digest = _receive_chunk(session, index, stream, expected_sha256)
+    UploadChunk.objects.update_or_create(session=session, index=index, defaults={'digest': digest})
+
+
+async def awrite_chunk(session, index, stream, expected_sha256=None):
+    """``write_chunk`` for async views: the copy and hashing run in aio.py's pool."""
+    digest = await aio.run(_receive_chunk, session, index, stream, expected_sha256)
+    await UploadChunk.objects.aupdate_or_create(session=session, index=index, defaults={'digest': digest})
+
+
+def _receive_chunk(session, index, stream, expected_sha256):
+    # Returns the chunk's SHA-256 digest; touches the disk only.
+    if not 0 <= index < session.chunk_count:
+        raise UploadError("Chunk index out of range.")
+    if session.finalizing_at is not None:
+        raise UploadError("Upload is being finalized.")
+    length = session.chunk_length(index)
+    digest = hashlib.sha256()
+    offset = index * session.chunk_size
+    received = 0
+    fd = _open_locked(session, os.O_WRONLY, fcntl.LOCK_SH)
+    try:
+        with metrics.timer('chunk_write', length):
+            while received < length:
+                data = stream.read(min(hashing.buffer_size(), length - received))
+                if not data:
+                    break
+                os.pwrite(fd, data, offset + received)
+                digest.update(data)
+                received += len(data)
+    finally:
+        os.close(fd)
+    if received != length or stream.read(1):
+        raise UploadError(f"Chunk {index} must be exactly {length} bytes.")
+    if expected_sha256 and expected_sha256.lower() != digest.hexdigest():
+        raise UploadError(f"Chunk {index} does not match its checksum.")
+    return digest.digest()
+
+
+def _open_locked(session, flags, lock):
+    """Open the session's data file with ``flags`` and take the flock ``lock`` on it."""
+    path = session_path(session)
+    try:
+        fd = os.open(path, flags)
+    except FileNotFoundError:
+        raise UploadError("Upload session has no data file.")
+    try:
+        fcntl.flock(fd, lock)
+        # A finalize may have moved the file into the blob store while this waited.
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            current = None
+        if current is None or not os.path.samestat(current, os.fstat(fd)):
+            raise UploadError("Upload has been finalized.")
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def received_indexes(session):
+    return sorted(session.chunks.values_list('index', flat=True))
+
+
+def session_status(session):
+    indexes = received_indexes(session)
+    ranges = integrity.merge_ranges([
+        (i * session.chunk_size, i * session.chunk_size + session.chunk_length(i)) for i in indexes
+    ])
+    received = set(indexes)
+    return {
+        'id': str(session.pk),
+        'filename': session.filename,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'received': ranges,
+        'missing': [i for i in range(session.chunk_count) if i not in received],
+        'expires_at': session.expires_at.isoformat(),
+        'document': session.document_id,
+        'folder': session.folder_id,
+    }
+
+
+def check_target(session, data):
+    """
+    Raise UploadError if the ``document`` or ``folder`` ids posted in
+    ``data`` (empty for none) aren't the ones ``session`` uploads into.
+    Fields that weren't posted aren't checked.
+    """
+    for field in ('document', 'folder'):
+        if field in data and data[field] != str(getattr(session, f'{field}_id') or ''):
+            raise UploadError(f"This upload was started for another {field}.")
+
+
+def finalize(session):
+    """
+    Turn a fully received session into a document (or a new version of
+    one). The session is claimed with one conditional UPDATE and its file
+    locked against chunk writes; the file is hashed and moved into the blob
+    store outside any transaction, and only the document rows are written
+    in one.
+    """
+    now = timezone.now()
+    claimed = UploadSession.objects.filter(pk=session.pk).filter(
+        Q(finalizing_at__isnull=True) | Q(finalizing_at__lt=now - FINALIZE_TIMEOUT)
+    ).update(finalizing_at=now)
+    if not claimed:
+        raise UploadError("Upload is already being finalized.")
+    try:
+        session = UploadSession.objects.select_related('document').get(pk=session.pk)
+        # Waits for chunk writes in progress; later ones find the claim, or
+        # the file gone.
+        fd = _open_locked(session, os.O_RDONLY, fcntl.LOCK_EX)
+    except BaseException:
+        UploadSession.objects.filter(pk=session.pk).update(finalizing_at=None)
+        raise
+    try:
+        try:
+            path, sha256, digest, chunk_digests, manifest_size = _prepare(session)
+        except BaseException:
+            UploadSession.objects.filter(pk=session.pk).update(finalizing_at=None)
+            raise
+        try:
+            # From here on the data file belongs to the blob store.
+            blob = blobstore.store_path(path, sha256, session.filename, refs=2)
+        except BaseException:
+            # The data file has been removed, so the upload can't be retried.
+            discard(session)
+            raise
+    finally:
+        os.close(fd)
+    try:
+        # Each writes its rows in one transaction.
+        if session.document_id:
+            doc = add_version(session.document, session.user, blob, digest, chunk_digests, manifest_size)
+        else:
+            doc = create_document(session.user, session.name or session.filename, session.folder,
+                                  blob, digest, chunk_digests, manifest_size)
+    except accounting.QuotaExceeded as e:
+        # The blob was released and the data file is gone with it.
+        session.delete()
+        raise UploadError(str(e))
+    session.delete()
+    return doc
+
+
+def _prepare(session):
+    """Check a claimed session and hash its file: ``(path, sha256, digest, chunk digests, manifest chunk size)``."""
+    chunks = dict(session.chunks.values_list('index', 'digest'))
+    if len(chunks) != session.chunk_count:
+        raise UploadError("Upload is incomplete.")
+    if session.document_id and session.document.is_deleted:
+        raise UploadError("The document has been deleted.")
+    try:
+        # Usage may have grown since the session was created.
+        owner = session.document.uploaded_by_id if session.document_id else session.user_id
+        accounting.check_quota(owner, session.size)
+    except accounting.QuotaExceeded as e:
+        raise UploadError(str(e))
+    path = session_path(session)
+    if os.path.getsize(path) != session.size:
+        raise UploadError("Upload data file has the wrong size.")
+
+    # Chunks arrive out of order, so the whole-file digests take one
+    # sequential read here; there is no copy.
+    algorithm = hashing.default_algorithm()
+    hashers = {'sha256': hashing.new_hasher('sha256'), algorithm: hashing.new_hasher(algorithm)}
+    manifest_size = integrity.manifest_chunk_size()
+    chunk_hasher = None
+    if manifest_size and manifest_size != session.chunk_size:
+        chunk_hasher = integrity.ChunkHasher(manifest_size)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(hashing.buffer_size()), b''):
+            for hasher in hashers.values():
+                hasher.update(data)
+            if chunk_hasher:
+                chunk_hasher.update(data)
+    if chunk_hasher:
+        chunk_digests = chunk_hasher.finish()
+    elif manifest_size and session.size:
+        chunk_digests = b''.join(bytes(chunks[i]) for i in range(session.chunk_count))
+    else:
+        chunk_digests = None
+    return path, hashers['sha256'].hexdigest(), (algorithm, hashers[algorithm].hexdigest()), chunk_digests, manifest_size
+
+
+def discard(session):
+    path = session_path(session)
+    session.delete()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def purge_expired(now=None):
+    """Delete expired sessions and their data; return how many were removed."""
+    expired = list(UploadSession.objects.filter(expires_at__lt=now or timezone.now()))
+    for session in expired:
+        discard(session)
+    return len(expired)
@@ -0,0 +1,203 @@
+"""
+Delta-compressed storage for older document versions.
+
+A document's current version always has a full blob. Once a newer version
+exists, an older one whose blob nothing else references is rewritten as a
+reverse delta against the version after it (see delta.py) and its blob is
+released: ``version_file`` then names the delta file and ``delta_base`` the
+version it applies to. Every DMS_VERSION_SNAPSHOT_INTERVAL-th version keeps
+its full blob, so rebuilding any version applies fewer deltas than that.
+
+Computing a delta is pure-Python work that holds the GIL for about a second
+per megabyte, so it never runs in a request or the background pool: run
+``manage.py compact_versions --since 2`` hourly from cron (or without
+``--since`` to convert all existing history) and ``manage.py
+version_storage_report`` to see the space saved per document.
+
+Rebuilt versions are kept in an LRU disk cache keyed by their SHA-256, so
+repeated downloads of the same old version are served from one file.
+"""
+import hashlib
+import os
+import tempfile
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from . import blobstore, compression, delta, filecache
+from .models import Blob, DocumentVersion, sharded_name
+
+cache = filecache.FileCache('versions', 'DMS_VERSION_CACHE_SIZE', 512 * 1024 * 1024)
+
+
+def enabled():
+    return getattr(settings, 'DMS_VERSION_DELTAS', True)
+
+
+def snapshot_interval():
+    return getattr(settings, 'DMS_VERSION_SNAPSHOT_INTERVAL', 10)
+
+
+# --- Reading ---
+def content_path(version):
+    """Return ``(path, storage name)`` of a file holding ``version``'s full content (maybe compressed)."""
+    if version.delta_base_id is None:
+        return version.version_file.path, version.version_file.name
+    path = cache.get(version.hash_value) or _rebuild(version)
+    return path, cache.storage_name(path)
+
+
+def _rebuild(version):
+    # Walk back to the nearest full (or already cached) version, then apply
+    # the deltas forward, caching each rebuilt version on the way.
+    chain = []
+    base_path = None
+    while version.delta_base_id is not None:
+        base_path = cache.get(version.hash_value)
+        if base_path:
+            break
+        chain.append(version)
+        version = version.delta_base
+    if base_path is None:
+        base_path = version.version_file.path
+    for version in reversed(chain):
+        base_path = cache.put(version.hash_value, lambda f, base=base_path, v=version: _apply(base, v, f))
+    return base_path
+
+
+class _HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.f.write(data)
+
+
+def _apply(base_path, version, f):
+    out = _HashingWriter(f)
+    delta.apply_delta(base_path, version.version_file.path, out)
+    if out.sha256.hexdigest() != version.hash_value:
+        raise delta.DeltaError(f"Version {version.pk} was rebuilt with the wrong hash.")
+
+
+def acquire_content(version, filename, refs=1):
+    """
+    Return ``(blob, storage name)`` for ``version``'s content with ``refs``
+    references taken, storing a delta-stored version as a blob again.
+    Versions from before the blob store have no blob.
+    """
+    if version.delta_base_id is None:
+        blobstore.acquire(version.blob, refs)
+        return version.blob, version.version_file.name
+    path, _ = content_path(version)
+    with compression.open_file(path) as f:
+        blob = blobstore.store_file(File(f, name=filename), sha256=version.hash_value, refs=refs)
+    return blob, blob.file.name
+
+
+# --- Compacting ---
+def compact_document(document_id):
+    """Store every eligible older version of a document as a delta; return how many were converted."""
+    if not enabled():
+        return 0
+    versions = list(
+        DocumentVersion.objects.filter(document_id=document_id)
+        .select_related('blob').order_by('version_number')
+    )
+    converted = 0
+    for version, newer in zip(versions, versions[1:]):
+        if _should_deltify(version, newer) and deltify(version, newer):
+            converted += 1
+    return converted
+
+
+def _should_deltify(version, newer):
+    blob = version.blob
+    if blob is None or version.delta_base_id is not None:
+        return False
+    if version.version_number % snapshot_interval() == 0:
+        return False
+    # A blob shared with another row (the current file, a restored copy,
+    # another document) wouldn't be freed.
+    if blob.ref_count != 1 or newer.blob_id == blob.pk:
+        return False
+    min_size = getattr(settings, 'DMS_VERSION_DELTA_MIN_SIZE', 16 * 1024)
+    max_size = getattr(settings, 'DMS_VERSION_DELTA_MAX_SIZE', 64 * 1024 * 1024)
+    return min_size <= blob.size <= max_size
+
+
+def deltify(version, base):
+    """Replace ``version``'s blob with a delta against ``base``; False if that saves too little."""
+    blob = version.blob
+    max_ratio = getattr(settings, 'DMS_VERSION_DELTA_MAX_RATIO', 0.5)
+    base_path, _ = content_path(base)
+    with compression.open_file(blob.file.path) as f:
+        target = f.read()
+    with compression.open_file(base_path) as f:
+        base_data = f.read()
+    ops = delta.diff(base_data, target, max_literal=int(len(target) * max_ratio))
+    if ops is None:
+        return False
+
+    storage = version.version_file.storage
+    name = sharded_name('deltas', f'{version.pk}.delta')
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            delta.write_delta(ops, len(base_data), target, f)
+        delta_size = os.path.getsize(tmp)
+        if delta_size > len(target) * max_ratio:
+            return False
+        with transaction.atomic():
+            Blob.objects.select_for_update().filter(pk=blob.pk).first()
+            if not DocumentVersion.objects.filter(pk=version.pk, blob=blob).exists():
+                return False
+            os.replace(tmp, path)
+            DocumentVersion.objects.filter(pk=version.pk).update(
+                version_file=name, blob=None, delta_base=base, delta_size=delta_size,
+                size=len(target), hash_value=version.hash_value or blob.sha256,
+            )
+            blobstore.release({blob.pk: 1})
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return True
+
+
+# --- Reporting ---
+def storage_report(documents):
+    """
+    Per-document version storage for the ``documents`` queryset: logical
+    bytes (every version in full), stored bytes (distinct blobs plus delta
+    files) and the difference.
+    """
+    rows = {
+        row['document']: row for row in
+        DocumentVersion.objects.filter(document__in=documents).values('document').annotate(
+            versions=Count('id'), deltas=Count('delta_base'),
+            logical=Sum('size'), delta_bytes=Sum('delta_size'),
+        )
+    }
+    blob_bytes = defaultdict(int)
+    for document_id, _, size in (DocumentVersion.objects.filter(document__in=documents, blob__isnull=False)
+                                 .values_list('document', 'blob', 'blob__size').distinct()):
+        blob_bytes[document_id] += size
+    report = []
+    for document_id, name in documents.values_list('id', 'name'):
+        row = rows.get(document_id)
+        if row is None:
+            continue
+        stored = blob_bytes[document_id] + (row['delta_bytes'] or 0)
+        logical = row['logical'] or 0
+        report.append({
+            'document': document_id, 'name': name, 'versions': row['versions'], 'deltas': row['deltas'],
+            'logical': logical, 'stored': stored, 'saved': logical - stored,
+        })
+    return report
@@ -1,19 +1,28 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.conf import settings
 from django.utils import timezone
 from .models import *
+from . import (
+    accounting, aio, analytics as usage, blobstore, bulk, compression, downloads, eventlog, export, hashing,
+    integrity, listcache, metrics, previews, retention, search, uploadhandlers, uploads, versions,
+)
+from .pagination import paginate, paginate_documents
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
-from django.shortcuts import get_object_or_404, redirect
+from django.views.decorators.http import require_http_methods, require_POST, require_safe
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.db import transaction
+import os
+import secrets
 from urllib.parse import quote
-from django.db.models import Count
-import mimetypes
-import hashlib
-from django.db.models import Q
-from django.utils.timezone import now
-from datetime import timedelta
 
 
 # --- Registration View ---
@@ -43,7 +52,7 @@ def login_user(request):
         user = authenticate(request, username=username, password=password)
         if user is not None:
             login(request, user)
-            ActivityLog.objects.create(user=user, action='login')
+            eventlog.log_activity(user, 'login')
             return redirect('dashboard')
         else:
             messages.warning(request, 'Invalid credentials.')
@@ -56,105 +65,157 @@ def dashboard(request):
 
     recent_uploads = Document.objects.filter(uploaded_by=user, is_deleted=False).order_by('-uploaded_at')[:5]
     recent_activities = ActivityLog.objects.filter(user=user).order_by('-timestamp')[:5]
+    # Kept current by accounting.py, so no aggregate over the documents.
+    used_bytes, file_count, quota = accounting.usage(user)
 
     return render(request, 'dashboard.html', {
         'recent_uploads': recent_uploads,
         'recent_activities': recent_activities,
+        'used_bytes': used_bytes,
+        'file_count': file_count,
+        'quota': quota,
+        'quota_percent': min(100, round(100 * used_bytes / quota)) if quota else None,
     })
 
 @login_required
 def upload_document(request):
-    folders = Folder.objects.all()
-
     if request.method == 'POST':
+        quota_error = uploadhandlers.quota_error(request)
+        if quota_error:
+            messages.error(request, quota_error)
+            return redirect('upload_document')
         name = request.POST['name']
         file = request.FILES['file']
         folder_id = request.POST.get('folder')
-        folder = Folder.objects.get(id=folder_id) if folder_id else None
+        folder = get_object_or_404(Folder, id=folder_id, category__created_by=request.user) if folder_id else None
         
         if not name:
             name = file.name
 
-        doc = Document.objects.create(
-            name=name,
-            file=file,
-            folder=folder,
-            uploaded_by=request.user,
-            uploaded_at=timezone.now()
-        )
-
-        # SHA256 hashing
-        sha256 = hashlib.sha256()
-        for chunk in file.chunks():
-            sha256.update(chunk)
-        hash_value = sha256.hexdigest()
-        
-        DocumentVersion.objects.create(
-            document=doc,
-            version_file=doc.file,
-            version_number=1
-        )
-        
-        hash_value = FileHash.generate_sha256(doc.file.path)
-        FileHash.objects.create(document=doc, hash_value=hash_value)
-        ActivityLog.objects.create(user=request.user, action='upload', document=doc)
+        # Stored once per distinct content; the document and its first
+        # version both reference the same blob. The SHA-256 was computed by
+        # the upload handler while the file streamed in.
+        blob = blobstore.store_file(file, refs=2)
+        try:
+            uploads.create_document(
+                request.user, name, folder, blob, hashing.uploaded_digest(file),
+                getattr(file, 'chunk_digests', None), getattr(file, 'manifest_chunk_size', None),
+            )
+        except accounting.QuotaExceeded as e:
+            messages.error(request, str(e))
+            return redirect('upload_document')
 
         return redirect('dashboard')
 
 
-    return render(request, 'documents/upload.html', {'folders': folders})
+    return render(request, 'documents/upload.html', {
+        'folders': listcache.folder_choices(request.user),
+        # Files of at least one chunk are sent through a resumable upload session.
+        'resumable_threshold': uploads.session_chunk_size(),
+    })
 
+@login_required
+@require_safe
 def smart_view(request, doc_id):
-    doc = Document.objects.get(id=doc_id)
-    file_url = request.build_absolute_uri(doc.file.url)
-    mimetype, _ = mimetypes.guess_type(doc.file.path)
-
-    # ✅ Log the view before redirecting
-    if request.user != doc.uploaded_by:
-        recent = UsageStat.objects.filter(
-            document=doc,
-            accessed_by=request.user,
-            action='view',
-            accessed_at__gte=now() - timedelta(minutes=10)
-        ).exists()
-        if not recent:
-            UsageStat.objects.create(
-                document=doc,
-                accessed_by=request.user,
-                action='view'
-            )
+    doc = get_object_or_404(Document.objects.select_related('filehash'), id=doc_id)
+    if not downloads.can_download(request.user, doc):
+        raise Http404
+
+    # ✅ Log the view before serving
+    # (repeat views within 10 minutes are dropped by the log buffer)
+    if request.user.id != doc.uploaded_by_id:
+        eventlog.log_view(doc, request.user)
+
+    # The first page is rendered locally (see previews.py); the original is
+    # only sent when the user downloads it.
+    return render(request, 'documents/preview.html', {
+        'document': doc,
+        'can_preview': previews.renderer_for(doc.file.name) is not None,
+    })
 
-    # ✅ Then process preview logic
-    if mimetype and mimetype.startswith('image'):
-        return redirect(doc.file.url)
+@login_required
+@require_safe
+def document_rendition(request, doc_id, rendition):
+    if rendition not in previews.RENDITIONS:
+        raise Http404
+    doc = get_object_or_404(Document.objects.select_related('blob', 'filehash'), id=doc_id)
+    if not downloads.can_download(request.user, doc):
+        raise Http404
+    if previews.renderer_for(doc.file.name) is None:
+        response = previews.placeholder_response(doc.file.name, rendition)
+        patch_cache_control(response, private=True, max_age=previews.MAX_AGE)
+        return response
+    path = previews.get_rendition(doc, rendition)
+    if path is None:
+        # Still rendering (or unreadable): show the icon without caching it.
+        response = previews.placeholder_response(doc.file.name, rendition)
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+    base = os.path.splitext(doc.name)[0] or doc.name
+    response = downloads.serve_file(
+        request, path, previews.cache.storage_name(path), f"{base} ({rendition}){os.path.splitext(path)[1]}",
+        etag=downloads.etag_for(os.path.basename(path)), inline=True, max_age=previews.MAX_AGE,
+    )
+    return previews.secure_response(response)
 
-    elif mimetype == 'application/pdf':
-        return redirect(doc.file.url)
 
-    elif doc.file.name.lower().endswith(('.doc', '.docx', '.pptx', '.xlsx')):
-        encoded_url = quote(file_url, safe='')
-        office_url = f"https://view.officeapps.live.com/op/embed.aspx?src={encoded_url}"
-        return redirect(office_url)
+def _document_file_response(request, doc, inline=False, asynchronous=False):
+    filehash = getattr(doc, 'filehash', None)
+    etag = downloads.etag_for(filehash.hash_value if filehash else None)
+    filename = doc.name if os.path.splitext(doc.name)[1] else doc.name + os.path.splitext(doc.file.name)[1]
+    return downloads.serve_file(
+        request, doc.file.path, doc.file.name, filename,
+        etag=etag, last_modified=doc.uploaded_at, inline=inline, asynchronous=asynchronous,
+    )
+
+
+@login_required
+@require_safe
+async def download_document(request, doc_id):
+    # Async so that under ASGI a slow client holds a coroutine, not a worker
+    # thread, for the whole transfer (see aio.py). Under WSGI the worker
+    # thread streams the file as before.
+    user = await request.auser()
+    doc = await aget_object_or_404(Document.objects.select_related('filehash'), id=doc_id)
+    if not downloads.can_download(user, doc):
+        raise Http404
+    response = await aio.run(_document_file_response, request, doc, asynchronous=isinstance(request, ASGIRequest))
+    if response.status_code in (200, 206) and user.id != doc.uploaded_by_id:
+        # Range requests for one download are logged once (see eventlog).
+        await sync_to_async(eventlog.log_view)(doc, user, 'download')
+    return response
+
+
+@login_required
+@require_safe
+def download_version(request, version_id):
+    version = get_object_or_404(DocumentVersion.objects.select_related('document'), id=version_id,
+                                document__uploaded_by=request.user)
+    doc = version.document
+    base, ext = os.path.splitext(doc.name)
+    filename = f"{base or doc.name} (v{version.version_number}){ext or os.path.splitext(doc.file.name)[1]}"
+    # Delta-stored versions are rebuilt into (or served from) the version cache.
+    path, name = versions.content_path(version)
+    return downloads.serve_file(
+        request, path, name, filename,
+        etag=downloads.etag_for(version.hash_value), last_modified=version.created_at,
+    )
+
 
-    # If nothing matches
-    return render(request, 'dashboard.html', {
-        'message': "This file cannot be previewed in the browser."
-    })
-    
-    
 @login_required
 def my_files(request):
     query = request.GET.get('q')
-    files = Document.objects.filter(uploaded_by=request.user, is_deleted=False)
-
     if query:
-        files = files.filter(
-            Q(name__icontains=query) |
-            Q(folder__name__icontains=query) |
-            Q(folder__category__name__icontains=query)
-        )
-
-    return render(request, 'documents/my_files.html', {'files': files, 'query': query})
+        # Ranked full-text search over names, folders, categories and contents.
+        page = search.search_page(request.user, query, request.GET.get('cursor'))
+    else:
+        files = Document.objects.filter(uploaded_by=request.user, is_deleted=False).select_related('folder__category')
+        page = paginate_documents(request, files)
+    # Documents can only be moved into the user's own folders.
+    categories = listcache.folder_tree(request.user)
+    return render(request, 'documents/my_files.html', {
+        'files': page, 'page': page, 'query': query, 'categories': categories,
+    })
 
 @require_POST
 @login_required
@@ -162,14 +223,19 @@ def delete_file(request, doc_id):
     doc = get_object_or_404(Document, id=doc_id, uploaded_by=request.user, is_deleted=False)
     doc.is_deleted = True
     doc.deleted_at = timezone.now()
-    doc.save()
+    with transaction.atomic():
+        doc.save(update_fields=['is_deleted', 'deleted_at'])
+        accounting.documents_trashed([(doc.folder_id, doc.versions_size)])
     messages.success(request, f"'{doc.name or doc.file.name}' has been deleted.")
     return redirect('my_files')
 
 @login_required
 def trash(request):
-    trashed_files = Document.objects.filter(uploaded_by=request.user, is_deleted=True).order_by('-deleted_at')
-    return render(request, 'documents/trash.html', {'files': trashed_files})
+    trashed_files = Document.objects.filter(uploaded_by=request.user, is_deleted=True)
+    page = paginate(trashed_files, 'deleted_at', descending=True, cursor=request.GET.get('cursor'))
+    return render(request, 'documents/trash.html', {
+        'files': page, 'page': page, 'retention_days': retention.retention_days(),
+    })
 
 @require_POST
 @login_required
@@ -177,7 +243,9 @@ def restore_file(request, doc_id):
     doc = get_object_or_404(Document, id=doc_id, uploaded_by=request.user, is_deleted=True)
     doc.is_deleted = False
     doc.deleted_at = None
-    doc.save()
+    with transaction.atomic():
+        doc.save(update_fields=['is_deleted', 'deleted_at'])
+        accounting.documents_trashed([(doc.folder_id, doc.versions_size)], sign=-1)
     messages.success(request, "File restored successfully.")
     return redirect('trash')
 
@@ -185,40 +253,103 @@ def restore_file(request, doc_id):
 @login_required
 def permanent_delete_file(request, doc_id):
     doc = get_object_or_404(Document, id=doc_id, uploaded_by=request.user, is_deleted=True)
-    file_path = doc.file.path
-    doc.delete()
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    blobstore.delete_document(doc)
     messages.success(request, "File permanently deleted.")
     return redirect('trash')
 
+# --- Bulk Operations ---
+@require_POST
+@login_required
+def bulk_documents(request):
+    """
+    Apply one operation to many documents. Select them with ``ids``,
+    ``folder`` and/or ``q``; ``move`` takes a ``target_folder`` (empty for no
+    folder). Form posts with a ``next`` URL are redirected back with a
+    summary, anything else gets per-document results as JSON.
+    """
+    operation = request.POST.get('operation')
+    next_url = request.POST.get('next')
+    if next_url and not url_has_allowed_host_and_scheme(next_url, {request.get_host()}, request.is_secure()):
+        next_url = None
+    target = None
+    if operation == 'move' and request.POST.get('target_folder'):
+        target = get_object_or_404(
+            Folder.objects.select_related('category').filter(category__created_by=request.user),
+            id=request.POST['target_folder'],
+        )
+    try:
+        documents, requested = bulk.select(
+            request.user, ids=request.POST.getlist('ids') or None,
+            folder_id=request.POST.get('folder') or None, query=request.POST.get('q'),
+        )
+        results = bulk.run(request.user, operation, documents, requested, target=target)
+    except bulk.BulkError as e:
+        if next_url:
+            messages.error(request, str(e))
+            return redirect(next_url)
+        return JsonResponse({'error': str(e)}, status=400)
+    if next_url:
+        messages.success(request, bulk.summary(operation, results))
+        return redirect(next_url)
+    return JsonResponse({'operation': operation, 'results': results})
+
+# --- ZIP Export ---
+@require_http_methods(['GET', 'POST'])
+@login_required
+def export_documents(request):
+    """
+    Stream a ZIP archive of a ``folder``, a ``category`` or the documents
+    selected with ``ids`` and/or ``q`` (see export.py). Errors redirect to a
+    ``next`` URL with a message, or are answered with JSON.
+    """
+    params = request.POST if request.method == 'POST' else request.GET
+    next_url = params.get('next')
+    if next_url and not url_has_allowed_host_and_scheme(next_url, {request.get_host()}, request.is_secure()):
+        next_url = None
+    ids = params.getlist('ids')
+    if len(ids) == 1 and ',' in ids[0]:
+        ids = [pk for pk in ids[0].split(',') if pk]
+    try:
+        documents, depth, title = export.select(
+            request.user, ids=ids or None, folder_id=params.get('folder') or None,
+            category_id=params.get('category') or None, query=params.get('q'),
+        )
+        entries = export.plan(documents, depth)
+    except export.ExportError as e:
+        if next_url:
+            messages.error(request, str(e))
+            return redirect(next_url)
+        return JsonResponse({'error': str(e)}, status=400)
+
+    eventlog.log_activities(request.user, 'download', [entry.document_id for entry in entries])
+    # Under ASGI a sync iterator would be read into memory whole before it is sent.
+    body = export.astream(entries) if isinstance(request, ASGIRequest) else export.stream(entries)
+    response = StreamingHttpResponse(body, content_type='application/zip')
+    response['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(title)}.zip"
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
 @login_required
 def analytics(request):
     user = request.user
 
-    # Total uploads
-    total_uploads = Document.objects.filter(uploaded_by=user, is_deleted=False).count()
-
-    # Total views/downloads on user's files
-    user_docs = Document.objects.filter(uploaded_by=user)
-    total_views = UsageStat.objects.filter(document__in=user_docs, action='view').count()
-    total_downloads = UsageStat.objects.filter(document__in=user_docs, action='download').count()
-    
-    user_docs = Document.objects.filter(uploaded_by=request.user)
-    access_logs = UsageStat.objects.filter(document__in=user_docs).select_related('accessed_by', 'document').order_by('-accessed_at')
+    # Uploads, views/downloads, top documents and the daily series come from
+    # the pre-aggregated rollups rather than counting rows.
+    totals = usage.usage_totals(user)
+    top_docs = usage.top_documents(user, 'view', 5)
+    series = usage.usage_series(user, 'day', 14)
 
-    # Top 5 most viewed
-    top_docs = UsageStat.objects.filter(document__in=user_docs, action='view') \
-        .values('document__id', 'document__name') \
-        .annotate(view_count=Count('id')) \
-        .order_by('-view_count')[:5]
+    access_logs = UsageStat.objects.filter(document__uploaded_by=user).select_related('accessed_by', 'document')
+    page = paginate(access_logs, 'accessed_at', descending=True, cursor=request.GET.get('cursor'))
 
     context = {
-        'total_uploads': total_uploads,
-        'total_views': total_views,
-        'total_downloads': total_downloads,
+        'total_uploads': totals.get('upload', 0),
+        'total_views': totals.get('view', 0),
+        'total_downloads': totals.get('download', 0),
         'top_docs': top_docs,
-        'access_logs': access_logs
+        'series': series,
+        'access_logs': page,
+        'page': page,
     }
     return render(request, 'documents/analytics.html', context)
 
@@ -236,7 +367,7 @@ def create_category(request):
 
 @login_required
 def create_folder(request):
-    categories = Category.objects.filter(created_by=request.user)
+    categories = listcache.folder_tree(request.user)
     if request.method == 'POST':
         name = request.POST.get('name')
         category_id = request.POST.get('category')
@@ -252,106 +383,196 @@ def create_folder(request):
 
 @login_required
 def view_categories_and_folders(request):
-    categories = Category.objects.filter(created_by=request.user).prefetch_related('folder_set')
+    categories = listcache.folder_tree(request.user)
     return render(request, 'documents/categories_folders.html', {'categories': categories})
 
 @login_required
 def view_folder_documents(request, folder_id):
     folder = get_object_or_404(Folder, id=folder_id)
     documents = Document.objects.filter(folder=folder, is_deleted=False)
-    return render(request, 'documents/folder_documents.html', {'folder': folder, 'documents': documents})
+    page = paginate_documents(request, documents)
+    return render(request, 'documents/folder_documents.html', {'folder': folder, 'documents': page, 'page': page})
 
 @login_required
 def upload_new_version(request, doc_id):
     document = get_object_or_404(Document, id=doc_id, uploaded_by=request.user, is_deleted=False)
 
     if request.method == 'POST':
+        quota_error = uploadhandlers.quota_error(request)
+        if quota_error:
+            messages.error(request, quota_error)
+            return redirect('upload_new_version', doc_id=document.id)
         new_file = request.FILES.get('version_file')
         if new_file:
-            # increment version number
-            current_versions = DocumentVersion.objects.filter(document=document).count()
-            version_number = current_versions + 1
+            blob = blobstore.store_file(new_file, refs=2)
+            try:
+                uploads.add_version(
+                    document, request.user, blob, hashing.uploaded_digest(new_file),
+                    getattr(new_file, 'chunk_digests', None), getattr(new_file, 'manifest_chunk_size', None),
+                )
+            except accounting.QuotaExceeded as e:
+                messages.error(request, str(e))
+                return redirect('upload_new_version', doc_id=document.id)
 
-            DocumentVersion.objects.create(
-                document=document,
-                version_file=new_file,
-                version_number=version_number
-            )
+            messages.success(request, "New version uploaded.")
+            return redirect('my_files')
 
-            # update original document to point to new version
-            document.file = new_file
-            document.uploaded_at = timezone.now()
-            document.save()
+    return render(request, 'documents/upload_version.html', {
+        'document': document,
+        'resumable_threshold': uploads.session_chunk_size(),
+    })
 
-            ActivityLog.objects.create(user=request.user, action='modify', document=document)
+# --- Resumable Uploads (JSON) ---
+@login_required
+@require_POST
+def create_upload_session(request):
+    folder_id = request.POST.get('folder')
+    doc_id = request.POST.get('document')
+    folder = get_object_or_404(Folder, id=folder_id, category__created_by=request.user) if folder_id else None
+    document = get_object_or_404(Document, id=doc_id, uploaded_by=request.user, is_deleted=False) if doc_id else None
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': "Invalid size."}, status=400)
+    try:
+        session = uploads.create_session(
+            request.user, request.POST.get('filename') or 'upload', size,
+            name=request.POST.get('name', ''), folder=folder, document=document,
+        )
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(uploads.session_status(session), status=201)
 
-            messages.success(request, "New version uploaded.")
-            return redirect('my_files')
+def _upload_session(request, session_id):
+    return get_object_or_404(UploadSession, id=session_id, user=request.user, expires_at__gt=timezone.now())
 
-    return render(request, 'documents/upload_version.html', {'document': document})
+@login_required
+@require_http_methods(['GET', 'DELETE'])
+def upload_session(request, session_id):
+    session = _upload_session(request, session_id)
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        return JsonResponse({'deleted': True})
+    return JsonResponse(uploads.session_status(session))
+
+@login_required
+@require_http_methods(['PUT'])
+async def upload_chunk(request, session_id, index):
+    # Under ASGI the body has been received without holding a thread; the
+    # copy into the session file and its hashing run in aio.py's pool.
+    user = await request.auser()
+    session = await aget_object_or_404(UploadSession, id=session_id, user=user, expires_at__gt=timezone.now())
+    try:
+        await uploads.awrite_chunk(session, index, request, request.headers.get('X-Chunk-SHA256'))
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'index': index})
+
+@login_required
+@require_POST
+def complete_upload_session(request, session_id):
+    session = _upload_session(request, session_id)
+    try:
+        uploads.check_target(session, request.POST)
+        doc = uploads.finalize(session)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e), **uploads.session_status(session)}, status=409)
+    redirect_to = reverse('my_files') if session.document_id else reverse('dashboard')
+    return JsonResponse({'document': doc.id, 'redirect': redirect_to})
 
 @login_required
 def document_versions(request, doc_id):
     document = get_object_or_404(Document, id=doc_id, uploaded_by=request.user)
-    versions = DocumentVersion.objects.filter(document=document).order_by('-version_number')
-    return render(request, 'documents/version_history.html', {'document': document, 'versions': versions})
+    # Newest first, seeking on the (document, version_number) unique index.
+    page = paginate(DocumentVersion.objects.filter(document=document), 'version_number',
+                    descending=True, cursor=request.GET.get('cursor'))
+    return render(request, 'documents/version_history.html', {'document': document, 'versions': page, 'page': page})
 
 @login_required
 @require_POST
 def restore_version(request, version_id):
-    version = get_object_or_404(DocumentVersion, id=version_id)
+    version = get_object_or_404(DocumentVersion.objects.select_related('document'), id=version_id,
+                                document__uploaded_by=request.user)
     document = version.document
 
-    # Create a new version entry using the restored file
-    version_number = DocumentVersion.objects.filter(document=document).count() + 1
-    DocumentVersion.objects.create(
-        document=document,
-        version_file=version.version_file,
-        version_number=version_number
-    )
-
-    # Replace current file in main document
-    document.file = version.version_file
-    document.uploaded_at = timezone.now()
-    document.save()
+    # A delta-stored version becomes a full blob again as the current file.
+    blob, file_name = versions.acquire_content(version, document.name, refs=2)
+    hash_value = version.hash_value or FileHash.generate_sha256(version.version_file.path)
+    size = blob.size if blob else version.version_file.size
+    try:
+        with transaction.atomic():
+            restored = uploads.new_version(document, blob, file_name, hash_value, size)
+            # Version hashes are SHA-256, so the restored FileHash is recorded as such.
+            FileHash.objects.update_or_create(
+                document=document,
+                defaults={'algorithm': 'sha256', 'hash_value': hash_value, 'file_size': size}
+            )
+            # Chunk digests are only known for uploaded content; drop the stale manifest.
+            ChunkManifest.objects.filter(document=document).delete()
+    except accounting.QuotaExceeded as e:
+        blobstore.release({blob.pk if blob else None: 2})
+        messages.error(request, str(e))
+        return redirect('document_versions', doc_id=document.id)
 
-    ActivityLog.objects.create(user=request.user, action='modify', document=document)
+    eventlog.log_activity(request.user, 'modify', document)
 
-    messages.success(request, f"Restored to version {version.version_number} (saved as version {version_number}).")
+    messages.success(request, f"Restored to version {version.version_number} (saved as version {restored.version_number}).")
     return redirect('document_versions', doc_id=document.id)
 
+def _verify_file(path, hash_obj, manifest):
+    """``(intact, damaged ranges, size)`` of the file at ``path``."""
+    size = compression.content_size(path)
+    with metrics.timer('integrity_check', size):
+        if manifest:
+            # Chunks are hashed in parallel and any mismatch maps to byte ranges.
+            damaged_ranges = integrity.verify_chunks(path, manifest)
+            return not damaged_ranges, damaged_ranges, size
+        return hash_obj.compute(path) == hash_obj.hash_value, [], size
+
 @login_required
-def check_file_integrity(request, doc_id):
-    doc = get_object_or_404(Document, id=doc_id, uploaded_by=request.user)
+async def check_file_integrity(request, doc_id):
+    user = await request.auser()
+    doc = await aget_object_or_404(Document, id=doc_id, uploaded_by=user)
     try:
-        hash_obj = FileHash.objects.get(document=doc)
-        current_hash = FileHash.generate_sha256(doc.file.path)
-
-        if current_hash == hash_obj.hash_value:
-            result = 'intact'
-            messages.success(request, "✅ File is intact.")
-        else:
-            result = 'tampered'
-            messages.warning(request, "⚠️ File has been modified or corrupted!")
-
-        # 🔐 Log the check
-        IntegrityCheckLog.objects.create(document=doc, checked_by=request.user, result=result)
-
+        hash_obj = await FileHash.objects.aget(document=doc)
     except FileHash.DoesNotExist:
         messages.warning(request, "No hash found for this file.")
+        return redirect('my_files')
+    manifest = await ChunkManifest.objects.filter(document=doc).afirst()
+    # Re-hashing a large file runs in aio.py's pool, off the event loop.
+    is_intact, damaged_ranges, size = await aio.run(_verify_file, doc.file.path, hash_obj, manifest)
+
+    if is_intact:
+        result = 'intact'
+        messages.success(request, "✅ File is intact.")
+        # Lets the bulk scan skip this file until it changes on disk.
+        hash_obj.file_size = size
+        await hash_obj.asave()
+    else:
+        result = 'tampered'
+        if damaged_ranges:
+            ranges = ", ".join(f"{start}–{end}" for start, end in damaged_ranges)
+            messages.warning(request, f"⚠️ File has been modified or corrupted! Changed bytes: {ranges}")
+        else:
+            messages.warning(request, "⚠️ File has been modified or corrupted!")
 
+    # 🔐 Log the check
+    await IntegrityCheckLog.objects.acreate(
+        document=doc, checked_by=user, result=result, damaged_ranges=damaged_ranges
+    )
     return redirect('my_files')
 
 @login_required
 def shared_documents(request):
-    files = Document.objects.filter(is_shared=True, is_deleted=False).exclude(uploaded_by=request.user)
-    return render(request, 'documents/shared_docs.html', {'files': files})
+    page = listcache.shared_page(request)
+    return render(request, 'documents/shared_docs.html', {'files': page, 'page': page})
 
 @login_required
 def access_log(request, doc_id):
     doc = get_object_or_404(Document, id=doc_id, uploaded_by=request.user)
-    logs = UsageStat.objects.filter(document=doc).order_by('-accessed_at')
-    return render(request, 'documents/access_log.html', {'document': doc, 'logs': logs})
+    logs = UsageStat.objects.filter(document=doc).select_related('accessed_by')
+    page = paginate(logs, 'accessed_at', descending=True, cursor=request.GET.get('cursor'))
+    return render(request, 'documents/access_log.html', {'document': doc, 'logs': page, 'page': page})
 
 
 @login_required
@@ -365,18 +586,35 @@ def integrity_history(request, doc_id):
 def toggle_share(request, doc_id):
     doc = get_object_or_404(Document, id=doc_id, uploaded_by=request.user)
     doc.is_shared = not doc.is_shared
-    doc.save()
+    doc.save(update_fields=['is_shared'])
 
     status = "shared" if doc.is_shared else "unshared"
     messages.success(request, f"File is now {status}.")
     return redirect('my_files')
 
+@login_required
+@require_safe
+def cache_stats(request):
+    # Hit/miss counts of the listing cache in this process (see listcache.py).
+    if not request.user.is_staff:
+        raise Http404
+    return JsonResponse({'listings': listcache.stats()})
+
+@require_safe
+def metrics_view(request):
+    # Staff, or a scraper presenting DMS_METRICS_TOKEN as a bearer token.
+    token = getattr(settings, 'DMS_METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+    if not (token and secrets.compare_digest(authorization.encode(), f'Bearer {token}'.encode())) and not request.user.is_staff:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 
 
 
 # --- Logout View ---
 def logout_user(request):
-    ActivityLog.objects.create(user=request.user, action='logout')
+    eventlog.log_activity(request.user, 'logout')
     logout(request)
     return redirect('login')